@@ -1,15 +1,66 @@
 #!/usr/bin/env python
-import argparse
+import array
+import atexit
+import bisect
 import collections
 import ConfigParser
-import gdata.auth
-import gdata.spreadsheet
-import gdata.spreadsheet.service
+import contextlib
+import cStringIO
+import csv
+import difflib
+import hashlib
+import httplib
+import importlib
+import itertools
+import json
 import logging
+import marshal
+import multiprocessing.pool
 import os
+import random
 import re
+import socket
+import threading
 import time
+import weakref
+import xml.etree.cElementTree
 import xml.sax.saxutils
+import zlib
+
+class LazyModule(object):
+    """
+    A stand-in for a module that is imported along with the given 
+    submodules on first attribute access, so that importing this module 
+    doesn't pay for loading gdata until the first API call. 
+    """
+    def __init__(self, name, *submodules):
+        self._name = name
+        self._submodules = submodules
+        self._module = None
+
+    def __getattr__(self, attr):
+        if (self._module == None):
+            for name in self._submodules: importlib.import_module(name)
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+gdata = LazyModule('gdata', 'gdata.service', 'gdata.spreadsheet', 
+                   'gdata.spreadsheet.service')
+atom = LazyModule('atom')
+
+def import_module(*names):
+    """
+    Returns the first of the named modules that can be imported, or None. 
+    This is for the optional dependencies: asyncio (or trollius) and 
+    concurrent.futures for the async interface, and numpy and pandas for 
+    to_numpy and to_dataframe. 
+    """
+    for name in names:
+        try:
+            return importlib.import_module(name)
+        except ImportError:
+            pass
+    return None
 
 """
 Module for interacting with Google Docs spreadsheets.  This has an 
@@ -37,7 +88,58 @@ email = ''
 password = ''
 source = 'gdata_array-v1'
 num_tries = 5
+# Number of logged-in service clients shared by threads, and how long 
+# a client may sit idle before its login is checked on checkout.
+service_pool_size = 8
+service_max_idle_seconds = 300
+# Optional function returning a new logged-in SpreadsheetsService-like 
+# client, used instead of ClientLogin with email/password/source.
+service_factory = None
+# Optional file where ClientLogin tokens are kept by email and source, 
+# so that new processes can skip logging in, and how long a saved token 
+# is trusted.  The file is created readable only by its owner.
+token_cache_file = None
+token_max_age_seconds = 24 * 3600
+# Retries back off exponentially from retry_wait_time_seconds, with 
+# jitter, up to retry_max_wait_seconds.
 retry_wait_time_seconds = 2
+retry_max_wait_seconds = 60
+# Optional process-wide limit on API requests per second, such as 10, 
+# with bursts of up to rate_limit_burst.  The rate is halved (down to 
+# rate_limit_min) when the server throttles us and creeps back up on 
+# success.  None, the default, sends requests unthrottled.
+rate_limit_per_second = None
+rate_limit_burst = 10
+rate_limit_min = 0.5
+# Default number of rows fetched per request when loading on demand
+page_rows = 500
+# Maximum number of cell updates sent in a single batch request
+batch_size = 500
+# Read cells feeds with parse_cells_feed, straight from the XML into 
+# the cell store, rather than through gdata objects.
+fast_cells_feed = False
+# Number of rows the exporters collect before each write to the file
+export_buffer_rows = 1000
+# Directory for the on-disk feed cache, or None to disable it, and 
+# the limits on its total size and on the age of its entries.
+cache_dir = None
+cache_max_bytes = 100 * 1024 * 1024
+cache_max_age_seconds = 7 * 24 * 3600
+# Worksheets feeds are shared in memory for this many seconds, for up 
+# to this many spreadsheets.  A TTL of 0 turns this off.
+metadata_ttl_seconds = 60
+metadata_cache_size = 100
+# Default number of worksheets loaded in parallel by prefetch
+prefetch_workers = 8
+# Number of threads running blocking calls for the async interface
+async_workers = 8
+# How long the write-behind flusher waits after a cell write before 
+# sending, so that writes in quick succession go out together.
+write_behind_delay_seconds = 0.5
+# Collect the API call metrics returned by stats().  Functions added 
+# with add_metrics_hook are called after each call even when this is 
+# off; with neither, calls are not measured at all.
+metrics_enabled = False
 # Identify key within a Google Doc spreadsheet public URL, like 
 # https://docs.google.com/a/spreadsheet/ccc?key=(<key>)&pli=1#gid=0
 gdata_key_pattern = re.compile('https?://.*key=(\w+)', re.I)
@@ -55,6 +157,35 @@ blank_coltags = ('_cn6ca', '_cokwr', '_cpzh4', '_cre1l', '_chk2m',
 
 # The following are private module variables
 _spreadsheet_service = None
+_service_pool = None
+_service_pool_lock = threading.Lock()
+_rate_limiter = None
+_async_executor = None
+# HTTP statuses worth retrying, and those meaning we were throttled
+_retry_statuses = (408, 429, 500, 502, 503, 504)
+_throttle_statuses = (429, 503)
+# Requests that must not be repeated unless the server refused them
+_non_idempotent_methods = ('AddWorksheet', 'DeleteRow', 'InsertRow')
+_feed_cache = None
+_token_cache = None
+_metadata_cache = None
+_metrics = None
+_metrics_hooks = []
+# Worksheets in write-behind mode, drained at exit
+_write_behind_worksheets = set()
+_write_behind_lock = threading.Lock()
+# Positions of the wksht_id argument of API calls, for metrics
+_wksht_id_args = {'GetWorksheetsFeed': 1, 'GetCellsFeed': 1, 
+                  'GetListFeed': 1, 'UpdateCell': 4, 'InsertRow': 2}
+# Worksheet ID in a cells, list or worksheet entry URL
+_feed_url_pattern = re.compile(
+    r'/feeds/(?:cells|list)/[^/]+/([^/]+)/|/worksheets/[^/]+/private/full/([^/]+)')
+_nan = float('nan')
+# Element names in cells feeds, for parse_cells_feed
+_atom_entry = '{http://www.w3.org/2005/Atom}entry'
+_atom_updated = '{http://www.w3.org/2005/Atom}updated'
+_gs_cell = '{http://schemas.google.com/spreadsheets/2006}cell'
+_gd_etag = '{http://schemas.google.com/g/2005}etag'
 
 def read_config_file():
     global email, password, source
@@ -69,85 +200,639 @@ def read_config_file():
         logging.warn("Error reading config file %s" % fullpath)
         raise e
 
+def new_spreadsheet_service():
+    """
+    Returns a new logged-in service client. 
+    """
+    if (service_factory):
+        return service_factory()
+    svc = gdata.spreadsheet.service.SpreadsheetsService()
+    svc.email = email
+    svc.password = password
+    svc.source = source
+    cache = token_cache()
+    entry = cache and cache.get_entry(email, source)
+    if (entry):
+        svc.SetClientLoginToken(entry[0])
+        svc.login_time = entry[1]
+    else:
+        login(svc)
+    return svc
+
+def login(svc):
+    """
+    Logs a service client in with ClientLogin, saving the new token in 
+    the token cache if there is one.  The client's login_time is when 
+    its token was issued.
+    """
+    svc.ProgrammaticLogin()
+    svc.login_time = time.time()
+    cache = token_cache()
+    if (cache):
+        cache.put(svc.email, svc.source, svc.GetClientLoginToken())
+
 def spreadsheet_service():
+    """
+    Returns a single logged-in service client.  This is not safe to 
+    share between threads; the API wrapper functions below use the 
+    service_pool() instead.
+    """
     global _spreadsheet_service
     if ( (not _spreadsheet_service) or 
          (_spreadsheet_service.email != email) or
          (_spreadsheet_service.password != password) or
          (_spreadsheet_service.source != source) ):
-        read_config_file()
-        _spreadsheet_service = gdata.spreadsheet.service.SpreadsheetsService()
-        _spreadsheet_service.email = email
-        _spreadsheet_service.password = password
-        _spreadsheet_service.source = source
-        _spreadsheet_service.ProgrammaticLogin()
+        if (not service_factory): read_config_file()
+        _spreadsheet_service = new_spreadsheet_service()
     return _spreadsheet_service
 
+def service_pool():
+    """
+    Returns the ServicePool of logged-in clients for the current 
+    email, password, source and service_factory.
+    """
+    global _service_pool
+    with _service_pool_lock:
+        if ( (not _service_pool) or 
+             (_service_pool.credentials != get_credentials()) ):
+            if (not service_factory): read_config_file()
+            _service_pool = ServicePool(service_pool_size, 
+                                        new_spreadsheet_service)
+            _service_pool.credentials = get_credentials()
+    return _service_pool
+
+def get_credentials():
+    return (email, password, source, service_factory)
+
+def is_auth_error(e):
+    """
+    True for a gdata RequestError caused by a missing or expired login.
+    """
+    if (not (e.args and isinstance(e.args[0], dict))): return False
+    status = e.args[0].get('status')
+    body = '%s' % e.args[0].get('body')
+    return (status == 401 or (status == 403 and 'Token' in body))
+
+def rate_limiter():
+    """
+    Returns the process-wide RateLimiter, or None if there is no limit. 
+    """
+    global _rate_limiter
+    if (not rate_limit_per_second): 
+        return None
+    with _service_pool_lock:
+        if ( (not _rate_limiter) or 
+             (_rate_limiter.max_rate != rate_limit_per_second) or
+             (_rate_limiter.burst != rate_limit_burst) ):
+            _rate_limiter = RateLimiter(rate_limit_per_second, 
+                                        rate_limit_burst)
+    return _rate_limiter
+
+def get_status(e):
+    """
+    Returns the HTTP status of a gdata RequestError, or None. 
+    """
+    if (isinstance(e, gdata.service.RequestError) and e.args and 
+        isinstance(e.args[0], dict)):
+        return e.args[0].get('status')
+    return None
+
+def is_retryable(e, method_name=None):
+    """
+    True if a failed request may succeed when sent again.  Requests 
+    that are not idempotent are only retried when throttled, since 
+    otherwise they may have taken effect.
+    """
+    status = get_status(e)
+    if (method_name in _non_idempotent_methods):
+        return (status in _throttle_statuses)
+    if (status != None):
+        return (status in _retry_statuses)
+    return isinstance(e, (socket.error, httplib.HTTPException))
+
+def get_retry_delay(attempt):
+    """
+    Exponential backoff with jitter for the given attempt number.
+    """
+    delay = min(retry_wait_time_seconds * 2**(attempt-1), 
+                retry_max_wait_seconds)
+    return delay/2.0 + random.uniform(0, delay/2.0)
+
+def call_service(method_name, *args, **kwargs):
+    """
+    Executes a gdata service request for all of the wrapper functions: 
+    waits for the rate limiter, then retries retryable errors up to 
+    num_tries times with backoff.  The call is measured for stats() 
+    and the metrics hooks, if any.
+    """
+    measure = (metrics_enabled or _metrics_hooks)
+    if (measure): start = time.time()
+    responses = None
+    for attempt in range(1, num_tries+1):
+        limiter = rate_limiter()
+        if (limiter): limiter.acquire()
+        # The HTTP responses of the last attempt, to measure them
+        if (measure): responses = []
+        try:
+            result = call_pooled_service(method_name, args, kwargs, 
+                                         responses)
+        except Exception, e:
+            if (limiter and get_status(e) in _throttle_statuses):
+                limiter.throttle()
+            if (attempt == num_tries or not is_retryable(e, method_name)):
+                if (measure): 
+                    record_call(method_name, args, kwargs, start, attempt, 
+                                error=e, nbytes=get_nbytes(responses))
+                raise e
+            delay = get_retry_delay(attempt)
+            logging.warn(e)
+            logging.warn('Retrying %s in %.1f seconds', method_name, delay)
+            time.sleep(delay)
+        else:
+            if (limiter): limiter.succeed()
+            if (measure): 
+                record_call(method_name, args, kwargs, start, attempt, 
+                            result=result, nbytes=get_nbytes(responses))
+            return result
+
+def get_nbytes(responses):
+    """
+    Returns the bytes read from a list of CountingReaders, or None if 
+    it is empty, when the client made no HTTP requests that could be 
+    measured. 
+    """
+    if (not responses): return None
+    return sum([response.nbytes for response in responses])
+
+class CountingReader(object):
+    """
+    A file to read from, such as an HTTP response, that counts the 
+    bytes read from another.  Other attributes are those of the other. 
+    """
+    def __init__(self, f):
+        self.f = f
+        self.nbytes = 0
+
+    def read(self, *args):
+        data = self.f.read(*args)
+        self.nbytes += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+def record_call(method_name, args, kwargs, start, tries, result=None, 
+                error=None, nbytes=0):
+    """
+    Records a finished API call in the metrics, if enabled, and passes 
+    it to the metrics hooks as a dict with the keys operation, 
+    worksheet (the wksht_id, or None), seconds (including retries), 
+    retries, bytes (the size of the HTTP responses read, or None for 
+    clients whose requests cannot be measured; cf. counting_responses), 
+    cells (entries returned) and error (the exception raised, or None).
+    """
+    seconds = time.time() - start
+    ncells = 0
+    if (isinstance(getattr(result, 'entry', None), list)):
+        ncells = len(result.entry)
+    elif (getattr(result, 'cell', None) != None):
+        ncells = 1
+    call = {'operation': method_name, 
+            'worksheet': get_call_worksheet(method_name, args, kwargs),
+            'seconds': seconds, 
+            'retries': tries - 1, 
+            'bytes': nbytes, 
+            'cells': ncells, 
+            'error': error}
+    if (metrics_enabled): 
+        metrics().record(call)
+    for hook in list(_metrics_hooks):
+        try:
+            hook(call)
+        except Exception, e:
+            logging.warn('Error in metrics hook %s: %s', hook, e)
+
+def get_call_worksheet(method_name, args, kwargs):
+    """
+    Returns the short wksht_id that an API call applies to, or None. 
+    """
+    wksht_id = kwargs.get('wksht_id')
+    i = _wksht_id_args.get(method_name)
+    if (wksht_id == None and i != None and i < len(args)):
+        wksht_id = args[i]
+    if (wksht_id != None):
+        return str(getattr(wksht_id, 'short_id', None) or wksht_id)
+    url = kwargs.get('url') or kwargs.get('uri')
+    for arg in args:
+        if (url): break
+        if (isinstance(arg, basestring)): 
+            url = arg
+        elif (getattr(arg, 'id', None) != None and arg.id.text):
+            url = arg.id.text
+        elif (getattr(arg, 'link', None)):
+            url = arg.link[0].href
+    match = _feed_url_pattern.search(url or '')
+    if (match): 
+        return match.group(1) or match.group(2)
+    return None
+
+def metrics():
+    """
+    Returns the process-wide Metrics.
+    """
+    global _metrics
+    with _service_pool_lock:
+        if (not _metrics):
+            _metrics = Metrics()
+    return _metrics
+
+def stats():
+    """
+    Returns the API call metrics collected while metrics_enabled was 
+    set; cf. Metrics.get_stats.
+    """
+    return metrics().get_stats()
+
+def reset_stats():
+    metrics().reset()
+
+def add_metrics_hook(hook):
+    """
+    Adds a function to be called after every API call with a dict 
+    describing the call; cf. record_call.
+    """
+    _metrics_hooks.append(hook)
+
+def remove_metrics_hook(hook):
+    _metrics_hooks.remove(hook)
+
+def call_pooled_service(method_name, args, kwargs, responses=None):
+    """
+    Calls a method of a service client checked out of the pool for the 
+    duration of the call, logging in again once if the login expired.
+    The HTTP responses of the call are added to the list responses, if 
+    given, as CountingReaders (cf. counting_responses).
+    """
+    with service_pool().service() as svc:
+        with counting_responses(svc, responses):
+            try:
+                return get_client_method(svc, method_name)(*args, **kwargs)
+            except gdata.service.RequestError, e:
+                if (not is_auth_error(e)): raise e
+                logging.info('Logging in again after %s' % e)
+                login(svc)
+                return get_client_method(svc, method_name)(*args, **kwargs)
+
+@contextlib.contextmanager
+def counting_responses(svc, responses):
+    """
+    While in the block, wraps the HTTP responses returned by the 
+    request method of a service client, through which gdata sends all 
+    its API requests, in CountingReaders added to the list responses. 
+    Does nothing if responses is None or the client has no request 
+    method. 
+    """
+    request = getattr(svc, 'request', None)
+    if (responses == None or request == None):
+        yield
+        return
+    def counting_request(*args, **kwargs):
+        response = request(*args, **kwargs)
+        if (not hasattr(response, 'read')): return response
+        response = CountingReader(response)
+        responses.append(response)
+        return response
+    own_request = svc.__dict__.get('request')
+    svc.request = counting_request
+    try:
+        yield
+    finally:
+        if (own_request == None): 
+            del svc.request
+        else:
+            svc.request = own_request
+
+def get_client_method(svc, method_name):
+    """
+    Returns a method of a service client by name.  GetStream, which 
+    gdata's own clients lack, is stream_get for them.
+    """
+    if (method_name == 'GetStream' and not hasattr(svc, 'GetStream')):
+        return lambda *args, **kwargs: stream_get(svc, *args, **kwargs)
+    return getattr(svc, method_name)
+
+def feed_cache():
+    """
+    Returns the FeedCache for cache_dir, or None if it is not set.
+    """
+    global _feed_cache
+    if (not cache_dir): 
+        return None
+    with _service_pool_lock:
+        if ((not _feed_cache) or (_feed_cache.directory != cache_dir)):
+            _feed_cache = FeedCache(cache_dir)
+    return _feed_cache
+
+def token_cache():
+    """
+    Returns the TokenCache for token_cache_file, or None if it is not set.
+    """
+    global _token_cache
+    if (not token_cache_file): 
+        return None
+    with _service_pool_lock:
+        if ((not _token_cache) or (_token_cache.path != token_cache_file)):
+            _token_cache = TokenCache(token_cache_file)
+    return _token_cache
+
+def metadata_cache():
+    """
+    Returns the in-memory MetadataCache of worksheets feeds. 
+    """
+    global _metadata_cache
+    with _service_pool_lock:
+        if (not _metadata_cache):
+            _metadata_cache = MetadataCache()
+    return _metadata_cache
+
+def normalize_key(key):
+    # Strip off a trailing "#gid=0" at the end of an ID
+    # This can come from cut-and-paste from a GDoc URL
+    return re.sub(r'\#gid=\d+$', '', key)
+
+def get_worksheets_feed(key):
+    """
+    Returns the worksheets feed of a spreadsheet, shared through the 
+    metadata cache for metadata_ttl_seconds.
+    """
+    key = normalize_key(key)
+    feed = metadata_cache().get(key)
+    if (feed == None):
+        feed = GetWorksheetsFeed(key)
+        metadata_cache().put(key, feed)
+    return feed
+
 def GetWorksheetsFeed(*args, **kwargs):
     logging.info('GetWorksheetsFeed(%s,%s)', args, kwargs)
-    return spreadsheet_service().GetWorksheetsFeed(*args, **kwargs)
+    if (feed_cache() and len(args) == 1 and not kwargs):
+        return feed_cache().get_worksheets_feed(args[0])
+    return call_service('GetWorksheetsFeed', *args, **kwargs)
 
 def AddWorksheet(*args, **kwargs):
     logging.info('AddWorksheet(%s, %s)', args, kwargs)
-    return spreadsheet_service().AddWorksheet(*args, **kwargs)
+    return call_service('AddWorksheet', *args, **kwargs)
+
+def UpdateWorksheet(*args, **kwargs):
+    logging.info('UpdateWorksheet(%s, %s)', args, kwargs)
+    return call_service('UpdateWorksheet', *args, **kwargs)
 
 def GetCellsFeed(*args, **kwargs):
     logging.info('GetCellsFeed(%s, %s)', args, kwargs)
-    return spreadsheet_service().GetCellsFeed(*args, **kwargs)
+    return call_service('GetCellsFeed', *args, **kwargs)
 
 def GetListFeed(*args, **kwargs):
     logging.info('GetListFeed(%s, %s)', args, kwargs)
-    return spreadsheet_service().GetListFeed(*args, **kwargs)
+    return call_service('GetListFeed', *args, **kwargs)
 
 def UpdateCell(*args, **kwargs):
     logging.info('UpdateCell(%s, %s)', args, kwargs)
-    for i in range(1,num_tries+1):
-        try:
-            return spreadsheet_service().UpdateCell(*args, **kwargs)
-        except Exception, e:
-            if (i < num_tries):
-                logging.warn(e)
-                logging.warn('Retrying UpdateCell')
-                time.sleep(retry_wait_time_seconds)
-            else:
-                raise e
+    return call_service('UpdateCell', *args, **kwargs)
+
+def ExecuteBatch(batch_feed, *args, **kwargs):
+    logging.info('ExecuteBatch(<%d entries>, %s, %s)', 
+                 len(batch_feed.entry), args, kwargs)
+    return call_service('ExecuteBatch', batch_feed, *args, **kwargs)
+
+def ConditionalGet(uri, converter, etag=None):
+    """
+    Gets a feed unless it still matches the given ETag, in which case 
+    this returns None. 
+    """
+    logging.info('ConditionalGet(%s, etag=%s)', uri, etag)
+    headers = {'GData-Version': '3.0'}
+    if (etag): 
+        headers['If-None-Match'] = etag
+    try:
+        return call_service('Get', uri, extra_headers=headers, 
+                            converter=converter)
+    except gdata.service.RequestError, e:
+        if (etag and e.args and isinstance(e.args[0], dict) and 
+            e.args[0].get('status') == 304):
+            return None
+        raise e
+
+def GetCellsValues(uri):
+    """
+    Gets a cells feed, parsed by parse_cells_feed as the response is 
+    read (cf. stream_get). 
+    """
+    logging.info('GetCellsValues(%s)', uri)
+    return call_service('GetStream', uri, 
+                        extra_headers={'GData-Version': '3.0'},
+                        parser=parse_cells_feed)
+
+def stream_get(svc, uri, extra_headers=None, parser=None, 
+               redirects_remaining=4):
+    """
+    Gets a feed with a service client as GDataService.Get does, but 
+    passes the response to parser as a file to read from, rather than 
+    reading it into a string first.  This is GetStream for clients 
+    without a GetStream method of their own. 
+    """
+    response = svc.request('GET', uri, headers=extra_headers or {})
+    if (response.status == 200):
+        return parser(response)
+    body = response.read()
+    if (response.status == 302 and redirects_remaining > 0):
+        location = (response.getheader('Location') or 
+                    response.getheader('location'))
+        if (location != None):
+            return stream_get(svc, location, extra_headers, parser, 
+                              redirects_remaining - 1)
+    raise gdata.service.RequestError({'status': response.status, 
+                                      'reason': response.reason, 
+                                      'body': body})
+
+def DeleteRow(*args, **kwargs):
+    logging.info('DeleteRow(%s, %s)', args, kwargs)
+    return call_service('DeleteRow', *args, **kwargs)
 
 def InsertRow(*args, **kwargs):
     logging.info('InsertRow(%s, %s)', args, kwargs)
-    return spreadsheet_service().InsertRow(*args, **kwargs)
+    return call_service('InsertRow', *args, **kwargs)
+
+def worksheets_feed_url(key):
+    return ('https://spreadsheets.google.com/feeds/worksheets/%s/private/full'
+            % key)
+
+def cells_feed_url(key, wksht_id):
+    """
+    Returns the URL of the cells feed for a worksheet.  Cell entry IDs 
+    and the batch endpoint are both built from this URL.
+    """
+    return ('https://spreadsheets.google.com/feeds/cells/%s/%s/private/full'
+            % (key, wksht_id))
+
+def cell_values(entries):
+    """
+    Yields (row, col, text, inputValue, numericValue) for each entry 
+    of a cells feed. 
+    """
+    for entry in entries:
+        cell = entry.cell
+        yield (int(cell.row), int(cell.col), cell.text, 
+               cell.inputValue, cell.numericValue)
+
+def parse_cells_feed(source):
+    """
+    Parses the XML of a cells feed, from a file or a string, returning 
+    the feed, without entries, and the list of its cell values as given 
+    by cell_values.  Only the gs:cell elements of the entries are read, 
+    with iterparse, and each entry is removed from the tree as soon as 
+    it is read, so no gdata objects are built for the cells and memory 
+    does not grow with the feed.  Texts are UTF-8 encoded, as by gdata. 
+    """
+    if (isinstance(source, basestring)): 
+        source = cStringIO.StringIO(source)
+    values = []
+    # The first event is the start of the feed element, which is kept to
+    # remove the entries from; other start events are skipped.
+    events = iter(xml.etree.cElementTree.iterparse(
+        source, events=('start', 'end')))
+    event, root = events.next()
+    for event, elem in events:
+        if (event == 'start'): continue
+        tag = elem.tag
+        if (tag == _gs_cell):
+            text = elem.text
+            input_value = elem.get('inputValue')
+            if (isinstance(text, unicode)): text = text.encode('utf-8')
+            if (isinstance(input_value, unicode)): 
+                input_value = input_value.encode('utf-8')
+            values.append( (int(elem.get('row')), int(elem.get('col')), 
+                            text, input_value, elem.get('numericValue')) )
+        elif (tag == _atom_entry):
+            root.remove(elem)
+    feed = gdata.spreadsheet.SpreadsheetsCellsFeed()
+    updated = root.find(_atom_updated)
+    if (updated != None): 
+        feed.updated = atom.Updated(text=updated.text)
+    if (root.get(_gd_etag) != None):
+        feed.extension_attributes['{%s}etag' % gdata.GDATA_NAMESPACE] = \
+            root.get(_gd_etag)
+    return (feed, values)
+
+def make_header_map(headers):
+    """
+    Returns a dict from each header name to its column index, counting 
+    from 0.  For repeated names, the first column is used. 
+    """
+    header_map = {}
+    for i,name in enumerate(headers or []):
+        if (name != None and name not in header_map): 
+            header_map[name] = i
+    return header_map
+
+def get_export_name(headers, icol):
+    """
+    Returns the name of a column in exported data: its header, or 
+    'col' and the column number for a blank header or a column past 
+    the headers.
+    """
+    if (icol < len(headers) and headers[icol]): 
+        return headers[icol]
+    return 'col%d' % (icol+1)
 
-def spreadsheet(key):
+def spreadsheet(key, titles=None, prefetch=False, max_workers=None):
     """
     Returns a Spreadsheet object that acts as a list of worksheet objects.
+    With prefetch=True, the worksheets are loaded in parallel, and any 
+    errors are kept by title in the errors attribute.
     """
-    ss = Spreadsheet()
-    ss.extend( worksheets(key) )
+    ss = Spreadsheet(key, titles=titles)
+    if (prefetch): 
+        ss.prefetch(max_workers)
     return ss
 
-def worksheets(key, titles=None):
+def worksheets(key, titles=None, prefetch=False, max_workers=None):
     """
     This returns a simplified list-like object that includes 
     simple key, wksht_id, and title fields - and accesses rows 
     as list items. 
 
     The optional key "titles" returns only those worksheets with 
-    titles in that set.  
+    titles in that set.  With prefetch=True, the worksheets are loaded 
+    in parallel, max_workers at a time; see load_worksheets.  The 
+    worksheets that failed to load are left unloaded, with their 
+    exceptions in the errors map of the returned WorksheetList. 
     """
-    # Strip off a trailing "#gid=0" at the end of an ID
-    # This can come from cut-and-paste from a GDoc URL
-    key = re.sub(r'\#gid=\d+$', '', key)
-    feed = GetWorksheetsFeed(key)
-    wslist = []
+    key = normalize_key(key)
+    wslist = feed_worksheets(key, get_worksheets_feed(key), titles)
+    if (prefetch): 
+        wslist.prefetch(max_workers)
+    return wslist
+
+def feed_worksheets(key, feed, titles=None):
+    """
+    Returns a WorksheetList of the worksheets in a worksheets feed, or 
+    only of those with titles in titles. 
+    """
+    wslist = WorksheetList()
     for wsdata in feed.entry:
         ws = Worksheet(key, wsdata, feed)
         if ((titles==None) or (ws.title in titles)): wslist.append(ws)
     return wslist
 
-def worksheet(key, num=None, wksht_id=None, title=None, nheaders=None):
+def thread_map(func, items, max_workers):
+    """
+    Calls func on each item on a pool of at most max_workers threads, 
+    and returns a (result, exception) pair for each item, in order.
+    """
+    def call(item):
+        try:
+            return (func(item), None)
+        except Exception, e:
+            return (None, e)
+    nthreads = max(min(max_workers, len(items)), 1)
+    pool = multiprocessing.pool.ThreadPool(nthreads)
+    try:
+        return pool.map(call, items)
+    finally:
+        pool.close()
+        pool.join()
+
+def load_worksheets(wslist, max_workers=None):
+    """
+    Loads the data of several worksheets in parallel on a pool of at 
+    most max_workers (default prefetch_workers) threads.  A worksheet 
+    that fails to load is left unloaded, so it is tried again when 
+    used.  Returns a map of worksheet title to exception for those.
+    """
+    todo = [ws for ws in wslist if not ws.has_data()]
+    if (not todo): return {}
+    results = thread_map(lambda ws: ws.load_data(), todo, 
+                         max_workers or prefetch_workers)
+    errors = {}
+    for ws,(res, e) in zip(todo, results):
+        if (e != None):
+            logging.warn('Error loading worksheet "%s": %s' % (ws.title, e))
+            errors[ws.title] = e
+    return errors
+
+def worksheet(key, num=None, wksht_id=None, title=None, nheaders=None,
+              rows=None, cols=None, page_rows=None):
     """
     Return a single worksheet object from the spreadsheet at key, 
     specifying wksht_id or title or both. 
     Raises an exception if there are multiple or zero matches found.
+
+    The optional rows and cols slices limit what is loaded: rows 
+    selects the data rows (indexed like the worksheet itself, so 
+    rows=slice(-50, None) is the last 50 rows with data) loaded up 
+    front, and cols restricts loading to those columns.  Other rows 
+    are loaded page_rows at a time on first access.  Only a rows slice 
+    counted from the end, or with no stop, makes the end of the sheet 
+    be looked up before any rows are read.
     """
     if ((num != None) and (num <= 0)): 
         raise ValueError('Invalid num argument (should be 1,2,...): %s' % num)
@@ -155,9 +840,7 @@ def worksheet(key, num=None, wksht_id=None, title=None, nheaders=None):
     wslist = worksheets(key)
     if (wksht_id==None and title==None and num==None):
         if (len(wslist) == 1):
-            if (nheaders != None): 
-                wslist[0].nheaders = nheaders
-            return wslist[0]
+            ws = wslist[0]
         else:
             raise ValueError("Must specify wksht_id or title")
     else:
@@ -170,18 +853,55 @@ def worksheet(key, num=None, wksht_id=None, title=None, nheaders=None):
             if (num and num != (i+1)): continue
             filtered.append(ws)
         if (len(filtered) == 1):
-            if (nheaders != None): 
-                filtered[0].nheaders = nheaders
-            return filtered[0]
+            ws = filtered[0]
         else:
             raise ValueError('%d worksheets matching num=%s wksht_id=%s title="%s"\ntitles=%s' % (len(filtered), num, wksht_id, title, titles))
+    if (nheaders != None): 
+        ws.nheaders = nheaders
+    ws.row_range = rows
+    ws.col_range = cols
+    ws.page_rows = page_rows
+    return ws
+
+def aworksheet(key, loop=None, **kwargs):
+    """
+    Returns a future for an AsyncWorksheet, taking the same arguments as 
+    worksheet().  In a coroutine:
+
+    ws = await gdata_array.aworksheet(key, title='worksheet 1')
+    await ws.load()
+    """
+    def open_worksheet():
+        return AsyncWorksheet(worksheet(key, **kwargs), loop=loop)
+    return run_async(open_worksheet, loop=loop)
+
+def run_async(func, *args, **kwargs):
+    """
+    Runs a blocking function on the shared pool of async_workers threads 
+    and returns an asyncio future for its result.  The event loop may be 
+    given as the keyword argument loop.
+    """
+    global _async_executor
+    asyncio = import_module('asyncio', 'trollius')
+    futures = import_module('concurrent.futures')
+    if (asyncio == None or futures == None):
+        raise ImportError('The async interface needs asyncio (or trollius) '
+                          'and concurrent.futures (or futures)')
+    loop = kwargs.pop('loop', None) or asyncio.get_event_loop()
+    with _service_pool_lock:
+        if (not _async_executor):
+            _async_executor = futures.ThreadPoolExecutor(
+                async_workers)
+    return loop.run_in_executor(_async_executor, func, *args)
 
 def add_worksheet(key, title, rows=10, cols=10, nheaders=1):
     """
     Adds a worksheet to the specified spreadsheet, and returns an 
     worksheet array object.  
     """
+    key = normalize_key(key)
     wsdata = AddWorksheet(title, rows, cols, key)
+    metadata_cache().invalidate(key)
     ws = Worksheet(key, wsdata, nheaders=nheaders)
     return ws
 
@@ -189,10 +909,7 @@ def wksht_ids(key, titles=None):
     """
     Returns the list of short wksht_id strings in a given spreadsheet.
     """
-    # Strip off a trailing "#gid=0" at the end of an ID
-    # This can come from cut-and-paste from a GDoc URL
-    key = re.sub(r'\#gid=\d+$', '', key)
-    feed = GetWorksheetsFeed(key)
+    feed = get_worksheets_feed(key)
     ids = []
     for ws in feed.entry:
         if ((titles != None) and (ws.title.text not in titles)):
@@ -224,177 +941,559 @@ def wksht_id(key, title=None):
         else:
             raise ValueError('No matching wksht_id found')
 
-def create_worksheet(key, array):
-    """
-    This takes a large array and creates a new worksheet in one pass 
-    by using the CSV import feature.  
-    """
-    svc.SetOAuthInputParameters(gdata.auth.OAuthSignatureMethod.HMAC_SHA1, 'anonymous', 'anonymous')
-    token = svc.FetchOAuthRequestToken()
-    raise NotImplementedError()
-
-    # POST /a/spreadsheet/info/tc?id=tmvEpRQK3raevlL3yqqj0QQ.15810189397340970591.3707098243111392783&tfe=ih_598&gsessionid=XH1O2GlKpaA HTTP/1.1
-    # returns plain text FpdJbD4BAAA.WqfYrYosmUVrBck0flAEdA.dwAu6ipjOvhzd5LbONd4wA
-    #
-    # Below is a sample captured HTTP for creating a new worksheet:
-    # The spreadsheet has the following key:
-    # 0AqcMI7sDzBmudG12RXBSUUszcmFldmxMM3lxcWowUVE#gid=2
-    #
-    # POST /a/spreadsheet/convert/import?id=tmvEpRQK3raevlL3yqqj0QQ.15810189397340970591.3707098243111392783&tfe=ih_598&gsessionid=XH1O2GlKpaA&c=0&r=0&agi=0&dst=NEW_SHEET&del&token=FpdJbD4BAAA.WqfYrYosmUVrBck0flAEdA.dwAu6ipjOvhzd5LbONd4wA HTTP/1.1
-    # POST Data
-    # Content-Disposition: form-data; name="file"; filename="sample_data.csv"
-    # Content-Type: text/csv
-
-    # token.oauth_input_params = client._oauth_input_params 
-    #         client.SetOAuthInputParameters(
-    #gdata.auth.OAuthSignatureMethod.HMAC_SHA1,
-    #        GDATA_CREDS['key'],
-    #        consumer_secret=GDATA_CREDS['secret'],
-    #    )
-    #    client.SetOAuthTok
-
-######################################################################
-class WorksheetID(str):
+def create_worksheet(key, array, title=None, nheaders=1, max_workers=None):
     """
-    This is a class for the short-form ID for a Google Doc worksheet.
-    It takes either a long URL-form ID or a short form.
+    Creates a new worksheet holding a two-dimensional array of values, 
+    the first nheaders rows being headers, and returns it.  The sheet 
+    is created at the size of the array in a single request, and the 
+    cells are then written in batch requests, by up to max_workers 
+    threads at once.  The worksheet returned is filled from the array 
+    rather than read back.  The title defaults to "Sheet" and the 
+    lowest number not already taken by a worksheet title.
+    """
+    key = normalize_key(key)
+    array = [list(vals) for vals in array]
+    if (title == None):
+        titles = set([entry.title.text 
+                      for entry in get_worksheets_feed(key).entry])
+        num = 1
+        while ('Sheet%d' % num in titles): num += 1
+        title = 'Sheet%d' % num
+    nrows = max(len(array), nheaders, 1)
+    ncols = max([len(vals) for vals in array] + [1])
+    ws = add_worksheet(key, title, rows=nrows, cols=ncols, nheaders=nheaders)
+    ws.upload(array, max_workers=max_workers)
+    return ws
 
-    TODO: add in more validation
+def close_write_behind():
     """
-    def __new__(cls, full_id=None, short_id=None):
-        if (full_id and not short_id):
-            gdata_id_match = gdata_id_pattern.match(full_id)
-            if (gdata_id_match):
-                short_id = gdata_id_match.group(1)
-            else:
-                raise ValueError('Could not parse full worksheet ID "%s"' % full_id)
-        elif (full_id and short_id):
-            raise ValueError('Cannot specify both full and short worksheet IDs')
-        obj = super(WorksheetID, cls).__new__(cls, short_id)
-        obj.full_id = full_id
-        obj.short_id = short_id
-        return obj
+    Sends the queued cell updates of every worksheet in write-behind 
+    mode and stops their flusher threads.  This runs at exit.
+    """
+    with _write_behind_lock:
+        wslist = list(_write_behind_worksheets)
+    for ws in wslist:
+        try:
+            ws.close()
+        except Exception, e:
+            logging.error('Lost queued updates to worksheet "%s": %s' 
+                          % (ws.title, e))
+
+atexit.register(close_write_behind)
 
 ######################################################################
-class Spreadsheet(list):
+class BatchError(Exception):
     """
-    This acts as a list of Worksheet objects. 
+    Raised when some of the cell updates in a batch request fail.  The 
+    failures attribute lists (row, col, code, reason) for each failed 
+    cell; all other cells in the batch were written.  If a later batch 
+    request failed as a whole, error is its exception, and its cells 
+    were not written; otherwise error is None.
     """
-    def __init__(self, gdata_ws_feed):
-        self.title = None
-        raise NotImplementedError()
+    def __init__(self, failures, error=None):
+        self.failures = failures
+        self.error = error
+        msg = '%d cell updates failed: %s' % (
+            len(failures), 
+            ', '.join(['R%dC%d (%s %s)' % f for f in failures[:10]]))
+        if (error != None):
+            msg += '; then a batch request failed: %s' % error
+        super(BatchError, self).__init__(msg)
 
 ######################################################################
-class Worksheet(object):
+class ServicePool(object):
     """
-    This acts like a list of Row objects.  It loads data through the 
-    Google gdata API only when that data is called on, rather than 
-    upon object creation.  
+    A thread-safe pool of up to size logged-in service clients, created 
+    on demand by factory.  Each thread checks out a client for one call 
+    at a time, so calls from worker threads can run concurrently.
 
-    for row in worksheet:
-        # do whatever with row
+    with pool.service() as svc:
+        svc.GetCellsFeed(key, wksht_id)
+
+    A client that raised anything other than an HTTP error is dropped 
+    rather than reused, and one idle for service_max_idle_seconds logs 
+    in again before it is handed out if its token is missing, of 
+    unknown age, or older than token_max_age_seconds. 
     """
-    def __init__(self, key, gdata_ws, gdata_ws_feed=None, nheaders=1):
-        self.key = key
-        self.data = gdata_ws
-        self._ws_feed = gdata_ws_feed
-        self.nheaders = nheaders
+    def __init__(self, size, factory):
+        self.size = size
+        self.factory = factory
+        self.credentials = None
+        self._idle = []
+        self._nclients = 0
+        self._cond = threading.Condition()
 
-        # If row_count is less than nheaders, error out.
-        if (int(self.data.row_count.text) < nheaders):
-            raise ValueError("Fewer rows than specified headers")
+    def checkout(self):
+        with self._cond:
+            while (not self._idle and self._nclients >= self.size):
+                self._cond.wait()
+            if (self._idle):
+                svc, last_used = self._idle.pop()
+            else:
+                svc, last_used = None, None
+                self._nclients += 1
+        if (svc == None):
+            try:
+                return self.factory()
+            except:
+                self.discard()
+                raise
+        if (time.time() - last_used > service_max_idle_seconds):
+            self.check(svc)
+        return svc
 
-        # A gdata_ws object is required
-        self.wksht_id = wksht_id( gdata_ws.id.text )
-        self.title = gdata_ws.title.text
-        # The internal data representation
-        self._headers = None
-        self._rows = None
-        self._list_feed = None
-        self._cells_feed = None
-        self._max_col = 0
+    def check(self, svc):
+        if (not getattr(svc, 'password', None)): return
+        login_time = getattr(svc, 'login_time', None)
+        if ((not svc.GetClientLoginToken()) or login_time == None or 
+            time.time() - login_time > token_max_age_seconds):
+            logging.info('Logging in again for idle service client')
+            login(svc)
 
-    def get_ws_feed(self):
-        if (not self._ws_feed):
-            self._ws_feed = GetWorksheetsFeed(self.key)
-        return self._ws_feed
-    ws_feed = property(get_ws_feed, None)
+    def checkin(self, svc):
+        with self._cond:
+            # Most recently used clients are reused first.
+            self._idle.append( (svc, time.time()) )
+            self._cond.notify()
 
-    def get_sstitle(self):
-        return self.ws_feed.title.text
-    sstitle = property(get_sstitle, None)
+    def discard(self):
+        with self._cond:
+            self._nclients -= 1
+            self._cond.notify()
 
-    def load_data(self):
-        self.get_cells_feed()
+    @contextlib.contextmanager
+    def service(self):
+        svc = self.checkout()
+        healthy = False
+        try:
+            yield svc
+            healthy = True
+        except gdata.service.RequestError:
+            # The server answered, so the client itself is fine.
+            healthy = True
+            raise
+        finally:
+            if (healthy): self.checkin(svc)
+            else: self.discard()
 
-    def has_data(self): 
-        return (self._cells_feed != None)
+######################################################################
+class Metrics(object):
+    """
+    Thread-safe counters of API calls, kept both by operation and by 
+    worksheet: the numbers of calls, errors and retries, the seconds 
+    taken in total, at most, and as a histogram, and the bytes and 
+    cells returned (bytes only counting the calls measured).
+    """
+    # Upper bounds in seconds of the latency histogram buckets; the 
+    # last bucket counts slower calls.
+    buckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
 
-    def reload(self): 
-        self._cells_feed = None
-        self._list_feed = None
-        self.get_cells_feed()
-        
-    def get_cells_feed(self):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+            self.worksheets = {}
+
+    def new_counts(self):
+        return {'calls': 0, 'errors': 0, 'retries': 0, 'seconds': 0.0, 
+                'max_seconds': 0.0, 'bytes': 0, 'cells': 0, 
+                'histogram': [0] * (len(self.buckets) + 1)}
+
+    def record(self, call):
+        bucket = bisect.bisect_left(self.buckets, call['seconds'])
+        with self.lock:
+            for table,name in ((self.operations, call['operation']), 
+                               (self.worksheets, call['worksheet'])):
+                if (name == None): continue
+                counts = table.get(name)
+                if (counts == None): 
+                    counts = table[name] = self.new_counts()
+                counts['calls'] += 1
+                if (call['error'] != None): counts['errors'] += 1
+                counts['retries'] += call['retries']
+                counts['seconds'] += call['seconds']
+                counts['max_seconds'] = max(counts['max_seconds'], 
+                                            call['seconds'])
+                counts['bytes'] += (call['bytes'] or 0)
+                counts['cells'] += call['cells']
+                counts['histogram'][bucket] += 1
+
+    def get_stats(self):
         """
-        This reads the worksheet data into local memory using the cells 
-        feed.  The List feed is potentially more intuitive, but it stops 
-        reading after a single blank row, so should be avoided.  
+        Returns a copy of the counters as a dict with 'operations' and 
+        'worksheets' maps from name to counts, and the 'buckets' of the 
+        histograms.
         """
-        if (not self._cells_feed):
-            logging.info('Creating feed for worksheet "%s"' % self.title)
-            self._cells_feed = GetCellsFeed(self.key, self.wksht_id.short_id)
-            logging.info('Found %d entries' % len(self._cells_feed.entry))
-            self._rows = []
-            if (self.nheaders > 1): 
-                logging.warn("Only looking at last of multiple header rows")
+        with self.lock:
+            copy = lambda table: dict(
+                (name, dict(counts, histogram=list(counts['histogram'])))
+                for name,counts in table.items())
+            return {'operations': copy(self.operations), 
+                    'worksheets': copy(self.worksheets), 
+                    'buckets': list(self.buckets)}
 
-            self._header_rows = []
-            for cell in self._cells_feed.entry:
-                row = int(cell.cell.row)
-                col = int(cell.cell.col)
-                logging.debug('Adding cell for row %d, col %d' % (row, col))
-                # Allow for multiple header rows, possibly 
-                # including blank rows in them.  
-                if (row <= self.nheaders):
-                    for i in range(len(self._header_rows), row):
-                        self._header_rows.append( Row(self, i+1) )
-                    header_row = self._header_rows[row-1]
-                    new_cell = Cell(self, cell, row=row, col=col)
-                    header_row._set_local(col-1, new_cell)
-                else:
-                    self.init_cell(row, col, cell)
-            # If header rows are blank, ensure they are entered anyway.
-            for i in range(len(self._header_rows), self.nheaders):
-                logging.debug("Adding header row")
-                self._header_rows.append( Row(self, i+1) )
-                
-        return self._cells_feed
+######################################################################
+class RateLimiter(object):
+    """
+    A thread-safe token bucket allowing rate requests per second on 
+    average, in bursts of up to burst.  The rate adapts to the server: 
+    throttle() halves it, and each succeed() raises it by 5% of 
+    max_rate, never beyond max_rate.
+    """
+    def __init__(self, max_rate, burst):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._stamp = time.time()
+        self._lock = threading.Lock()
 
-    def get_list_feed(self):
+    def acquire(self):
         """
-        WARNING: The gdata List Feed is fatally flawed in that it stops
-        returning results after a single blank line.  To retrieve a 
-        correct list feed, the module temporarily puts a single space 
-        character into the first cell of blank rows, gets the list feed, 
-        then removes that whitespace. 
+        Waits until a request may be sent.
         """
-        if (not self._list_feed):
-            if (not self.has_data()): self.load_data()
-            # For the list feed to read correctly, there must be no 
-            # blank rows.  
-            blank_rows = []
-            for row in self.headers+self.rows:
-                if (not row): 
-                    row[0] = ' '
-                    blank_rows.append(row)
-            self._list_feed = GetListFeed(self.key, self.wksht_id)
-            for row in blank_rows:
-                row[0] = None
-        return self._list_feed
-    list_feed = property(get_list_feed, None)
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + 
+                                   (now - self._stamp) * self.rate)
+                self._stamp = now
+                if (self._tokens >= 1):
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
 
-    def get_coltags(self):
+    def succeed(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 0.05*self.max_rate)
+
+    def throttle(self):
+        with self._lock:
+            self.rate = max(rate_limit_min, self.rate / 2.0)
+            self._tokens = min(self._tokens, 0)
+            logging.info('Throttled: request rate now %.2f/s' % self.rate)
+
+######################################################################
+class FeedCache(object):
+    """
+    An on-disk cache of worksheets feeds and worksheet cell values, 
+    one zlib-compressed marshal file per feed, keyed by spreadsheet key 
+    and wksht_id.  Each file keeps the feed ETag and updated timestamp. 
+
+    Cached feeds are revalidated with a conditional request on their 
+    ETag, rather than by the worksheet's updated timestamp, which may 
+    come from the metadata cache and be stale.  Entries older than 
+    cache_max_age_seconds are 
+    dropped, then the least recently used ones while the cache is over 
+    cache_max_bytes.
+    """
+    format_version = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+        if (not os.path.isdir(directory)):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another process may have just created it
+                if (not os.path.isdir(directory)): raise
+
+    def get_path(self, kind, key, wksht_id=None):
+        name = hashlib.sha1('%s|%s|%s' % (kind, key, wksht_id)).hexdigest()
+        return os.path.join(self.directory, name + '.feed')
+
+    def read(self, kind, key, wksht_id=None):
+        """
+        Returns the cached (etag, updated, payload), or None.
+        """
+        path = self.get_path(kind, key, wksht_id)
+        try:
+            f = open(path, 'rb')
+            try:
+                data = marshal.loads(zlib.decompress(f.read()))
+            finally:
+                f.close()
+        except IOError:
+            return None
+        except Exception, e:
+            logging.warn('Ignoring unreadable cache file %s: %s' % (path, e))
+            return None
+        if (data[0] != self.format_version): 
+            return None
+        # Mark the entry as recently used for eviction, unless another 
+        # process evicted it since
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data[1:]
+
+    def write(self, kind, key, wksht_id, etag, updated, payload):
+        path = self.get_path(kind, key, wksht_id)
+        data = (self.format_version, etag, updated, payload)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        f = open(tmp_path, 'wb')
+        try:
+            f.write(zlib.compress(marshal.dumps(data)))
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if (not name.endswith('.feed')): continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if (now - st.st_mtime > cache_max_age_seconds):
+                self.remove(path)
+            else:
+                entries.append( (st.st_mtime, st.st_size, path) )
+        total = sum([size for mtime,size,path in entries])
+        for mtime,size,path in sorted(entries):
+            if (total <= cache_max_bytes): break
+            self.remove(path)
+            total -= size
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if (name.endswith('.feed')): 
+                self.remove(os.path.join(self.directory, name))
+
+    def get_worksheets_feed(self, key):
+        cached = self.read('worksheets', key)
+        feed = ConditionalGet(
+            worksheets_feed_url(key), 
+            gdata.spreadsheet.SpreadsheetsWorksheetsFeedFromString, 
+            etag=cached and cached[0])
+        if (feed == None):
+            logging.info('Using cached worksheets feed for %s' % key)
+            return gdata.spreadsheet.SpreadsheetsWorksheetsFeedFromString(
+                cached[2])
+        self.write('worksheets', key, None, get_etag(feed), 
+                   get_updated(feed), feed.ToString())
+        return feed
+
+    def get_cells_values(self, worksheet):
+        """
+        Returns the cells feed for the worksheet, with its entries 
+        removed, and the list of its cell values as given by cell_values.
+        """
+        key = worksheet.key
+        wksht_id = worksheet.wksht_id.short_id
+        cached = self.read('cells', key, wksht_id)
+        if (fast_cells_feed):
+            converter = parse_cells_feed
+        else:
+            converter = gdata.spreadsheet.SpreadsheetsCellsFeedFromString
+        feed = ConditionalGet(cells_feed_url(key, wksht_id), converter, 
+                              etag=cached and cached[0])
+        if (feed == None):
+            logging.info('Using cached cells for worksheet "%s"' 
+                         % worksheet.title)
+            feed = gdata.spreadsheet.SpreadsheetsCellsFeed()
+            if (cached[1]): feed.updated = atom.Updated(text=cached[1])
+            return (feed, cached[2])
+        if (fast_cells_feed):
+            feed, values = feed
+        else:
+            values = list(cell_values(feed.entry))
+            feed.entry = []
+        self.write('cells', key, wksht_id, get_etag(feed), get_updated(feed), 
+                   values)
+        return (feed, values)
+
+def get_etag(feed):
+    return feed.extension_attributes.get('{%s}etag' % gdata.GDATA_NAMESPACE)
+
+def get_updated(feed):
+    if (feed.updated == None): return None
+    return feed.updated.text
+
+def copy_entry(entry):
+    """
+    Returns a copy of a gdata entry, made through its XML. 
+    """
+    return atom.CreateClassFromXMLString(entry.__class__, entry.ToString())
+
+######################################################################
+class TokenCache(object):
+    """
+    A file of ClientLogin tokens keyed by email and source, so that a 
+    new process can reuse a token instead of logging in.  The file is 
+    only ever written readable by its owner, and is ignored if anyone 
+    else can read it.  Tokens older than token_max_age_seconds are not 
+    used; the server may still reject a younger one, in which case 
+    call_pooled_service logs in again and replaces it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def get_key(self, email, source):
+        return '%s|%s' % (email, source)
+
+    def read(self):
+        """
+        Returns the saved {key: [token, saved time]}, or {}.
+        """
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return {}
+        try:
+            if (os.fstat(f.fileno()).st_mode & 077):
+                logging.warn('Ignoring token cache file %s, which others '
+                             'can read' % self.path)
+                return {}
+            return json.load(f)
+        except ValueError, e:
+            logging.warn('Ignoring unreadable token cache file %s: %s' % 
+                         (self.path, e))
+            return {}
+        finally:
+            f.close()
+
+    def get_entry(self, email, source):
+        """
+        Returns the saved (token, saved time) for email and source if 
+        the token has not expired, otherwise None.
+        """
+        with self._lock:
+            entry = self.read().get(self.get_key(email, source))
+        if ((not entry) or (time.time() - entry[1] > token_max_age_seconds)):
+            return None
+        return (str(entry[0]), entry[1])
+
+    def put(self, email, source, token):
+        """
+        Saves the token for email and source, or removes it if token is 
+        None, dropping any expired tokens. 
+        """
+        now = time.time()
+        with self._lock:
+            tokens = dict([(key, entry) for key,entry in self.read().items()
+                           if (now - entry[1] <= token_max_age_seconds)])
+            key = self.get_key(email, source)
+            if (token):
+                tokens[key] = [token, now]
+            else:
+                tokens.pop(key, None)
+            tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+            fd = os.open(tmp_path, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0600)
+            try:
+                os.fchmod(fd, 0600)
+                os.write(fd, json.dumps(tokens))
+            finally:
+                os.close(fd)
+            os.rename(tmp_path, self.path)
+
+######################################################################
+class MetadataCache(object):
+    """
+    A thread-safe in-memory cache of worksheets feeds by spreadsheet 
+    key, so that looking up several worksheets of a spreadsheet takes a 
+    single request.  Entries expire after metadata_ttl_seconds, and the 
+    least recently used ones are dropped beyond metadata_cache_size.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.pop(key, None)
+            if (item and time.time() - item[0] < metadata_ttl_seconds):
+                self._entries[key] = item
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, feed):
+        if (metadata_ttl_seconds <= 0): return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), feed)
+            while (len(self._entries) > metadata_cache_size):
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """
+        Drops the entry for a spreadsheet key, or all entries.
+        """
+        with self._lock:
+            if (key == None): 
+                self._entries.clear()
+            else:
+                self._entries.pop(normalize_key(key), None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 
+                'size': len(self._entries)}
+
+######################################################################
+class WorksheetID(str):
+    """
+    This is a class for the short-form ID for a Google Doc worksheet.
+    It takes either a long URL-form ID or a short form.
+
+    TODO: add in more validation
+    """
+    def __new__(cls, full_id=None, short_id=None):
+        if (full_id and not short_id):
+            gdata_id_match = gdata_id_pattern.match(full_id)
+            if (gdata_id_match):
+                short_id = gdata_id_match.group(1)
+            else:
+                raise ValueError('Could not parse full worksheet ID "%s"' % full_id)
+        elif (full_id and short_id):
+            raise ValueError('Cannot specify both full and short worksheet IDs')
+        obj = super(WorksheetID, cls).__new__(cls, short_id)
+        obj.full_id = full_id
+        obj.short_id = short_id
+        return obj
+
+######################################################################
+class Schema(object):
+    """
+    The column layout of a worksheet, computed once: the header map, 
+    the coltags used by the list feed, and the header and data row 
+    boundaries.  Worksheet.schema replaces it with a new version after 
+    the header rows are written or more columns come into use, so other 
+    caches can be keyed on the version.
+    """
+    def __init__(self, worksheet, version):
+        self.version = version
+        self.nheaders = worksheet.nheaders
+        self.first_data_row = worksheet.nheaders + 1
+        self.max_col = worksheet._max_col
+        self.header_map = make_header_map(worksheet.headers)
+        if (worksheet.nheaders or len(worksheet.rows)):
+            tag_row = list(worksheet.get_row(1))
+        else:
+            tag_row = []
+        self.coltags = self.make_coltags(tag_row, self.max_col)
+
+    @staticmethod
+    def make_coltags(tag_row, max_col):
         """
         The gdata spreadsheet API creates column keys according to 
         an undocumented algorithm.  Take the first row; convert 
@@ -405,11 +1504,9 @@ class Worksheet(object):
         gdata.spreadsheet.text_db.ConvertStringsToColumnHeaders
         is written to convert column names, but it is *WRONG*.  
         """
-        if (not self.has_data()): self.load_data()
         coltags = []
         count = collections.defaultdict(int)
-        tag_row = self.get_row(1)
-        for i in range(0, max(self.max_col,len(blank_coltags))):
+        for i in range(0, max(max_col,len(blank_coltags))):
             key = None
             if (i < len(tag_row) and tag_row[i]):
                 key = re.sub(r'[^a-zA-Z0-9\-]', '', tag_row[i])
@@ -421,172 +1518,2022 @@ class Worksheet(object):
                 key = blank_coltags[i]
             coltags.append(key)
         return coltags
-    coltags = property(get_coltags, None)
 
-    def coltag_test(self):
-        custom_tags = []
-        if (self.list_feed.entry):
-            coltags = self.coltags
-            missing = []
-            for e in self.list_feed.entry:
-                for key in e.custom.keys():
-                    if (key not in custom_tags):
-                        custom_tags.append(key)
-                    if (key not in coltags+missing):
-                        missing.append(key)
-            if (missing):
-                logging.warn("unrecognized coltags %s" % missing)
-        return custom_tags
+######################################################################
+class WorksheetList(list):
+    """
+    A list of Worksheet objects, as returned by worksheets. 
+    """
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        # Map of title to exception for worksheets that failed to prefetch
+        self.errors = {}
 
-    def get_rows(self):
-        if (not self.has_data()): self.load_data()
-        return self._rows
-    rows = property(get_rows, None)
+    def prefetch(self, max_workers=None):
+        """
+        Loads all worksheets in parallel; cf. load_worksheets.
+        """
+        self.errors = load_worksheets(self, max_workers)
+        return self.errors
+
+######################################################################
+class Spreadsheet(WorksheetList):
+    """
+    This acts as a list of Worksheet objects. 
+    """
+    def __init__(self, key, titles=None):
+        self.key = normalize_key(key)
+        # One feed for both, even if the metadata cache is off
+        feed = get_worksheets_feed(self.key)
+        WorksheetList.__init__(self, feed_worksheets(self.key, feed, titles))
+        self.title = feed.title.text
+
+    def get_titles(self):
+        return [ws.title for ws in self]
+    titles = property(get_titles, None)
+
+    def worksheet(self, title):
+        for ws in self:
+            if (ws.title == title): return ws
+        raise KeyError('No worksheet titled "%s"' % title)
+
+    def __repr__(self):
+        return '<gdata spreadsheet "%s">' % self.title
+
+######################################################################
+class Worksheet(object):
+    """
+    This acts like a list of Row objects.  It loads data through the 
+    Google gdata API only when that data is called on, rather than 
+    upon object creation.  
+
+    for row in worksheet:
+        # do whatever with row
+    """
+    def __init__(self, key, gdata_ws, gdata_ws_feed=None, nheaders=1,
+                 rows=None, cols=None, page_rows=None):
+        self.key = key
+        self.data = gdata_ws
+        self._ws_feed = gdata_ws_feed
+        self.nheaders = nheaders
+        # Optional slices of data rows and columns to load, and the 
+        # page size for loading the remaining rows on demand.
+        self.row_range = rows
+        self.col_range = cols
+        self.page_rows = page_rows
+
+        # If row_count is less than nheaders, error out.
+        if (int(self.data.row_count.text) < nheaders):
+            raise ValueError("Fewer rows than specified headers")
+
+        # A gdata_ws object is required
+        self.wksht_id = wksht_id( gdata_ws.id.text )
+        self.title = gdata_ws.title.text
+        # The internal data representation: cell values are kept in 
+        # a CellStore, and Row/Cell objects are views created from it.
+        self._headers = None
+        self._store = None
+        self._rows = None
+        self._header_rows = None
+        self._schema = None
+        self._schema_version = 0
+        self._list_feed = None
+        self._cells_feed = None
+        self._max_col = 0
+        # Value indexes by column index, as value -> sorted row numbers;
+        # None for an index that must be rebuilt.
+        self._indexes = {}
+        # Cell updates waiting for flush(), as (row, col) -> (val, old)
+        self._pending = collections.OrderedDict()
+        self._batch_depth = 0
+        # The WriteBehind flusher, if on.  Local cell writes and the 
+        # updates from batch responses hold _write_lock, and flushes 
+        # hold _flush_lock, since the flusher runs in its own thread.
+        self._write_behind = None
+        self._write_lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+
+    def get_ws_feed(self):
+        if (not self._ws_feed):
+            self._ws_feed = get_worksheets_feed(self.key)
+        return self._ws_feed
+    ws_feed = property(get_ws_feed, None)
+
+    def get_sstitle(self):
+        return self.ws_feed.title.text
+    sstitle = property(get_sstitle, None)
+
+    def load_data(self):
+        self.get_cells_feed()
+
+    def has_data(self): 
+        return (self._cells_feed != None)
+
+    def reload(self, incremental=False): 
+        """
+        Reads the worksheet data again.  With incremental=True, only the 
+        cells changed since the last load are fetched and patched into 
+        the loaded rows, and this returns the list of changes as 
+        (row, col, old, new) tuples, with None for blank cells. 
+        """
+        if (incremental and self.has_data()):
+            updated_min = get_updated(self._cells_feed)
+            if (updated_min):
+                return self.reload_changes(updated_min)
+            logging.info('No timestamp for incremental reload of "%s"' 
+                         % self.title)
+        self._cells_feed = None
+        self._list_feed = None
+        self.get_cells_feed()
+        
+    def get_cells_feed(self):
+        """
+        This reads the worksheet data into local memory using the cells 
+        feed.  The List feed is potentially more intuitive, but it stops 
+        reading after a single blank row, so should be avoided.  
+
+        If the worksheet is paged (cf. is_paged), only the header rows 
+        and the rows in row_range, or else the first page of rows, are 
+        read here, in one request when the rows start at the first data 
+        row.  The other rows are read a page at a time when first 
+        accessed.  As when all rows are loaded, the data rows end at the 
+        last row with any cell, but on a paged worksheet that row is 
+        only looked for (cf. find_last_row) when the rows are counted or 
+        indexed from the end; until then they end at the last row with 
+        a cell in the pages read (cf. load_next_rows). 
+        """
+        if (not self._cells_feed):
+            logging.info('Creating feed for worksheet "%s"' % self.title)
+            self.reset_data()
+            if (self.nheaders > 1): 
+                logging.warn("Only looking at last of multiple header rows")
+
+            if (not self.is_paged()):
+                if (self.col_range == None and feed_cache()):
+                    self._cells_feed, values = \
+                        feed_cache().get_cells_values(self)
+                else:
+                    self._cells_feed, values = self.read_cells()
+                logging.info('Found %d entries' % len(values))
+                self.add_values(values)
+            else:
+                self._rows.complete = False
+                start, stop = self.get_first_rows()
+                if (self.nheaders == 0 and start >= stop):
+                    self._cells_feed = gdata.spreadsheet.SpreadsheetsCellsFeed()
+                elif (start == 0 or self.nheaders == 0):
+                    # The header rows and the first rows in one request
+                    first_row = self.nheaders + start + 1
+                    if (start == 0): first_row = 1
+                    self._cells_feed, values = self.read_cells(
+                        first_row, self.nheaders + stop)
+                    self.load_rows(start, stop, values)
+                else:
+                    self._cells_feed, values = self.read_cells(1, 
+                                                               self.nheaders)
+                    self.add_values(values)
+                    self.load_rows(start, stop)
+
+            # Header rows are always kept, even if they are blank.
+            self._header_rows = [self.make_row(i+1) 
+                                 for i in range(0, self.nheaders)]
+                
+        return self._cells_feed
+
+    def get_first_rows(self):
+        """
+        Returns the (start, stop) indices of the data rows a paged 
+        worksheet reads first: row_range, or else the first page.  The 
+        end of the rows is found first only if row_range needs it. 
+        """
+        if (self.row_range == None):
+            return (0, self.page_rows or page_rows)
+        start, stop, step = (self.row_range.start, self.row_range.stop, 
+                             self.row_range.step)
+        if (step not in (None, 1)):
+            raise ValueError('Row range must be contiguous')
+        start = start or 0
+        if (stop == None or start < 0 or stop < 0):
+            self.find_last_row()
+            start, stop, step = self.row_range.indices(len(self._rows))
+        return (start, max(start, stop))
+
+    def reset_data(self):
+        """
+        Starts the local data afresh, with no cells.
+        """
+        self._store = CellStore()
+        self._rows = RowList(self)
+        self._header_rows = []
+        self._schema = None
+        self.invalidate_indexes()
+
+    def upload(self, array, max_workers=None):
+        """
+        Writes a two-dimensional array of values, starting at row 1, 
+        into this worksheet, which should be new and empty, and which 
+        must be large enough.  Only the non-blank cells are sent, in 
+        batch requests as for flush(max_workers).  The local data is 
+        set up from the array as if it had been loaded, so there is no 
+        need to read the worksheet back.  Returns the number of cells 
+        written. 
+        """
+        self.reset_data()
+        self._cells_feed = gdata.spreadsheet.SpreadsheetsCellsFeed()
+        values = []
+        for i,vals in enumerate(array):
+            for j,val in enumerate(vals):
+                if (val == None or val == ''): continue
+                text = '%s' % val
+                numeric_value = None
+                if (isinstance(val, (int, long, float)) and 
+                    not isinstance(val, bool)):
+                    numeric_value = val
+                values.append( (i+1, j+1, text, text, numeric_value) )
+                self._pending.setdefault((i+1, j+1), (text, None))
+        self.add_values(values)
+        self._header_rows = [self.make_row(i+1) 
+                             for i in range(0, self.nheaders)]
+        return self.flush(max_workers)
+
+    def reload_changes(self, updated_min):
+        feed, values = self.read_cells(updated_min=updated_min)
+        logging.info('Found %d changed entries' % len(values))
+        self._list_feed = None
+        changes = []
+        changed_rows = set()
+        for row, col, text, input_value, numeric_value in values:
+            if (not self.is_row_loaded(row)): continue
+            old = self._store.get(row, col)
+            if (text): 
+                new_vals = (text, input_value or text, numeric_value)
+            else:
+                new_vals = None
+            if (old == None and new_vals == None): continue
+            if (old != None and new_vals != None and 
+                old[:2] == new_vals[:2]): continue
+            changes.append( (row, col, old and old[0], text or None) )
+            changed_rows.add(row)
+            if (new_vals == None):
+                self._store.clear(row, col)
+            elif (row <= self.nheaders):
+                self._store.set(row, col, text, input_value, numeric_value)
+            else:
+                self.init_value(row, col, text, input_value, numeric_value)
+        if (feed.updated != None): 
+            self._cells_feed.updated = feed.updated
+
+        # Drop trailing rows left blank, as a full load would
+        if (not self.is_paged()):
+            while (self._rows and 
+                   not self._store.get_row(self.nheaders+len(self._rows))):
+                self._rows.pop()
+        if (changed_rows): self.invalidate_indexes()
+        for row_num in changed_rows:
+            if (row_num <= self.nheaders):
+                self._header_rows[row_num-1]._refresh()
+            else:
+                irow = row_num - self.nheaders - 1
+                self._rows.refresh(irow, irow+1)
+        if (changed_rows and min(changed_rows) <= max(self.nheaders, 1)):
+            self._schema = None
+        return changes
+
+    def get_cells_feed_range(self, min_row=None, max_row=None, 
+                             updated_min=None, cols=None):
+        """
+        Returns the cells feed limited to the given spreadsheet rows 
+        (numbered from 1) and to the columns in the slice cols, by 
+        default col_range.  If updated_min is given, only cells changed 
+        since then are returned, including cells that were cleared. 
+        """
+        query = self.get_cells_query(min_row, max_row, updated_min, cols)
+        return GetCellsFeed(self.key, self.wksht_id.short_id, query=query)
+
+    def read_cells(self, min_row=None, max_row=None, updated_min=None, 
+                   cols=None):
+        """
+        Returns the cells feed, without its entries, and the list of its 
+        cell values as given by cell_values, for the rows and columns as 
+        for get_cells_feed_range.  With fast_cells_feed, the XML is 
+        parsed by parse_cells_feed instead of into gdata objects. 
+        """
+        if (not fast_cells_feed):
+            feed = self.get_cells_feed_range(min_row, max_row, updated_min, 
+                                             cols)
+            values = list(cell_values(feed.entry))
+            feed.entry = []
+            return (feed, values)
+        query = self.get_cells_query(min_row, max_row, updated_min, cols)
+        query.feed = cells_feed_url(self.key, self.wksht_id.short_id)
+        return GetCellsValues(query.ToUri())
+
+    def get_cells_query(self, min_row=None, max_row=None, updated_min=None,
+                        cols=None):
+        if (cols == None): cols = self.col_range
+        query = gdata.spreadsheet.service.CellQuery()
+        if (min_row != None): query.min_row = str(min_row)
+        if (max_row != None): query.max_row = str(max_row)
+        if (updated_min != None): 
+            query['updated-min'] = updated_min
+            query.return_empty = 'true'
+        if (cols != None):
+            ncols = int(self.data.col_count.text)
+            start, stop, step = cols.indices(ncols)
+            if (step != 1): 
+                raise ValueError('Column range must be contiguous')
+            query.min_col = str(start+1)
+            query.max_col = str(max(stop, start+1))
+        return query
+
+    def add_values(self, values):
+        """
+        Adds cell values, as given by cell_values, to the internal 
+        representation.
+        """
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        for row, col, text, input_value, numeric_value in values:
+            if (debug): 
+                logging.debug('Adding cell for row %d, col %d', row, col)
+            # Allow for multiple header rows, possibly 
+            # including blank rows in them.  
+            if (row <= self.nheaders):
+                self._store.set(row, col, text, input_value, numeric_value)
+            else:
+                self.init_value(row, col, text, input_value, numeric_value)
+
+    def is_paged(self):
+        """
+        True if rows are loaded on demand rather than all at once, 
+        which happens when either row_range or page_rows is set.
+        """
+        return (self.row_range != None or self.page_rows != None)
+
+    def get_last_row(self, lo=0):
+        """
+        Returns the number of the last spreadsheet row with a cell in 
+        col_range, or lo if there are none after it, by a binary search 
+        over the rows of the sheet with requests for a single cell. 
+        """
+        # The last row is known to be within lo..hi
+        hi = int(self.data.row_count.text)
+        while (lo < hi):
+            mid = (lo + hi + 1) // 2
+            query = self.get_cells_query(mid, hi)
+            query.max_results = '1'
+            feed = GetCellsFeed(self.key, self.wksht_id.short_id, query=query)
+            if (feed.entry): 
+                lo = int(feed.entry[0].cell.row)
+            else:
+                hi = mid - 1
+        return lo
+
+    def find_row(self, min_row):
+        """
+        Returns the number of the first spreadsheet row from min_row on 
+        with a cell in col_range, or None, with a request for one cell. 
+        """
+        max_row = int(self.data.row_count.text)
+        if (min_row > max_row): return None
+        query = self.get_cells_query(min_row, max_row)
+        query.max_results = '1'
+        feed = GetCellsFeed(self.key, self.wksht_id.short_id, query=query)
+        if (not feed.entry): return None
+        return int(feed.entry[0].cell.row)
+
+    def find_last_row(self):
+        """
+        Ends the rows of a paged worksheet at the last row with a cell, 
+        found by get_last_row, adding the rows after the pages read so 
+        far unloaded. 
+        """
+        rows = self._rows
+        if (rows.complete): return
+        nrows = len(rows.loaded)
+        last_row = self.get_last_row(self.nheaders + nrows)
+        rows.extend_blank(last_row - self.nheaders - nrows, loaded=False)
+        rows.complete = True
+
+    def load_next_rows(self):
+        """
+        Reads the page of rows after the last row with a cell read so 
+        far, on a paged worksheet whose rows are not known to end there. 
+        If the page has no cells, the next row with one is found by 
+        find_row, and if there is none the rows end where they are. 
+        """
+        rows = self._rows
+        size = self.page_rows or page_rows
+        start = len(rows.loaded)
+        self.load_rows(start, start + size)
+        if (rows.complete or len(rows.loaded) > start): return
+        row_num = self.find_row(self.nheaders + start + size + 1)
+        if (row_num == None): 
+            rows.complete = True
+        else:
+            # The rows before it are blank, but its own cells are unread
+            rows.extend_blank(row_num - self.nheaders - start - 1)
+            rows.extend_blank(1, loaded=False)
+
+    def load_rows(self, start, stop, values=None):
+        """
+        Reads the data rows with indices start <= i < stop (indexed as 
+        in the worksheet, not by spreadsheet row number) in one request, 
+        or adds their cell values if given.  While the end of the rows 
+        of a paged worksheet is not known, the rows are extended to the 
+        last row in the range with a cell. 
+        """
+        first_row = self.nheaders + start + 1
+        last_row = self.nheaders + stop
+        if (values == None):
+            if (start >= stop): return
+            feed, values = self.read_cells(first_row, last_row)
+            logging.info('Found %d entries in rows %d-%d' 
+                         % (len(values), first_row, last_row))
+        rows = self._rows
+        if (not rows.complete):
+            nrows = len(rows.loaded)
+            if (start > nrows and 
+                [vals for vals in values if (vals[0] > self.nheaders)]):
+                rows.extend_blank(start - nrows, loaded=False)
+            if (start <= nrows and last_row >= int(self.data.row_count.text)):
+                rows.complete = True
+        self.add_values(values)
+        stop = min(stop, len(rows.loaded))
+        for i in range(start, stop):
+            rows.loaded[i] = 1
+        rows.refresh(start, stop)
+
+    def load_row(self, row_num):
+        """
+        Reads the page of rows containing the given spreadsheet row 
+        number, skipping rows at either end of the page already loaded.
+        """
+        size = self.page_rows or page_rows
+        irow = row_num - self.nheaders - 1
+        start = irow - irow % size
+        stop = min(start + size, len(self._rows.loaded))
+        while (start < stop and self._rows.loaded[start]): start += 1
+        while (stop > start and self._rows.loaded[stop-1]): stop -= 1
+        self.load_rows(start, stop)
+
+    def load_all(self):
+        """
+        Reads the worksheet, and on a paged worksheet all the rows not 
+        read yet, page_rows rows per request.
+        """
+        if (not self.has_data()): self.load_data()
+        if (not self.is_paged()): return
+        while (not self._rows.complete): self.load_next_rows()
+        size = self.page_rows or page_rows
+        loaded = self._rows.loaded
+        start = 0
+        while (start < len(loaded)):
+            if (loaded[start]): 
+                start += 1
+                continue
+            stop = start + 1
+            while (stop < min(start + size, len(loaded)) and 
+                   not loaded[stop]): 
+                stop += 1
+            self.load_rows(start, stop)
+            start = stop
+
+    def is_row_loaded(self, row_num):
+        irow = row_num - self.nheaders - 1
+        if (irow < 0): return True
+        if (irow >= len(self._rows.loaded)): return self._rows.complete
+        return bool(self._rows.loaded[irow])
+
+    def get_list_feed(self):
+        """
+        WARNING: The gdata List Feed is fatally flawed in that it stops
+        returning results after a single blank line.  To retrieve a 
+        correct list feed, the module temporarily puts a single space 
+        character into the first cell of blank rows, gets the list feed, 
+        then removes that whitespace. 
+        """
+        if (not self._list_feed):
+            if (not self.has_data()): self.load_data()
+            # For the list feed to read correctly, there must be no 
+            # blank rows.  
+            blank_rows = []
+            for row in self.headers+list(self):
+                if (not row): 
+                    row[0] = ' '
+                    blank_rows.append(row)
+            self._list_feed = GetListFeed(self.key, self.wksht_id)
+            for row in blank_rows:
+                row[0] = None
+        return self._list_feed
+    list_feed = property(get_list_feed, None)
+
+    def get_schema(self):
+        """
+        Returns the Schema of the worksheet, which is computed again 
+        only after header rows are written or more columns are used.
+        """
+        if (not self.has_data()): self.load_data()
+        schema = self._schema
+        if (schema == None or schema.max_col != self._max_col or 
+            schema.nheaders != self.nheaders):
+            self._schema_version += 1
+            schema = self._schema = Schema(self, self._schema_version)
+        return schema
+    schema = property(get_schema, None)
+
+    def get_coltags(self):
+        """
+        Returns the column keys of the list feed; cf. Schema.make_coltags.
+        """
+        return self.schema.coltags
+    coltags = property(get_coltags, None)
+
+    def coltag_test(self):
+        custom_tags = []
+        if (self.list_feed.entry):
+            coltags = self.coltags
+            missing = []
+            for e in self.list_feed.entry:
+                for key in e.custom.keys():
+                    if (key not in custom_tags):
+                        custom_tags.append(key)
+                    if (key not in coltags+missing):
+                        missing.append(key)
+            if (missing):
+                logging.warn("unrecognized coltags %s" % missing)
+        return custom_tags
+
+    def get_rows(self):
+        if (not self.has_data()): self.load_data()
+        return self._rows
+    rows = property(get_rows, None)
+
+    def get_headers(self):
+        """
+        This returns a single header row.  If there are multiple header 
+        rows, it returns only the last one.  
+        """
+        if (not self.has_data()): self.load_data()
+        if (self._header_rows): return self._header_rows[-1]
+        else: return None
+    def set_headers(self, vals):
+        """
+        This sets the header values in the worksheet.
+        """
+        self.set_row(self.headers.row, vals)
+        
+    headers = property(get_headers, set_headers)
+
+    def get_header_map(self):
+        """
+        Returns a dict from header name to column index, counting from 
+        0, as kept in the schema.
+        """
+        return self.schema.header_map
+    header_map = property(get_header_map, None)
+
+    def get_column_index(self, key):
+        """
+        Returns the column index, counting from 0, for a header name or 
+        for a column index given as an int.
+        """
+        try:
+            return self.header_map[key]
+        except (KeyError, TypeError), e:
+            pass
+        try:
+            return int(key)
+        except Exception, e:
+            raise KeyError('Key "%s" not found in %s' % (key, self))
+
+    def get_all_header_rows(self):
+        """
+        Returns all header rows as a two-dimensional array. 
+        """
+        if (not self.has_data()): self.load_data()
+        return self._header_rows
+
+    def init_value(self, row_num, col_num, text, input_value=None, 
+                   numeric_value=None):
+        irow = row_num - self.nheaders - 1
+        nrows = len(self._rows.loaded)
+        if (irow >= nrows):
+            logging.debug('Adding blank rows to worksheet')
+            self._rows.extend_blank(irow + 1 - nrows)
+        self._store.set(row_num, col_num, text, input_value, numeric_value)
+        if (col_num > self._max_col): self._max_col = col_num
+
+    def make_row(self, row_num):
+        """
+        Creates a Row object for a spreadsheet row number from the 
+        cell store.  Use get_row instead, which reuses live rows.
+        """
+        row = Row(self, row_num)
+        list.extend(row, self.get_row_cells(row_num))
+        return row
+
+    def get_row_cells(self, row_num):
+        cells = []
+        for i,vals in enumerate(self._store.get_row(row_num)):
+            if (vals == None): 
+                cells.append(None)
+            else:
+                cells.append(Cell.from_values(self, row_num, i+1, *vals))
+        return cells
+
+    def store_cell(self, row_num, col_num, cell):
+        # The coltags come from row 1 even without header rows
+        if (row_num <= max(self.nheaders, 1)):
+            self._schema = None
+        if (row_num > self.nheaders and 
+            self._indexes.get(col_num-1) != None):
+            old = self._store.get(row_num, col_num)
+            self.update_index(col_num-1, row_num, old and old[0], 
+                              cell and cell.text)
+        if (cell == None):
+            self._store.clear(row_num, col_num)
+        else:
+            self._store.set(row_num, col_num, cell.text, 
+                            cell.input_value, cell.numeric_value)
+
+    def create_index(self, column):
+        """
+        Builds a hash index on a column, given by header name or index, 
+        for find() and lookup().  The index is kept up to date as cells 
+        are written and rows are appended or deleted. 
+        """
+        icol = self.get_column_index(column)
+        self._indexes[icol] = None
+        return self.get_index(icol)
+
+    def drop_index(self, column):
+        self._indexes.pop(self.get_column_index(column), None)
+
+    def invalidate_indexes(self):
+        """
+        Marks all indexes to be rebuilt when next used.
+        """
+        for icol in self._indexes: 
+            self._indexes[icol] = None
+
+    def get_index(self, icol):
+        index = self._indexes[icol]
+        if (index == None):
+            logging.info('Building index on column %d of "%s"' 
+                         % (icol+1, self.title))
+            self.load_all()
+            index = {}
+            for row_num in xrange(self.nheaders+1, self.max_row+1):
+                vals = self._store.get(row_num, icol+1)
+                if (vals != None): 
+                    index.setdefault(vals[0], []).append(row_num)
+            self._indexes[icol] = index
+        return index
+
+    def update_index(self, icol, row_num, old, new):
+        index = self._indexes[icol]
+        if (old == new): return
+        if (old):
+            row_nums = index.get(old)
+            if (row_nums and row_num in row_nums):
+                row_nums.remove(row_num)
+                if (not row_nums): del index[old]
+        if (new):
+            bisect.insort(index.setdefault(new, []), row_num)
+
+    def delete_from_indexes(self, row_nums):
+        """
+        Removes deleted rows, given as a sorted list of row numbers, from 
+        the indexes and renumbers the rows after them. 
+        """
+        deleted = set(row_nums)
+        for icol,index in self._indexes.items():
+            if (index == None): continue
+            for val in index.keys():
+                new_nums = [n - bisect.bisect_left(row_nums, n) 
+                            for n in index[val] if n not in deleted]
+                if (new_nums): index[val] = new_nums
+                else: del index[val]
+
+    def lookup(self, column, value):
+        """
+        Returns the list of rows whose cell in the column (a header name 
+        or index) has the given value, using an index on that column, 
+        which is created if needed.
+        """
+        icol = self.get_column_index(column)
+        if (icol not in self._indexes): 
+            self.create_index(icol)
+        row_nums = self.get_index(icol).get('%s' % value, [])
+        return [self.get_row(row_num) for row_num in row_nums]
+
+    def find(self, column, value):
+        """
+        Returns the first row with the given value in the column, or 
+        None, as for lookup. 
+        """
+        icol = self.get_column_index(column)
+        if (icol not in self._indexes): 
+            self.create_index(icol)
+        row_nums = self.get_index(icol).get('%s' % value)
+        if (row_nums): return self.get_row(row_nums[0])
+        else: return None
+
+    def get_max_row(self):
+        return len(self.rows) + self.nheaders
+    max_row = property(get_max_row, None)
+
+    def get_max_col(self):
+        if (not self.has_data()): self.load_data()
+        return self._max_col
+    max_col = property(get_max_col, None)
+
+    def get_row(self, row_num):
+        """
+        Get row by the spreadsheet row number, starting with 1 for the 
+        first row - which might be a header row.
+        """
+        if (row_num <= self.nheaders):
+            return self.get_all_header_rows()[row_num-1]
+        else:
+            return self.rows[row_num-self.nheaders-1]
+
+    def set_row(self, row_num, vals=[]):
+        """
+        Set row by the spreadsheet row number, starting with 1 for the 
+        first row - which might be a header row.
+        """
+        row_data = RowData(self, vals)
+        row = self.get_row(row_num)
+        with self.batch():
+            for i,val in enumerate(row_data):
+                if (row[i] != val): row[i] = val
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Within this context, cell writes update the local rows at once 
+        but are only sent to Google Docs, as batch requests, on exit.
+
+        with ws.batch():
+            for row in ws:
+                row['Status'] = 'done'
+
+        Nested batch() blocks are sent when the outermost one exits.  If 
+        the block raises, nothing is sent: the queued writes are 
+        discarded, restoring the local cells, and the exception goes on. 
+        In write-behind mode the queue is left to the flusher instead.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except:
+            self._batch_depth -= 1
+            if (not self.is_batching()): 
+                self.discard()
+            raise
+        self._batch_depth -= 1
+        if (not self.is_batching()): 
+            self.flush()
+
+    def discard(self):
+        """
+        Drops all queued cell updates, restoring the local cells to 
+        their previous values. 
+        """
+        with self._write_lock:
+            pending = self._pending.items()
+            self._pending = collections.OrderedDict()
+            for (row, col), (val, old) in pending:
+                self._update_local(row, col, old)
+
+    def is_batching(self):
+        return (self._batch_depth > 0 or self._write_behind != None)
+
+    def start_write_behind(self, delay_seconds=None, on_error=None):
+        """
+        Turns on write-behind mode: cell writes update the local rows 
+        at once and are queued, and a background thread sends the queue 
+        in batch requests delay_seconds (by default 
+        write_behind_delay_seconds) after a write.  Repeated writes to 
+        a cell before it is sent only send the last value. 
+
+        If sending fails, on_error(worksheet, exception) is called from 
+        the flusher thread; by default the error is logged.  Cells the 
+        server rejects are restored to their previous local values, as 
+        for flush(), and cells from failed requests stay queued until 
+        the next write or flush(). 
+
+        flush() sends the queue at once and close() stops the flusher 
+        after sending it; both raise any error.  Queued updates are 
+        also sent at exit. 
+        """
+        if (self._write_behind != None): return
+        if (delay_seconds == None): 
+            delay_seconds = write_behind_delay_seconds
+        self._write_behind = WriteBehind(self, delay_seconds, on_error)
+        with _write_behind_lock:
+            _write_behind_worksheets.add(self)
+
+    def close(self):
+        """
+        Turns off write-behind mode, sending any queued cell updates 
+        from the calling thread.
+        """
+        write_behind = self._write_behind
+        if (write_behind != None):
+            write_behind.stop()
+            self._write_behind = None
+            with _write_behind_lock:
+                _write_behind_worksheets.discard(self)
+        if (self._pending): self.flush()
+
+    def queue_update(self, row, col, new_val, old_val=None):
+        """
+        Queues a cell update for the next flush().  If the cell already 
+        has a queued update, the new value replaces it.  Returns a 
+        provisional gdata cell entry for the local representation.
+        """
+        with self._write_lock:
+            if ((row, col) in self._pending):
+                old_val = self._pending.pop((row, col))[1]
+            self._pending[(row, col)] = (new_val, old_val)
+        if (self._write_behind != None): self._write_behind.notify()
+        return gdata.spreadsheet.SpreadsheetsCell(
+            cell=gdata.spreadsheet.Cell(text=new_val, row=str(row), 
+                                        col=str(col), inputValue=new_val))
+
+    def flush(self, max_workers=None):
+        """
+        Sends all queued cell updates through the cells feed batch 
+        endpoint, batch_size cells per request, and updates the local 
+        cells from the response.  Returns the number of cells written. 
+        With max_workers, up to that many requests are sent at once 
+        from a pool of threads; the local cells are still updated in 
+        the calling thread.
+
+        Cells that fail are restored to their previous local values and 
+        reported together in a BatchError after all chunks are sent.  
+        If a request fails, its cells and, when sending one request at 
+        a time, those of the requests after it stay queued for a later 
+        flush(), and its error is raised, or carried by the BatchError 
+        if cells of the requests before it failed.
+        """
+        with self._flush_lock:
+            return self._flush(max_workers)
+
+    def _flush(self, max_workers):
+        with self._write_lock:
+            pending = self._pending.items()
+            self._pending = collections.OrderedDict()
+        url = cells_feed_url(self.key, self.wksht_id)
+        chunks = [pending[start:start+batch_size] 
+                  for start in range(0, len(pending), batch_size)]
+        def send(chunk):
+            return ExecuteBatch(self.make_batch_feed(chunk, url), 
+                                url + '/batch')
+        responses = None
+        if ((max_workers or 1) > 1 and len(chunks) > 1):
+            responses = thread_map(send, chunks, max_workers)
+        failures = []
+        written = 0
+        error = None
+        for i,chunk in enumerate(chunks):
+            if (responses == None):
+                try:
+                    res = send(chunk)
+                except Exception, e:
+                    # Keep the unsent updates queued for a later flush()
+                    self.requeue(pending[i*batch_size:])
+                    error = e
+                    break
+            else:
+                res, e = responses[i]
+                if (e != None):
+                    self.requeue(chunk)
+                    error = error or e
+                    continue
+            with self._write_lock:
+                chunk_written, chunk_failures = self.apply_batch(chunk, res)
+            written += chunk_written
+            failures.extend(chunk_failures)
+        logging.info('Wrote %d cells in batch to worksheet "%s"' 
+                     % (written, self.title))
+        if (failures):
+            raise BatchError(failures, error)
+        if (error != None):
+            raise error
+        return written
+
+    def requeue(self, chunk):
+        """
+        Queues unsent cell updates again, behind any newer writes to 
+        the same cells.
+        """
+        with self._write_lock:
+            for (row, col), (val, old) in chunk:
+                if ((row, col) in self._pending):
+                    # Keep the newer value, but restore the old one on failure
+                    new_val = self._pending.pop((row, col))[0]
+                    self._pending[(row, col)] = (new_val, old)
+                else:
+                    self._pending[(row, col)] = (val, old)
+
+    def make_batch_feed(self, chunk, url):
+        """
+        Returns the batch feed for a list of ((row, col), (val, old)) 
+        cell updates.
+        """
+        batch_feed = gdata.spreadsheet.SpreadsheetsCellsFeed()
+        for (row, col), (val, old) in chunk:
+            cell_id = '%s/R%dC%d' % (url, row, col)
+            entry = gdata.spreadsheet.SpreadsheetsCell(
+                atom_id=atom.Id(text=cell_id),
+                link=[atom.Link(rel='edit', link_type='application/atom+xml',
+                                href=cell_id)],
+                cell=gdata.spreadsheet.Cell(row=str(row), col=str(col),
+                                            inputValue=val))
+            batch_feed.AddUpdate(entry, batch_id_string='R%dC%d' % (row, col))
+        return batch_feed
+
+    def apply_batch(self, chunk, res):
+        """
+        Updates the local cells from the response to a batch request, 
+        and returns the number of cells written and the list of 
+        (row, col, code, reason) failures.  Cells written again since 
+        the request was sent keep their newer local values.
+        """
+        results = {}
+        for entry in res.entry:
+            if (entry.batch_id != None): 
+                results[entry.batch_id.text] = entry
+        written = 0
+        failures = []
+        for (row, col), (val, old) in chunk:
+            entry = results.get('R%dC%d' % (row, col))
+            if (entry == None):
+                code, reason = None, 'No batch response'
+                if (res.interrupted != None): 
+                    reason = res.interrupted.reason
+            elif (entry.batch_status == None or 
+                  entry.batch_status.code == '200'):
+                code, reason = '200', None
+            else:
+                code = entry.batch_status.code
+                reason = entry.batch_status.reason
+            newer = ((row, col) in self._pending)
+            if (code == '200'):
+                written += 1
+                if (newer): continue
+                if (entry.cell != None and entry.cell.text):
+                    new_cell = Cell(self, entry, row=row, col=col)
+                else:
+                    new_cell = None
+                self._update_local(row, col, new_cell)
+            else:
+                failures.append( (row, col, code, reason) )
+                if (not newer): self._update_local(row, col, old)
+        return written, failures
+
+    def _update_local(self, row_num, col_num, new_cell):
+        # Rows cleared by delete_rows are already gone locally
+        if (row_num > self.max_row): return
+        row = self.get_row(row_num)
+        row._set_local(col_num-1, new_cell)
+        while (row and row[-1] == None): 
+            row.pop(-1)
+
+    def __setitem__(self, irow, vals):
+        self.set_row(self[irow].row, vals)
+
+    def __len__(self):
+        return self.rows.__len__()
+
+    def __getitem__(self, key):
+        return self.rows.__getitem__(key)
+
+    def __iter__(self):
+        return self.rows.__iter__()
+
+    def iter_rows(self, chunk_rows=None):
+        """
+        Returns a RowStream over the data rows, which reads chunk_rows 
+        rows per request and keeps none of them in the worksheet, so 
+        memory stays bounded for any size of sheet.  The rows are 
+        read-only.  If the worksheet is already fully loaded, the loaded 
+        rows are used instead.
+        """
+        return RowStream(self, chunk_rows or self.page_rows or page_rows)
+
+    def select(self, where=None, columns=None):
+        """
+        Returns a Selection of the data rows matching where, with only 
+        the given columns, by header name or index, or with all of them. 
+        where is either a dict of column -> value, for the rows holding 
+        those values (blank for None), or a function returning True for 
+        each row to select. 
+
+        If the worksheet is loaded, the rows are filtered locally, and 
+        without columns they are the worksheet's own rows.  Otherwise 
+        as little as possible is read.  A dict of non-blank values is 
+        sent as a structured query on the list feed, through the 
+        coltags, if there is a single header row and no data after a 
+        blank row (since the list feed ends at the first blank row); 
+        these rows have no row number, as the list feed doesn't give 
+        them.  Failing that, only the span of columns used is read 
+        through the cells feed, a page at a time, and filtered locally.  
+        Rows other than the worksheet's are read-only. 
+
+        pending = ws.select(where={'Status': 'pending'}, columns=['Name'])
+        """
+        stream = self.iter_rows()
+        icols = None
+        if (columns != None):
+            icols = [stream.get_column_index(key) for key in columns]
+        conditions = None
+        if (where != None and not callable(where)):
+            conditions = []
+            for key, val in where.items():
+                if (val == None or val == ''): text = None
+                else: text = '%s' % val
+                conditions.append( (stream.get_column_index(key), text) )
+        selection = Selection(self, stream.headers, icols)
+
+        if (self.has_data() and not self.is_paged()):
+            rows = self
+        elif (conditions and self.nheaders == 1 and 
+              not [text for icol,text in conditions 
+                   if (text == None or '"' in text)] and 
+              self.is_list_feed_complete()):
+            rows = self.query_list_feed(stream, conditions)
+        else:
+            if (icols and not callable(where)):
+                used = icols + [icol for icol,text in conditions or []]
+                stream.cols = slice(min(used), max(used)+1)
+            rows = stream
+        for row in rows:
+            if (callable(where) and not where(row)): continue
+            if (conditions and [icol for icol,text in conditions 
+                                if ((row[icol] or None) != text)]): 
+                continue
+            selection.add(row)
+        return selection
+
+    def is_list_feed_complete(self):
+        """
+        True if the list feed sees every data row, which it doesn't if 
+        there is data after a blank row.  This takes two requests, for 
+        the number of rows in the list feed and for any cell below them.
+        """
+        query = gdata.spreadsheet.service.ListQuery()
+        query['max-results'] = '1'
+        feed = GetListFeed(self.key, self.wksht_id, query=query)
+        if (feed.total_results == None): return False
+        # Skip the header row, the list rows and the blank row after them
+        query = self.get_cells_query(int(feed.total_results.text) + 3)
+        query['max-results'] = '1'
+        return not GetCellsFeed(self.key, self.wksht_id.short_id, 
+                                query=query).entry
+
+    def query_list_feed(self, stream, conditions):
+        """
+        Returns the rows of the list feed with the given values, as 
+        (column index, text) pairs, as read-only rows of the stream.
+        """
+        coltags = Schema.make_coltags(list(stream.header_rows[0]), 
+                                      int(self.data.col_count.text))
+        query = gdata.spreadsheet.service.ListQuery()
+        query.sq = ' and '.join(['%s = "%s"' % (coltags[icol], text)
+                                 for icol,text in conditions])
+        feed = GetListFeed(self.key, self.wksht_id, query=query)
+        logging.info('Found %d rows for %s' % (len(feed.entry), query.sq))
+        rows = []
+        for entry in feed.entry:
+            row = StreamRow(stream, None, [])
+            for icol,coltag in enumerate(coltags):
+                val = entry.custom.get(coltag)
+                if (val == None or not val.text): continue
+                while (len(row) <= icol): list.append(row, None)
+                list.__setitem__(row, icol, Cell.from_values(
+                        self, None, icol+1, val.text))
+            rows.append(row)
+        return rows
+
+    def __contains__(self, item):
+        return (item in iter(self))
+
+    def append(self, vals=[], overwrite=True):
+        """
+        Appends the specified data to the worksheet.  Note that if there 
+        are blank lines at the end of the worksheet, this will write onto 
+        those.  
+        """
+        row_data = RowData(self, vals)
+        # Queued writes may add rows that InsertRow must append after
+        if (self._pending): self.flush()
+
+        # Frustratingly, for InsertRow, gdata does not allow inserting 
+        # an empty data. It only accepts column *name* to specify the 
+        # column, but also changes the column name by an undocumented 
+        # process - cf. Worksheet.get_coltags()
+        # 
+        # The process is collected in the RowData and RowDataVal classes.
+
+        # Standard append adds to content, not data.  If header rows 
+        # are blank, they should be temporarily filled in.  
+        blank_rows = []
+        for row in self.get_all_header_rows():
+            if (not row): 
+                row[0] = ' '
+                blank_rows.append(row)
+
+        # Insert in values via gdata API
+        res = InsertRow(row_data.insert_vals, 
+                        key=self.key, wksht_id=self.wksht_id)
+
+        for row in blank_rows: row[0] = None
+
+        # Create a blank row in internal representation
+        new_row_num = self.max_row+1
+        self.rows.append( Row(self, new_row_num) )
+
+        # Force creation of the new values, because InsertRow is 
+        # unreliable.  Example: new row has more columns than 
+        # previously used, then silently the new values don't show up. 
+        for val in row_data:
+            if (overwrite and val and (val.coltag not in res.custom)):
+                self[-1][val.icol] = val.val
+            else:
+                self[-1]._set_local(val.icol, val.val)
+        # Remove the added space for a blank row using UpdateCell.
+        if (row_data.is_blank()): self[-1][0] = None
+
+    def extend(self, rows):
+        """
+        Appends many rows of data after the last row of the worksheet. 
+        Unlike append, this grows the worksheet once if needed and then 
+        writes all the new cells through batch requests, so it takes a 
+        handful of requests regardless of the number of rows.  Each item 
+        may be a list or a map of header names, as for append.
+        """
+        row_datas = [RowData(self, vals) for vals in rows]
+        if (not row_datas): return
+        first_row_num = self.max_row + 1
+        ncols = max([len(row_data) for row_data in row_datas])
+        self.resize(first_row_num + len(row_datas) - 1, ncols)
+
+        new_rows = []
+        for i,row_data in enumerate(row_datas):
+            row = Row(self, first_row_num + i)
+            for val in row_data:
+                if (val):
+                    entry = self.queue_update(row.row, val.icol+1, val.val)
+                    new_cell = Cell(self, entry, row=row.row, col=val.icol+1)
+                    row._set_local(val.icol, new_cell)
+            if (len(row) > self._max_col): self._max_col = len(row)
+            new_rows.append(row)
+        self._rows.extend(new_rows)
+        if (not self.is_batching()):
+            self.flush()
+
+    def delete_rows(self, rows):
+        """
+        Deletes data rows, given as a list of indices as for ws[i], or 
+        as a function that returns True for each row to delete.  Returns 
+        the number of rows deleted. 
+
+        Instead of deleting rows one by one through the list feed, the 
+        cells below the first deleted row are moved up with batch 
+        requests and the sheet is then shrunk by the number of rows 
+        deleted, so the cost depends on the cells moved and not on the 
+        number of rows deleted.  Cells are moved by their inputValue, 
+        so formulas would neither be rewritten as they move nor follow 
+        the rows they refer to: if any cell of the worksheet holds a 
+        formula the rows are deleted through the list feed instead (cf. 
+        delete_list_rows), or ValueError is raised where the list feed 
+        cannot reach them.  Formulas in other worksheets that refer to 
+        this one cannot be seen, and read the wrong rows after cells are 
+        moved.  If the moves fail partway, the worksheet is read again 
+        before the error is raised, so the local rows match the server. 
+        """
+        if (self.col_range != None):
+            raise ValueError('Cannot delete rows with only a column range loaded')
+        self.load_all()
+        nrows = len(self.rows)
+        if (callable(rows)):
+            irows = [i for i,row in enumerate(self) if rows(row)]
+        else:
+            irows = set()
+            for i in rows:
+                if (i < 0): i += nrows
+                if (i < 0 or i >= nrows):
+                    raise IndexError('row index out of range')
+                irows.add(i)
+            irows = sorted(irows)
+        if (not irows): return 0
+        # Send any earlier updates before the rows are renumbered
+        if (self._pending): self.flush()
+        if (self._store.has_formulas()):
+            if (not self.can_delete_list_rows(irows)):
+                raise ValueError('Cannot move cells with formulas in the '
+                                 'worksheet, nor reach the rows through '
+                                 'the list feed')
+            logging.info('Deleting %d rows from worksheet "%s" through the '
+                         'list feed, to keep formulas' % (len(irows), 
+                                                          self.title))
+            self.delete_list_rows(irows)
+            return len(irows)
+
+        # Work out the moves against the current cells, then renumber 
+        # the local rows, so the batch responses land on the new rows.
+        deleted = set(irows)
+        sources = [i for i in xrange(irows[0], nrows) if i not in deleted]
+        sources.extend([None] * len(irows))
+        ncols = self._store.ncols
+        updates = []
+        for i,src_i in enumerate(sources):
+            row_num = self.nheaders + irows[0] + i + 1
+            for col in range(1, ncols+1):
+                old = self._store.get(row_num, col)
+                if (src_i == None): 
+                    new = None
+                else:
+                    new = self._store.get(self.nheaders + src_i + 1, col)
+                if (old == new or (old and new and old[:2] == new[:2])): 
+                    continue
+                if (old != None):
+                    old = Cell.from_values(self, row_num, col, *old)
+                updates.append( (row_num, col, new and new[1] or '', old) )
+        logging.info('Deleting %d rows from worksheet "%s" by moving %d cells' 
+                     % (len(irows), self.title, len(updates)))
+        self._rows.delete_rows(irows)
+        self._list_feed = None
+
+        # Cells in rows that the shrink removes need not be cleared
+        row_count = int(self.data.row_count.text)
+        new_row_count = max(row_count - len(irows), self.nheaders, 1)
+        try:
+            for row_num, col, new, old in updates:
+                if (row_num <= new_row_count):
+                    self.queue_update(row_num, col, new, old)
+            # The moves must be sent before the shrink, even when batching
+            self.flush()
+            self.set_size(new_row_count, int(self.data.col_count.text))
+        except Exception, e:
+            # Some of the moves may have been made: drop the others and 
+            # read the worksheet again.
+            logging.warn('Deleting rows from worksheet "%s" failed, '
+                         'reloading it: %s' % (self.title, e))
+            with self._write_lock:
+                self._pending = collections.OrderedDict()
+            self.reload()
+            raise e
+        return len(irows)
+
+    def can_delete_list_rows(self, irows):
+        """
+        True if the data rows with the given sorted indices can be 
+        deleted through the list feed, which needs a single header row 
+        and ends at the first blank row. 
+        """
+        if (self.nheaders != 1): return False
+        for i in xrange(0, irows[-1] + 1):
+            if (not self._store.get_row_texts(self.nheaders + i + 1)): 
+                return False
+        return True
+
+    def delete_list_rows(self, irows):
+        """
+        Deletes the data rows with the given sorted indices one by one 
+        through the list feed, which shifts the rows below them on the 
+        server and adjusts the formulas that refer to them.  Each row is 
+        a request of its own; cf. can_delete_list_rows. 
+        """
+        for i in reversed(irows):
+            self._rows[i].delete()
+        self.data = copy_entry(self.data)
+        self.data.row_count.text = str(
+            int(self.data.row_count.text) - len(irows))
+        metadata_cache().invalidate(self.key)
+
+    def sync(self, array):
+        """
+        Makes the worksheet hold a two-dimensional array of values, 
+        starting at row 1 with the header rows, with as few requests as 
+        it can, and returns the number of cells written. 
+
+        The data rows are aligned against the current rows with difflib. 
+        Rows missing from the array can then be deleted through the list 
+        feed, which shifts the rows below them on the server, and every 
+        other difference is written in batch requests as cell updates, 
+        after growing the sheet once if the array doesn't fit.  The API 
+        cannot insert a row in the middle of a sheet, so rows added by 
+        the array are written over the rows below them.  Each list feed 
+        delete is a request of its own, and reading the list feed costs 
+        two cell writes per blank row, so they are only used when they 
+        save requests over rewriting the cells, and only with one header 
+        row and no blank row above (the list feed ends at a blank row).
+        """
+        if (self.col_range != None):
+            raise ValueError('Cannot sync with only a column range loaded')
+        self.load_all()
+        if (self._pending): self.flush()
+        target = []
+        for vals in array:
+            texts = [None if (val == None or val == '') else '%s' % val
+                     for val in vals]
+            while (texts and texts[-1] == None): texts.pop(-1)
+            target.append(texts)
+        while (len(target) < self.nheaders): target.append([])
+        while (len(target) > self.nheaders and not target[-1]): target.pop(-1)
+
+        nrows = len(self.rows)
+        current = [tuple(self._store.get_row_texts(self.nheaders + i + 1))
+                   for i in xrange(0, nrows)]
+        matcher = difflib.SequenceMatcher(
+            None, current, [tuple(texts) for texts in target[self.nheaders:]], 
+            autojunk=False)
+        deletes = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if (tag in ('delete', 'replace')):
+                deletes.extend(range(i1 + j2 - j1, i2))
+        updates = self.get_sync_updates(range(0, nrows), target)
+        if (deletes and self.can_delete_list_rows(deletes)):
+            deleted = set(deletes)
+            aligned = self.get_sync_updates(
+                [i for i in xrange(0, nrows) if i not in deleted], target)
+            # Reading the list feed takes a request, plus two cell writes 
+            # per blank row to fill it in and clear it again (cf. 
+            # get_list_feed), then each delete is a request.
+            def requests(n): 
+                return (n + batch_size - 1) // batch_size
+            list_requests = 0
+            if (not self._list_feed): 
+                list_requests = 1 + 2 * current.count(())
+            if (list_requests + len(deletes) + requests(len(aligned)) < 
+                requests(len(updates))):
+                logging.info('Deleting %d rows from worksheet "%s" through '
+                             'the list feed' % (len(deletes), self.title))
+                self.delete_list_rows(deletes)
+                updates = aligned
+
+        ncols = max([len(texts) for texts in target] + [1])
+        self.resize(len(target), ncols)
+        nrows = len(target) - self.nheaders
+        if (nrows > len(self._rows)):
+            self._rows.extend_blank(nrows - len(self._rows))
+        with self._write_lock:
+            for row_num, col, new, old in updates:
+                if (old != None):
+                    old = Cell.from_values(self, row_num, col, *old)
+                entry = self.queue_update(row_num, col, new or '', old)
+                if (row_num > self.max_row): continue
+                if (new != None):
+                    self._update_local(row_num, col, 
+                                       Cell(self, entry, row=row_num, col=col))
+                else:
+                    self._update_local(row_num, col, None)
+            if (nrows < len(self._rows)):
+                self._rows.delete_rows(range(max(nrows, 0), len(self._rows)))
+        self._list_feed = None
+        self._max_col = max([len(texts) for texts in target] or [0])
+        logging.info('Syncing worksheet "%s" with %d cell updates' 
+                     % (self.title, len(updates)))
+        return self.flush()
+
+    def get_sync_updates(self, sources, target):
+        """
+        Returns the cell updates, as (row, col, new text, old values), 
+        that make the worksheet hold the target texts once the current 
+        data rows with the indices in sources are all that is left, in 
+        that order.
+        """
+        updates = []
+        ncols = self._store.ncols
+        for i in xrange(0, max(len(target), self.nheaders + len(sources))):
+            row_num = i + 1
+            if (i < self.nheaders):
+                src_num = row_num
+            elif (i - self.nheaders < len(sources)):
+                src_num = self.nheaders + sources[i - self.nheaders] + 1
+            else:
+                src_num = None
+            texts = target[i] if (i < len(target)) else []
+            for col in range(1, max(len(texts), ncols) + 1):
+                new = texts[col-1] if (col <= len(texts)) else None
+                old = src_num and self._store.get(src_num, col)
+                if (old == None):
+                    if (new != None): updates.append((row_num, col, new, None))
+                elif (new == None or new not in old[:2]):
+                    updates.append((row_num, col, new, old))
+        return updates
+
+    def resize(self, min_rows=None, min_cols=None):
+        """
+        Grows the worksheet so it has at least the given numbers of rows 
+        and columns, in a single request.  It never shrinks the sheet. 
+        """
+        row_count = int(self.data.row_count.text)
+        col_count = int(self.data.col_count.text)
+        if ((min_rows == None or min_rows <= row_count) and 
+            (min_cols == None or min_cols <= col_count)):
+            return
+        self.set_size(max(row_count, min_rows), max(col_count, min_cols))
+
+    def set_size(self, row_count, col_count):
+        """
+        Sets the numbers of rows and columns of the worksheet.  Cells 
+        outside the new size are lost. 
+        """
+        # The entry may be shared through the metadata cache, so a 
+        # copy is changed, and the entry is left as it was on failure.
+        entry = copy_entry(self.data)
+        entry.row_count.text = str(row_count)
+        entry.col_count.text = str(col_count)
+        logging.info('Resizing worksheet "%s" to %s rows, %s cols' % (
+                self.title, row_count, col_count))
+        try:
+            self.data = UpdateWorksheet(entry)
+        finally:
+            metadata_cache().invalidate(self.key)
+
+    def get_column_names(self, icols):
+        """
+        Returns a name for each column index: the header, or the index 
+        itself for blank or repeated headers. 
+        """
+        headers = self.headers or []
+        names = []
+        for icol in icols:
+            name = None
+            if (icol < len(headers)): name = headers[icol]
+            if (not name or name in names): name = icol
+            names.append(name)
+        return names
+
+    def get_columns(self, columns=None):
+        """
+        Returns the column names and, for each column, the texts and 
+        the numericValues of the data rows, as from CellStore.get_column. 
+        The columns may be given by header name or index, and default to 
+        all columns.  No Row or Cell objects are created. 
+        """
+        self.load_all()
+        if (columns == None): 
+            icols = range(0, self.max_col)
+        else:
+            icols = [self.get_column_index(key) for key in columns]
+        first_row = self.nheaders + 1
+        last_row = self.max_row
+        return (self.get_column_names(icols), 
+                [self._store.get_column(icol+1, first_row, last_row) 
+                 for icol in icols])
+
+    def to_columns(self, columns=None):
+        """
+        Returns the data as an OrderedDict from column name (cf. 
+        get_column_names) to a list of values, one per data row: the 
+        numericValue as a float where there is one, else the text, and 
+        None for a blank cell.
+        """
+        names, columns = self.get_columns(columns)
+        data = collections.OrderedDict()
+        for name,(texts, numbers) in zip(names, columns):
+            data[name] = [(text if num != num else num) 
+                          for text,num in zip(texts, numbers)]
+        return data
+
+    def to_numpy(self, dtype=float, columns=None):
+        """
+        Returns the data as a two-dimensional NumPy masked array, with 
+        a row for each data row and a column for each column.  For a 
+        numeric dtype the numericValues are used, and blank cells and 
+        cells without a numeric value are masked.  For other dtypes 
+        (such as object or str) the texts are used, and blank cells are 
+        masked; str and unicode without a size are sized to hold the 
+        longest text.  Requires numpy.
+        """
+        numpy = import_module('numpy')
+        if (numpy == None):
+            raise ImportError('to_numpy needs numpy')
+        dtype = numpy.dtype(dtype)
+        names, columns = self.get_columns(columns)
+        if (dtype.kind in 'SU' and dtype.itemsize == 0):
+            width = max([len(text) for texts,numbers in columns 
+                         for text in texts if text != None] + [1])
+            dtype = numpy.dtype((dtype.type, width))
+        nrows = self.max_row - self.nheaders
+        data = numpy.zeros((nrows, len(columns)), dtype=dtype)
+        mask = numpy.zeros((nrows, len(columns)), dtype=bool)
+        for j,(texts, numbers) in enumerate(columns):
+            if (dtype.kind in 'biuf'):
+                vals = numpy.frombuffer(numbers, dtype=float)
+                mask[:,j] = numpy.isnan(vals)
+                data[:,j] = numpy.where(mask[:,j], 0, vals)
+            else:
+                mask[:,j] = [(text == None) for text in texts]
+                if (dtype.kind == 'U'):
+                    data[:,j] = [(text or '').decode('utf-8') for text in texts]
+                else:
+                    data[:,j] = [(text or '') for text in texts]
+        return numpy.ma.masked_array(data, mask=mask)
+
+    def to_dataframe(self, columns=None):
+        """
+        Returns the data as a pandas DataFrame indexed by spreadsheet row 
+        number.  A column where every cell is numeric has dtype float64, 
+        with NaN for blank cells; other columns hold the values as in 
+        to_columns.  Requires pandas.
+        """
+        numpy = import_module('numpy')
+        pandas = import_module('pandas')
+        if (pandas == None):
+            raise ImportError('to_dataframe needs pandas')
+        names, columns = self.get_columns(columns)
+        data = {}
+        for j,(texts, numbers) in enumerate(columns):
+            if (all((text == None or num == num) 
+                    for text,num in zip(texts, numbers))):
+                data[j] = numpy.frombuffer(numbers, dtype=float).copy()
+            else:
+                data[j] = [(text if num != num else num) 
+                           for text,num in zip(texts, numbers)]
+        index = pandas.Index(range(self.nheaders+1, self.max_row+1), 
+                             name='row')
+        df = pandas.DataFrame(data, index=index, columns=range(len(names)))
+        df.columns = names
+        return df
+
+    def get_export_rows(self, rows=None):
+        """
+        Returns the header texts and an iterator over the data rows as 
+        lists of texts, with None for blank cells, for the exporters.  
+        The rows may be a worksheet, by default this one, which is read 
+        straight from its cell store, or a row source such as a 
+        RowStream from iter_rows. 
+        """
+        if (rows == None): rows = self
+        headers = [(cell and cell.text) for cell in rows.headers or []]
+        if (isinstance(rows, Worksheet)):
+            return headers, rows.iter_texts()
+        return headers, ([(cell and cell.text) for cell in row] 
+                         for row in rows)
+
+    def iter_texts(self):
+        """
+        Yields the data rows as lists of texts, without creating Row or 
+        Cell objects.
+        """
+        self.load_all()
+        store = self._store
+        for row_num in xrange(self.nheaders+1, self.max_row+1):
+            yield store.get_row_texts(row_num)
+
+    def write_csv(self, f, rows=None, **kwargs):
+        """
+        Writes the header row and the rows as CSV.  The rows may be given 
+        as for get_export_rows.  Other arguments are passed to csv.writer.
+        """
+        headers, texts = self.get_export_rows(rows)
+        buf = cStringIO.StringIO()
+        writer = csv.writer(buf, **kwargs)
+        writer.writerow([(text or '') for text in headers])
+        for i,vals in enumerate(texts):
+            writer.writerow([(text or '') for text in vals])
+            if ((i + 1) % export_buffer_rows == 0):
+                f.write(buf.getvalue())
+                buf.seek(0)
+                buf.truncate()
+        f.write(buf.getvalue())
 
-    def get_headers(self):
+    def write_jsonl(self, f, rows=None):
         """
-        This returns a single header row.  If there are multiple header 
-        rows, it returns only the last one.  
+        Writes each row as a JSON object on its own line, with the 
+        non-blank cells keyed by column name (cf. get_export_name).  The 
+        rows may be given as for get_export_rows.
         """
-        if (not self.has_data()): self.load_data()
-        if (self._header_rows): return self._header_rows[-1]
-        else: return None
-    def set_headers(self, vals):
+        headers, texts = self.get_export_rows(rows)
+        # Encode the keys once, and the texts with json's own string 
+        # encoder, rather than calling json.dumps for every row.
+        encode = json.encoder.encode_basestring_ascii
+        keys = []
+        parts = []
+        for vals in texts:
+            while (len(keys) < len(vals)): 
+                keys.append(encode(get_export_name(headers, len(keys))) 
+                            + ': ')
+            parts.append('{%s}\n' % ', '.join(
+                    [keys[i] + encode(text) for i,text in enumerate(vals) 
+                     if text != None]))
+            if (len(parts) >= export_buffer_rows): 
+                f.write(''.join(parts))
+                del parts[:]
+        f.write(''.join(parts))
+
+    def write_xml(self, f, rows=None):
         """
-        This sets the header values in the worksheet.
+        Writes the rows as XML, tagging cells by header.  The rows may 
+        be given as for get_export_rows, e.g. as a RowStream from 
+        iter_rows to write a large worksheet without loading it. 
         """
-        self.set_row(self.headers.row, vals)
-        
-    headers = property(get_headers, set_headers)
+        headers, texts = self.get_export_rows(rows)
+        tags = []
+        parts = ["<worksheet>\n"]
+        for vals in texts:
+            while (len(tags) < len(vals)): 
+                name = get_export_name(headers, len(tags))
+                tag = re.sub(r'\W', '', name) or 'col%d' % (len(tags)+1)
+                # XML names cannot start with a digit
+                if (tag[0].isdigit()): tag = '_' + tag
+                tags.append(('<%s>' % tag, '</%s>\n' % tag))
+            parts.append("<row>\n")
+            for i,text in enumerate(vals):
+                parts.append(tags[i][0])
+                if (text): parts.append(xml.sax.saxutils.escape(text))
+                parts.append(tags[i][1])
+            parts.append("</row>\n\n")
+            if (len(parts) >= 16*export_buffer_rows): 
+                f.write(''.join(parts))
+                del parts[:]
+        parts.append("</worksheet>\n")
+        f.write(''.join(parts))
 
-    def get_all_header_rows(self):
+    def get_fullname(self):
+        return '"%s" in spreadsheet "%s"' % (self.title, self.sstitle)
+
+    def __repr__(self):
+        return '<gdata wksht "%s">' % self.title
+
+######################################################################
+class WriteBehind(object):
+    """
+    The background thread of a worksheet in write-behind mode.  When 
+    notified of a queued write, it waits delay seconds for more writes 
+    and then flushes the worksheet, passing any error to 
+    on_error(worksheet, exception) or logging it.
+    """
+    def __init__(self, worksheet, delay, on_error=None):
+        self.worksheet = worksheet
+        self.delay = delay
+        self.on_error = on_error
+        self._cond = threading.Condition()
+        self._notified = False
+        self._stopped = False
+        self.thread = threading.Thread(
+            target=self.run, name='write-behind %s' % worksheet.title)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def notify(self):
+        with self._cond:
+            self._notified = True
+            self._cond.notify()
+
+    def stop(self):
         """
-        Returns all header rows as a two-dimensional array. 
+        Stops the thread, waiting for any flush in progress.
         """
-        if (not self.has_data()): self.load_data()
-        return self._header_rows
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if (self.thread != threading.current_thread()):
+            self.thread.join()
 
-    def init_cell(self, row_num, col_num, cell):
-        irow = row_num - self.nheaders - 1
-        icol = col_num - 1
-        logging.debug('Adding cell at irow %d, icol %d' % (irow, icol))
-        for blank_row_num in range(self.max_row+1 , row_num+1):
-            logging.debug('Adding blank row to worksheet')
-            self._rows.append( Row(self, blank_row_num) )
-        row = self._rows[irow]
-        new_cell = Cell(self, cell, row=row_num, col=col_num)
-        if (col_num > self._max_col): self._max_col = col_num
-        # Force normal list behavior for the Row class using super(...).
-        # Otherwise setitem will try to update the worksheet.
-        row._set_local(icol, new_cell)
-        
-    def get_max_row(self):
-        return len(self.rows) + self.nheaders
-    max_row = property(get_max_row, None)
+    def run(self):
+        while True:
+            with self._cond:
+                while (not (self._notified or self._stopped)):
+                    self._cond.wait()
+                if (self._stopped): return
+                # Let more writes queue up, unless stopped meanwhile
+                deadline = time.time() + self.delay
+                while (not self._stopped and time.time() < deadline):
+                    self._cond.wait(deadline - time.time())
+                if (self._stopped): return
+                self._notified = False
+            try:
+                self.worksheet.flush()
+            except Exception, e:
+                if (self.on_error != None):
+                    try:
+                        self.on_error(self.worksheet, e)
+                    except Exception:
+                        logging.exception('Error in write-behind callback')
+                else:
+                    logging.error('Write-behind to worksheet "%s" failed: %s'
+                                  % (self.worksheet.title, e))
 
-    def get_max_col(self):
-        if (not self.has_data()): self.load_data()
-        return self._max_col
-    max_col = property(get_max_col, None)
+######################################################################
+class AsyncWorksheet(object):
+    """
+    An asyncio interface to a Worksheet.  The methods that talk to 
+    Google Docs return futures to await, and run the blocking calls on 
+    a bounded thread pool (cf. run_async), so requests for many 
+    worksheets can be in flight at once.  Calls on one worksheet run 
+    one at a time, in order.  The rows are the same in-memory Row and 
+    Cell objects as for the underlying worksheet attribute, and can be 
+    read once loaded (with load_all for a paged worksheet):
 
-    def get_row(self, row_num):
+    ws = await aworksheet(key, title='worksheet 1')
+    await ws.load()
+    for row in ws:
+        print(row['Email'])
+    await ws.set_row(2, ['a', 'b'])
+    """
+    def __init__(self, worksheet, loop=None):
+        self.worksheet = worksheet
+        self.loop = loop
+        # Future of the last call started on this worksheet
+        self._last = None
+
+    def run(self, func, *args):
         """
-        Get row by the spreadsheet row number, starting with 1 for the 
-        first row - which might be a header row.
+        Returns a future for func(*args), which is run on the thread 
+        pool once the calls made before it on this worksheet are done.  
+        The calls are chained on the event loop, so those waiting their 
+        turn do not hold pool threads. 
         """
-        if (row_num <= self.nheaders):
-            return self.get_all_header_rows()[row_num-1]
+        asyncio = import_module('asyncio', 'trollius')
+        if (asyncio == None):
+            raise ImportError('The async interface needs asyncio (or trollius)')
+        loop = self.loop or asyncio.get_event_loop()
+        result = asyncio.Future(loop=loop)
+        def finish(future):
+            if (result.cancelled()): return
+            if (future.cancelled()): 
+                result.cancel()
+            elif (future.exception() != None): 
+                result.set_exception(future.exception())
+            else:
+                result.set_result(future.result())
+        def start(previous=None):
+            if (result.cancelled()): return
+            try:
+                future = run_async(func, *args, loop=loop)
+            except Exception, e:
+                result.set_exception(e)
+                return
+            future.add_done_callback(finish)
+        if (self._last == None): 
+            start()
         else:
-            return self.rows[row_num-self.nheaders-1]
+            self._last.add_done_callback(start)
+        self._last = result
+        return result
+
+    def load(self):
+        return self.run(self.worksheet.load_data)
+
+    def load_all(self):
+        return self.run(self.worksheet.load_all)
+
+    def reload(self, incremental=False):
+        return self.run(self.worksheet.reload, incremental)
 
     def set_row(self, row_num, vals=[]):
+        return self.run(self.worksheet.set_row, row_num, vals)
+
+    def set_cell(self, row_num, key, val):
         """
-        Set row by the spreadsheet row number, starting with 1 for the 
-        first row - which might be a header row.
+        Sets one cell, by spreadsheet row number and column index or 
+        header name. 
         """
-        row_data = RowData(self, vals)
-        row = self.get_row(row_num)
-        for i,val in enumerate(row_data):
-            if (row[i] != val): row[i] = val
+        def set_cell():
+            self.worksheet.get_row(row_num)[key] = val
+        return self.run(set_cell)
 
-    def __setitem__(self, irow, vals):
-        self.set_row(self[irow].row, vals)
+    def append(self, vals=[], overwrite=True):
+        return self.run(self.worksheet.append, vals, overwrite)
+
+    def extend(self, rows):
+        return self.run(self.worksheet.extend, rows)
+
+    def delete_row(self, row_num):
+        def delete_row():
+            self.worksheet.get_row(row_num).delete()
+        return self.run(delete_row)
+
+    def flush(self):
+        return self.run(self.worksheet.flush)
+
+    def get_title(self):
+        return self.worksheet.title
+    title = property(get_title, None)
+
+    def check_loaded(self):
+        """
+        Raises ValueError unless all the rows are loaded, so that 
+        reading them cannot block the event loop on a request. 
+        """
+        ws = self.worksheet
+        if ((not ws.has_data()) or 
+            (ws.is_paged() and (0 in ws._rows.loaded or 
+                                not ws._rows.complete))):
+            raise ValueError('Worksheet "%s" is not loaded: await load(), '
+                             'or load_all() if it is paged' % ws.title)
 
     def __len__(self):
-        return self.rows.__len__()
+        self.check_loaded()
+        return len(self.worksheet)
 
     def __getitem__(self, key):
-        return self.rows.__getitem__(key)
+        self.check_loaded()
+        return self.worksheet[key]
 
     def __iter__(self):
-        return self.rows.__iter__()
+        self.check_loaded()
+        return iter(self.worksheet)
 
-    def __contains__(self, item):
-        return self.rows.__contains__(item)
+    def __repr__(self):
+        return '<async %r>' % self.worksheet
 
-    def append(self, vals=[], overwrite=True):
+######################################################################
+class RowList(collections.MutableSequence):
+    """
+    This acts as the list of data rows of a worksheet.  Row objects are 
+    views created from the worksheet cell store when accessed, and are 
+    shared for as long as anything refers to them, so a worksheet only 
+    holds Row and Cell objects for the rows in use.  On a paged 
+    worksheet, getting a row that is not loaded yet reads its page. 
+
+    It behaves as a list of the rows, except that positions stay tied 
+    to spreadsheet rows: assigning to an item writes the row as 
+    Worksheet.set_row does, deleting items drops them locally as pop 
+    does, rows can only be added at the end, and sort and reverse 
+    raise TypeError (use sorted or reversed instead). 
+    """
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        # One byte per row: 0 until a row on a paged worksheet is read
+        self.loaded = bytearray()
+        # False while a paged worksheet may have rows after these
+        self.complete = True
+        self._views = weakref.WeakValueDictionary()
+
+    def get_row(self, irow):
+        row_num = self.worksheet.nheaders + irow + 1
+        if (not self.loaded[irow]): self.worksheet.load_row(row_num)
+        row = self._views.get(irow)
+        if (row == None):
+            row = self.worksheet.make_row(row_num)
+            self._views[irow] = row
+        return row
+
+    def grow(self, irow):
         """
-        Appends the specified data to the worksheet.  Note that if there 
-        are blank lines at the end of the worksheet, this will write onto 
-        those.  
+        Reads pages of a paged worksheet until the row index irow is 
+        reached or the rows are known to end before it. 
         """
-        row_data = RowData(self, vals)
+        while (not self.complete and irow >= len(self.loaded)):
+            self.worksheet.load_next_rows()
 
-        # Frustratingly, for InsertRow, gdata does not allow inserting 
-        # an empty data. It only accepts column *name* to specify the 
-        # column, but also changes the column name by an undocumented 
-        # process - cf. Worksheet.get_coltags()
-        # 
-        # The process is collected in the RowData and RowDataVal classes.
+    def __len__(self):
+        if (not self.complete): self.worksheet.find_last_row()
+        return len(self.loaded)
 
-        # Standard append adds to content, not data.  If header rows 
-        # are blank, they should be temporarily filled in.  
-        blank_rows = []
-        for row in self.get_all_header_rows():
-            if (not row): 
-                row[0] = ' '
-                blank_rows.append(row)
+    def __getitem__(self, key):
+        if (isinstance(key, slice)):
+            return [self.get_row(i) for i in range(*key.indices(len(self)))]
+        if (key < 0): 
+            key += len(self)
+        else:
+            self.grow(key)
+        if (key < 0 or key >= len(self.loaded)):
+            raise IndexError('row index out of range')
+        return self.get_row(key)
 
-        # Insert in values via gdata API
-        res = InsertRow(row_data.insert_vals, 
-                        key=self.key, wksht_id=self.wksht_id)
+    def __iter__(self):
+        i = 0
+        while True:
+            if (i >= len(self.loaded)):
+                self.grow(i)
+                if (i >= len(self.loaded)): return
+            yield self.get_row(i)
+            i += 1
 
-        for row in blank_rows: row[0] = None
+    def __contains__(self, item):
+        for row in self:
+            if (row == item): return True
+        return False
 
-        # Create a blank row in internal representation
-        new_row_num = self.max_row+1
-        self.rows.append( Row(self, new_row_num) )
+    def __setitem__(self, key, vals):
+        if (isinstance(key, slice)):
+            irows = range(*key.indices(len(self)))
+            vals = list(vals)
+            if (len(vals) != len(irows)):
+                raise ValueError('Cannot change the number of rows by '
+                                 'assigning to a slice')
+            for irow, row_vals in zip(irows, vals): self[irow] = row_vals
+            return
+        self.worksheet.set_row(self[key].row, vals)
 
-        # Force creation of the new values, because InsertRow is 
-        # unreliable.  Example: new row has more columns than 
-        # previously used, then silently the new values don't show up. 
-        for val in row_data:
-            if (overwrite and val and (val.coltag not in res.custom)):
-                self[-1][val.icol] = val.val
-            else:
-                self[-1]._set_local(val.icol, val.val)
-        # Remove the added space for a blank row using UpdateCell.
-        if (row_data.is_blank()): self[-1][0] = None
+    def __delitem__(self, key):
+        if (isinstance(key, slice)):
+            irows = sorted(set(range(*key.indices(len(self)))))
+            if (irows): self.delete_rows(irows)
+        else:
+            self.pop(key)
 
-    def write_xml(self, f):
-        f.write("<worksheet>\n")
-        for row in self:
-            f.write("<row>\n")
-            for i,cell in enumerate(row):
-                tagname = re.sub(r'\W', '', self.headers[i])
-                if (cell and cell.text):
-                    val = xml.sax.saxutils.escape(cell.text)
-                else:
-                    val = ''
-                f.write("<%s>%s</%s>\n" % (tagname, val, tagname))
-            f.write("</row>\n\n")
-        f.write("</worksheet>\n")
+    def __add__(self, other):
+        return list(self) + list(other)
 
-    def get_fullname(self):
-        return '"%s" in spreadsheet "%s"' % (self.title, self.sstitle)
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __eq__(self, other):
+        if (not isinstance(other, (list, RowList))): return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        if (not isinstance(other, (list, RowList))): return NotImplemented
+        return list(self) != list(other)
+
+    __hash__ = None
 
     def __repr__(self):
-        return '<gdata wksht "%s">' % self.title
+        return repr(list(self))
+
+    def insert(self, irow, row):
+        if (irow < len(self)):
+            raise TypeError('Rows can only be added at the end')
+        self.append(row)
+
+    def sort(self, *args, **kwargs):
+        raise TypeError('Worksheet rows stay in spreadsheet order; '
+                        'use sorted() instead')
+
+    def reverse(self):
+        raise TypeError('Worksheet rows stay in spreadsheet order; '
+                        'use reversed() instead')
+
+    def append(self, row):
+        self.extend([row])
+
+    def extend(self, rows):
+        """
+        Adds Row objects at the end.  Their cells must already be in the 
+        cell store, which Row._set_local takes care of.
+        """
+        for row in rows:
+            self._views[len(self.loaded)] = row
+            self.loaded.append(1)
+
+    def extend_blank(self, n, loaded=True):
+        self.loaded.extend(bytearray([int(loaded)]) * n)
+
+    def delete_rows(self, irows):
+        """
+        Removes the rows with the given sorted indices at once, shifting 
+        the cells of the other rows up in the store and renumbering 
+        their live Row and Cell objects.
+        """
+        ws = self.worksheet
+        row_nums = [ws.nheaders + i + 1 for i in irows]
+        ws._store.delete_row_set(row_nums)
+        ws.delete_from_indexes(row_nums)
+        deleted = set(irows)
+        self.loaded = bytearray([b for i,b in enumerate(self.loaded) 
+                                 if i not in deleted])
+        views = self._views.items()
+        self._views = weakref.WeakValueDictionary()
+        for i,view in views:
+            if (i in deleted): continue
+            shift = bisect.bisect_left(irows, i)
+            if (shift):
+                view.row -= shift
+                for cell in view:
+                    if (cell != None): cell.row -= shift
+            self._views[i-shift] = view
+
+    def pop(self, irow=-1):
+        """
+        Removes a row, shifting the cells of the following rows up in 
+        the store and renumbering their live Row and Cell objects.
+        """
+        if (irow < 0): irow += len(self)
+        row = self.get_row(irow)
+        self.worksheet._store.delete_rows(row.row)
+        self.worksheet.delete_from_indexes([row.row])
+        del self.loaded[irow]
+        views = self._views.items()
+        self._views = weakref.WeakValueDictionary()
+        for i,view in views:
+            if (i < irow):
+                self._views[i] = view
+            elif (i > irow):
+                view.row -= 1
+                for cell in view:
+                    if (cell != None): cell.row -= 1
+                self._views[i-1] = view
+        return row
+
+    def refresh(self, start, stop):
+        """
+        Re-reads the live Row objects in a range from the cell store.
+        """
+        for i in range(start, stop):
+            row = self._views.get(i)
+            if (row != None): row._refresh()
 
 ######################################################################
 class RowData(list):
@@ -600,16 +3547,18 @@ class RowData(list):
         if (hasattr(data, 'keys')):
             # Input is a map: convert to list based on header names.
             self.extend( [None] * len(worksheet.headers) )
+            header_map = worksheet.header_map
             for key,val in data.items():
-                if (key not in worksheet.headers): 
+                if (key not in header_map): 
                     raise ValueError('Invalid column key "%s"' % key)
                 elif (val not in [None, '']):
-                    i = worksheet.headers.index(key)
+                    i = header_map[key]
                     self[i] = RowDataVal(i, val)
         else:
             self.extend( [RowDataVal(i,val) for i,val in enumerate(data)] )
         # Now assign the coltags
-        for i,tag in enumerate(worksheet.coltags):
+        self.coltags = worksheet.coltags
+        for i,tag in enumerate(self.coltags):
             if ((i < len(self)) and self[i]):
                 self[i].coltag = tag
 
@@ -622,8 +3571,8 @@ class RowData(list):
         # blank because InsertRow does not accept empty data.
         # In these cases, make sure that the correct blank 
         # is over-written later.
-        if (not vals and self.worksheet.coltags):
-            insert_vals[self.worksheet.coltags[0]] = ' '
+        if (not vals and self.coltags):
+            vals[self.coltags[0]] = ' '
         return vals
     insert_vals = property(get_insert_vals, None)
 
@@ -647,11 +3596,24 @@ class Row(list):
         self.worksheet = worksheet
         self.row = row
 
+    def is_loaded(self):
+        """
+        False until the cells of a row on a paged worksheet are read.
+        """
+        return self.worksheet.is_row_loaded(self.row)
+    loaded = property(is_loaded, None)
+
     def get_headers(self):
         return self.worksheet.headers
     headers = property(get_headers, None)
 
+    def get_header_map(self):
+        return self.worksheet.header_map
+    header_map = property(get_header_map, None)
+
     def delete(self):
+        # Send queued writes before they are compared and renumbered
+        if (self.worksheet._pending): self.worksheet.flush()
         # This uses unhelpful gdata ListFeed to delete the row.
         # gdata ListFeed always assumes one header row, and doesn't 
         # allow access to column numbers.
@@ -665,29 +3627,26 @@ class Row(list):
         if (obj_vals != gdata_vals):
             raise ValueError("Mismatch of gdata and internal values!!\nobj %s\ngdata %s" % (obj_vals, gdata_vals))
         # Delete the row from Google Docs
-        spreadsheet_service().DeleteRow(sslist)
+        DeleteRow(sslist)
         # Delete the row from the Google Docs list feed
         del self.worksheet.list_feed.entry[self.row - 2]
-        # Pop the correct Row obj from the internal representation
+        # Pop the correct Row obj from the internal representation. 
+        # This also renumbers the following rows.
         x = self.worksheet._rows.pop(irow)
         logging.info("Deleting row %s" % x)
-        logging.debug("Decrementing row number for following rows")
-        for i in range(self.row-2, len(self.worksheet)):
-            if (len(self.worksheet) > i):
-                self.worksheet[i].row -= 1
-                for cell in self.worksheet[i]:
-                    if (cell): cell.row -= 1
 
     def get_index_of_key(self, key):
-        if (key in self.headers): 
-            return self.headers.index(key)
-        else: 
-            try:
-                return int(key)
-            except Exception, e:
-                raise KeyError('Key "%s" not found in %s' % (key, self))
+        try:
+            return self.header_map[key]
+        except (KeyError, TypeError), e:
+            pass
+        try:
+            return int(key)
+        except Exception, e:
+            raise KeyError('Key "%s" not found in %s' % (key, self))
 
     def __getitem__(self, key):
+        if (not self.loaded): self.worksheet.load_row(self.row)
         ind = self.get_index_of_key(key)
         if (len(self) > ind):
             return super(Row, self).__getitem__(ind)
@@ -701,9 +3660,20 @@ class Row(list):
             return default
 
     def _set_local(self, icol, new_val):
+        if (new_val != None and not isinstance(new_val, Cell)):
+            new_val = Cell.from_values(self.worksheet, self.row, icol+1, 
+                                       '%s' % new_val)
         while (len(self) <= icol): 
             super(Row, self).append(None)
         super(Row, self).__setitem__(icol, new_val)
+        self.worksheet.store_cell(self.row, icol+1, new_val)
+
+    def _refresh(self):
+        """
+        Re-reads the cells of this row from the worksheet cell store.
+        """
+        del self[:]
+        list.extend(self, self.worksheet.get_row_cells(self.row))
 
     def __setitem__(self, key, new_val):
         """
@@ -718,20 +3688,28 @@ class Row(list):
         row = self.row
         col = icol + 1
         if (new_val == self[icol]):
-            logging.info('No change to cell value "%s"' % self[icol])
+            logging.info('No change to cell value "%s"', self[icol])
             return
         ws = self.worksheet
-        gdata_cell = UpdateCell(row, col, new_val, ws.key, ws.wksht_id)
-        if (new_val):
-            new_cell = Cell(self, gdata_cell, row=row, col=col)
+        if (ws.is_batching()):
+            gdata_cell = None
         else:
-            new_cell = None
-        while (len(self) < col):
-            self.append(None)
-        # Use super to force the normal list behavior for setitem
-        self._set_local(icol, new_cell)
-        # To fit pattern, remove trailing None items in list
-        while (self and self[-1] == None): self.pop(-1)
+            gdata_cell = UpdateCell(row, col, new_val, ws.key, ws.wksht_id)
+        # Queue and set locally together, so a write-behind flush in 
+        # another thread can't apply an older value after this one
+        with ws._write_lock:
+            if (gdata_cell == None):
+                gdata_cell = ws.queue_update(row, col, new_val, self[icol])
+            if (new_val):
+                new_cell = Cell(ws, gdata_cell, row=row, col=col)
+            else:
+                new_cell = None
+            while (len(self) < col):
+                self.append(None)
+            # Use super to force the normal list behavior for setitem
+            self._set_local(icol, new_cell)
+            # To fit pattern, remove trailing None items in list
+            while (self and self[-1] == None): self.pop(-1)
         # Check if we need to revise max_col
         if (len(self) > self.worksheet.max_col):
             self.worksheet._max_col = len(self)
@@ -740,20 +3718,183 @@ class Row(list):
         return '<Row %s of %s>' % (row.row, row.worksheet.fullname)
     display = property(get_display, None)
 
+class StreamRow(Row):
+    """
+    A read-only row produced by a RowStream.  Its cells are not stored 
+    in the worksheet, and its headers are those read by the stream.
+    """
+    loaded = True
+
+    def __init__(self, stream, row, cells):
+        Row.__init__(self, stream.worksheet, row)
+        list.extend(self, cells)
+        self.stream = stream
+
+    def get_headers(self):
+        return self.stream.headers
+    headers = property(get_headers, None)
+
+    def get_header_map(self):
+        return self.stream.header_map
+    header_map = property(get_header_map, None)
+
+    def delete(self):
+        raise TypeError('Rows from iter_rows or select are read-only')
+
+    def __setitem__(self, key, new_val):
+        raise TypeError('Rows from iter_rows or select are read-only')
+
+class RowStream(object):
+    """
+    Iterates over the data rows of a worksheet, reading the cells feed 
+    a window of chunk_rows rows at a time.  Blank rows between data 
+    rows are produced as empty rows, as when loading the whole sheet, 
+    and trailing blank rows are dropped.  If cols is set to a slice, 
+    only those columns of the data rows are read. 
+    """
+    def __init__(self, worksheet, chunk_rows):
+        self.worksheet = worksheet
+        self.chunk_rows = chunk_rows
+        self.cols = None
+        self._header_rows = None
+        self._header_map = None
+
+    def get_header_rows(self):
+        ws = self.worksheet
+        if (self._header_rows == None):
+            if (ws.has_data()):
+                self._header_rows = ws.get_all_header_rows()
+            elif (ws.nheaders > 0):
+                rows = self.read_rows(1, ws.nheaders)
+                self._header_rows = [rows.get(i, []) 
+                                     for i in range(1, ws.nheaders+1)]
+            else:
+                self._header_rows = []
+        return self._header_rows
+    header_rows = property(get_header_rows, None)
+
+    def get_headers(self):
+        if (self.header_rows): return self.header_rows[-1]
+        else: return None
+    headers = property(get_headers, None)
+
+    def get_header_map(self):
+        if (self._header_map == None):
+            self._header_map = make_header_map(self.headers)
+        return self._header_map
+    header_map = property(get_header_map, None)
+
+    def get_column_index(self, key):
+        """
+        Returns the column index, as for Worksheet.get_column_index, 
+        without loading the worksheet.
+        """
+        try:
+            return self.header_map[key]
+        except (KeyError, TypeError), e:
+            pass
+        try:
+            return int(key)
+        except Exception, e:
+            raise KeyError('Key "%s" not found in %s' % (key, self.worksheet))
+
+    def read_rows(self, min_row, max_row, cols=None):
+        """
+        Reads one window of rows, returning a dict of StreamRows by 
+        spreadsheet row number for the rows that have any cells. 
+        """
+        ws = self.worksheet
+        feed, values = ws.read_cells(min_row, max_row, cols=cols)
+        rows = {}
+        for (row_num, col_num, text, input_value, numeric_value) in values:
+            row = rows.get(row_num)
+            if (row == None): 
+                row = rows[row_num] = StreamRow(self, row_num, [])
+            while (len(row) < col_num): list.append(row, None)
+            list.__setitem__(row, col_num-1, Cell.from_values(
+                    ws, row_num, col_num, text, input_value, numeric_value))
+        return rows
+
+    def __iter__(self):
+        ws = self.worksheet
+        if (ws.has_data() and not ws.is_paged()):
+            for row in ws: yield row
+            return
+        self.get_header_rows()
+        nrows = int(ws.data.row_count.text)
+        next_row = ws.nheaders + 1
+        for start in xrange(next_row, nrows+1, self.chunk_rows):
+            stop = min(start + self.chunk_rows - 1, nrows)
+            rows = self.read_rows(start, stop, self.cols)
+            for row_num in sorted(rows):
+                for blank_num in xrange(next_row, row_num):
+                    yield StreamRow(self, blank_num, [])
+                yield rows[row_num]
+                next_row = row_num + 1
+
+class Selection(list):
+    """
+    The rows returned by Worksheet.select.  With columns, each row 
+    holds only those columns, in that order, and the headers and 
+    header_map are those of the columns. 
+    """
+    def __init__(self, worksheet, headers, icols=None):
+        list.__init__(self)
+        self.worksheet = worksheet
+        self.icols = icols
+        if (icols != None):
+            headers = [(headers[icol] if (headers and icol < len(headers))
+                        else None) for icol in icols]
+        self.headers = headers
+        self.header_map = make_header_map(headers)
+
+    def add(self, row):
+        if (self.icols != None):
+            cells = [(row[icol] if (icol < len(row)) else None) 
+                     for icol in self.icols]
+            while (cells and cells[-1] == None): cells.pop(-1)
+            row = StreamRow(self, row.row, cells)
+        self.append(row)
+
 class Cell(str):
+    """
+    A cell acts as its text string, with the row and column numbers and 
+    the inputValue and numericValue of the spreadsheet cell.  Cells are 
+    created from the worksheet cell store only when their row is used.
+    """
     def __new__(cls, worksheet, cell, row=None, col=None):
         if ((row==None) or (col==None)):
             raise ValueError("Must specify row and column explicitly")
-        text = cell.cell.text
+        return cls.from_values(worksheet, row, col, cell.cell.text, 
+                               cell.cell.inputValue, cell.cell.numericValue)
+
+    @classmethod
+    def from_values(cls, worksheet, row, col, text, input_value=None, 
+                    numeric_value=None):
         if (text == None): text = ''
         obj = super(Cell, cls).__new__(cls, text)
         obj.worksheet = worksheet
-        obj.text = cell.cell.text
-        obj.data = cell
-        obj.row = int(row)
+        obj.text = text
+        obj.input_value = text if (input_value == None) else input_value
+        if (numeric_value != None): numeric_value = float(numeric_value)
+        obj.numeric_value = numeric_value
+        obj.row = None if (row == None) else int(row)
         obj.col = int(col)
         return obj
 
+    def get_data(self):
+        """
+        Returns a gdata cell entry equivalent to this cell. 
+        """
+        numeric_value = None
+        if (self.numeric_value != None): numeric_value = repr(self.numeric_value)
+        return gdata.spreadsheet.SpreadsheetsCell(
+            cell=gdata.spreadsheet.Cell(text=self.text, row=str(self.row), 
+                                        col=str(self.col), 
+                                        inputValue=self.input_value, 
+                                        numericValue=numeric_value))
+    data = property(get_data, None)
+
     def get_colname(self):
         if (len(self.worksheet.headers) >= self.col):
             return self.worksheet.headers[self.col-1]
@@ -775,7 +3916,7 @@ class Cell(str):
         return (self.href != None)
 
     def get_href(self):
-        val = self.data.cell.inputValue
+        val = self.input_value
         match = re.search(r'HYPERLINK\(([\"\'])(.*?)\1.*\)', val, re.I)
         if (match):
             return match.group(2)
@@ -784,3 +3925,178 @@ class Cell(str):
     href = property(get_href, None)
 
 ######################################################################
+class CellStore(object):
+    """
+    Compact columnar storage for the cells of a worksheet.  Each column 
+    holds an array of ids into a table of interned strings for the cell 
+    text and for the inputValue (0 meaning it is the same as the text), 
+    and an array of numericValue floats (NaN if absent) allocated only 
+    once the column has a number.  A text id of 0 marks a missing cell, 
+    so the text arrays double as the validity bitmap. 
+
+    Rows and columns are numbered from 1, as in the spreadsheet.
+    """
+    def __init__(self):
+        self.nrows = 0
+        self.strings = [None]
+        self.string_ids = {}
+        self.text_ids = []
+        self.input_ids = []
+        self.numbers = []
+
+    def intern(self, text):
+        sid = self.string_ids.get(text)
+        if (sid == None):
+            sid = len(self.strings)
+            self.strings.append(text)
+            self.string_ids[text] = sid
+        return sid
+
+    def get_ncols(self):
+        return len(self.text_ids)
+    ncols = property(get_ncols, None)
+
+    def grow(self, nrows, ncols):
+        if (nrows > self.nrows):
+            n = nrows - self.nrows
+            for c in range(0, self.ncols):
+                self.text_ids[c].extend(array.array('i', [0]) * n)
+                self.input_ids[c].extend(array.array('i', [0]) * n)
+                if (self.numbers[c] != None):
+                    self.numbers[c].extend(array.array('d', [_nan]) * n)
+            self.nrows = nrows
+        while (ncols > self.ncols):
+            self.text_ids.append(array.array('i', [0]) * self.nrows)
+            self.input_ids.append(array.array('i', [0]) * self.nrows)
+            self.numbers.append(None)
+
+    def set(self, row, col, text, input_value=None, numeric_value=None):
+        if (row > self.nrows or col > self.ncols): 
+            self.grow(row, col)
+        r = row - 1
+        c = col - 1
+        if (text == None): text = ''
+        self.text_ids[c][r] = self.intern(text)
+        if (input_value == None or input_value == text):
+            self.input_ids[c][r] = 0
+        else:
+            self.input_ids[c][r] = self.intern(input_value)
+        if (numeric_value != None):
+            if (self.numbers[c] == None):
+                self.numbers[c] = array.array('d', [_nan]) * self.nrows
+            self.numbers[c][r] = float(numeric_value)
+        elif (self.numbers[c] != None):
+            self.numbers[c][r] = _nan
+
+    def clear(self, row, col):
+        if (row <= self.nrows and col <= self.ncols):
+            self.set(row, col, None)
+            self.text_ids[col-1][row-1] = 0
+
+    def get(self, row, col):
+        """
+        Returns (text, inputValue, numericValue) for a cell, or None if 
+        there is no cell there.
+        """
+        if (row > self.nrows or col > self.ncols): return None
+        r = row - 1
+        c = col - 1
+        tid = self.text_ids[c][r]
+        if (not tid): return None
+        iid = self.input_ids[c][r] or tid
+        numeric_value = None
+        if (self.numbers[c] != None):
+            numeric_value = self.numbers[c][r]
+            if (numeric_value != numeric_value): numeric_value = None
+        return (self.strings[tid], self.strings[iid], numeric_value)
+
+    def get_row(self, row):
+        """
+        Returns the cell values of a row as a list, with None for missing 
+        cells and without trailing missing cells.
+        """
+        vals = []
+        if (row > self.nrows): return vals
+        for c in range(0, self.ncols):
+            if (self.text_ids[c][row-1]): 
+                vals.append(self.get(row, c+1))
+            else:
+                vals.append(None)
+        while (vals and vals[-1] == None): vals.pop(-1)
+        return vals
+
+    def get_column(self, col, first_row, last_row):
+        """
+        Returns the cells of a column from first_row to last_row as a 
+        list of texts, with None for missing cells, and an array of 
+        numericValues, with NaN where there is none. 
+        """
+        n = max(last_row - first_row + 1, 0)
+        r = first_row - 1
+        stop = min(last_row, self.nrows)
+        if (col > self.ncols or r >= stop):
+            return [None] * n, array.array('d', [_nan]) * n
+        strings = self.strings
+        texts = [strings[tid] for tid in self.text_ids[col-1][r:stop]]
+        if (self.numbers[col-1] != None):
+            numbers = self.numbers[col-1][r:stop]
+        else:
+            numbers = array.array('d', [_nan]) * (stop - r)
+        texts.extend([None] * (n - len(texts)))
+        numbers.extend(array.array('d', [_nan]) * (n - len(numbers)))
+        return texts, numbers
+
+    def delete_rows(self, row, n=1):
+        """
+        Removes n rows starting at the given row, shifting later rows up.
+        """
+        r = row - 1
+        for c in range(0, self.ncols):
+            del self.text_ids[c][r:r+n]
+            del self.input_ids[c][r:r+n]
+            if (self.numbers[c] != None): del self.numbers[c][r:r+n]
+        self.nrows = max(self.nrows - n, r)
+
+    def get_row_texts(self, row):
+        """
+        Returns the texts of a row as a list, as for get_row.
+        """
+        if (row > self.nrows): return []
+        strings = self.strings
+        r = row - 1
+        texts = [strings[text_ids[r]] for text_ids in self.text_ids]
+        while (texts and texts[-1] == None): texts.pop(-1)
+        return texts
+
+    def has_formulas(self):
+        """
+        True if the inputValue of any cell is a formula. 
+        """
+        formula_ids = set(sid for sid,text in enumerate(self.strings) 
+                          if (text and text.startswith('=')))
+        if (not formula_ids): return False
+        for text_ids, input_ids in zip(self.text_ids, self.input_ids):
+            if (formula_ids.isdisjoint(text_ids) and 
+                formula_ids.isdisjoint(input_ids)): continue
+            for tid, iid in itertools.izip(text_ids, input_ids):
+                if (tid and (iid or tid) in formula_ids): return True
+        return False
+
+    def delete_row_set(self, rows):
+        """
+        Removes the given rows, which need not be contiguous, in one 
+        pass, shifting the other rows up.
+        """
+        deleted = set(r-1 for r in rows)
+        keep = [r for r in xrange(0, self.nrows) if r not in deleted]
+        for c in range(0, self.ncols):
+            text_ids = self.text_ids[c]
+            input_ids = self.input_ids[c]
+            self.text_ids[c] = array.array('i', [text_ids[r] for r in keep])
+            self.input_ids[c] = array.array('i', [input_ids[r] for r in keep])
+            if (self.numbers[c] != None): 
+                numbers = self.numbers[c]
+                self.numbers[c] = array.array('d', [numbers[r] for r in keep])
+        self.nrows = len(keep)
+
+######################################################################
@@ -0,0 +1,679 @@
+#!/usr/bin/env python
+"""
+Benchmarks for gdata_array, run against an in-process fake of the gdata
+SpreadsheetsService so no Google account or network is needed.
+
+The fake holds synthetic worksheets of a given size and sparsity, and
+can add latency and random server errors to each request.  It is
+plugged in through gdata_array.service_factory.  Each benchmark runs in
+its own process on a fresh worksheet, and prints one JSON object per
+line with the wall time, the requests made by method, and the peak
+memory, e.g.:
+
+python gdata_array_bench.py --rows 5000 --cols 20 --sparsity 0.2 \\
+    --latency 0.05 --output bench_output.txt
+"""
+import argparse
+import atom
+import cStringIO
+import collections
+import gdata
+import gdata.service
+import gdata.spreadsheet
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+import gdata_array
+
+feeds_url = 'https://spreadsheets.google.com/feeds'
+etag_attribute = '{%s}etag' % gdata.GDATA_NAMESPACE
+
+######################################################################
+class FakeWorksheet(object):
+    """
+    A worksheet of the fake service, stored as a list of rows of values
+    (None for blank cells), with a stable ID for each row as used by
+    the list feed.  The version counts changes, and the version of the
+    last change to each cell that was ever set is kept for updated-min
+    queries.
+    """
+    def __init__(self, wksht_id, title, rows, row_count, col_count):
+        self.wksht_id = wksht_id
+        self.title = title
+        self.rows = rows
+        self.row_ids = range(1, len(rows)+1)
+        self.next_row_id = len(rows) + 1
+        self.row_count = max(row_count, len(rows))
+        self.col_count = col_count
+        # The initial cells count as changed at version 0, before any 
+        # feed was read, since updated-min includes the version given.
+        self.version = 1
+        self.cell_versions = {}
+
+    def get(self, row, col):
+        if (row > len(self.rows) or col > len(self.rows[row-1])):
+            return None
+        return self.rows[row-1][col-1]
+
+    def set(self, row, col, val):
+        if (row > self.row_count or col > self.col_count):
+            raise gdata.service.RequestError({
+                    'status': 400, 'reason': 'Cell out of range', 'body': ''})
+        while (len(self.rows) < row):
+            self.rows.append([])
+            self.row_ids.append(self.next_row_id)
+            self.next_row_id += 1
+        vals = self.rows[row-1]
+        while (len(vals) < col): vals.append(None)
+        vals[col-1] = val or None
+        self.version += 1
+        self.cell_versions[(row, col)] = self.version
+
+    def touch_rows(self, first_row, last_row):
+        """
+        Counts a change to every cell of the given rows, as when rows 
+        are inserted or deleted above them.
+        """
+        self.version += 1
+        for row in xrange(first_row, last_row+1):
+            for col in xrange(1, self.col_count+1):
+                self.cell_versions[(row, col)] = self.version
+
+    def resize(self, row_count, col_count):
+        self.row_count = row_count
+        self.col_count = col_count
+        del self.rows[row_count:]
+        del self.row_ids[row_count:]
+        for vals in self.rows: del vals[col_count:]
+        for row, col in self.cell_versions.keys():
+            if (row > row_count or col > col_count): 
+                del self.cell_versions[(row, col)]
+        self.version += 1
+
+######################################################################
+class FakeSpreadsheetsService(object):
+    """
+    An in-process stand-in for gdata.spreadsheet.service.SpreadsheetsService,
+    implementing the methods that gdata_array calls and returning real
+    gdata objects.  Each request sleeps for latency seconds (plus up to
+    jitter more) and fails with a 503 error with probability error_rate.
+    With parse_xml, feeds are returned by parsing their XML, as the real
+    client does, so the parsing cost is included in the timings.  The
+    XML of cells feeds is kept until the worksheet changes, so that a
+    warm fake spends little time building responses.
+    """
+    def __init__(self, latency=0, jitter=0, error_rate=0, parse_xml=True,
+                 seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.parse_xml = parse_xml
+        self.random = random.Random(seed)
+        self.spreadsheets = {}
+        self.requests = collections.Counter()
+        self.lock = threading.Lock()
+        self.xml_cache = {}
+
+    def add_worksheet(self, key, title, rows, row_count=None, col_count=None):
+        title_wss = self.spreadsheets.setdefault(key, ['Benchmark', []])
+        wksht_id = 'od%d' % (len(title_wss[1]) + 6)
+        if (col_count == None):
+            col_count = max([len(vals) for vals in rows] + [1])
+        ws = FakeWorksheet(wksht_id, title, rows, row_count or len(rows),
+                           col_count)
+        title_wss[1].append(ws)
+        return ws
+
+    def request(self, method_name):
+        """
+        Counts a request, then simulates its latency and errors.
+        """
+        with self.lock:
+            self.requests[method_name] += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            fail = (self.random.random() < self.error_rate)
+        if (delay): time.sleep(delay)
+        if (fail):
+            raise gdata.service.RequestError({
+                    'status': 503, 'reason': 'Service Unavailable', 'body': ''})
+
+    def convert(self, feed, from_string):
+        if (self.parse_xml):
+            return from_string(feed.ToString())
+        return feed
+
+    def get_worksheet(self, key, wksht_id):
+        for ws in self.spreadsheets[key][1]:
+            if (ws.wksht_id == str(wksht_id)): return ws
+        raise gdata.service.RequestError({
+                'status': 404, 'reason': 'Not Found', 'body': ''})
+
+    def ProgrammaticLogin(self):
+        pass
+
+    # Worksheets feed
+    def worksheet_entry(self, key, ws):
+        url = '%s/worksheets/%s/private/full/%s' % (feeds_url, key, ws.wksht_id)
+        return gdata.spreadsheet.SpreadsheetsWorksheet(
+            title=atom.Title(text=ws.title),
+            atom_id=atom.Id(text=url),
+            row_count=gdata.spreadsheet.RowCount(text=str(ws.row_count)),
+            col_count=gdata.spreadsheet.ColCount(text=str(ws.col_count)),
+            updated=atom.Updated(text='v%d' % ws.version),
+            link=[atom.Link(rel='edit', href=url + '/v%d' % ws.version)])
+
+    def get_worksheets_feed(self, key):
+        title, wss = self.spreadsheets[key]
+        etag = 'W/"%s"' % '.'.join(['%s%d' % (ws.wksht_id, ws.version)
+                                    for ws in wss])
+        return gdata.spreadsheet.SpreadsheetsWorksheetsFeed(
+            title=atom.Title(text=title),
+            entry=[self.worksheet_entry(key, ws) for ws in wss],
+            extension_attributes={etag_attribute: etag})
+
+    def GetWorksheetsFeed(self, key, wksht_id=None, query=None):
+        self.request('GetWorksheetsFeed')
+        if (wksht_id):
+            return self.worksheet_entry(key, self.get_worksheet(key, wksht_id))
+        feed = self.get_worksheets_feed(key)
+        return self.convert(
+            feed, gdata.spreadsheet.SpreadsheetsWorksheetsFeedFromString)
+
+    def AddWorksheet(self, title, row_count, col_count, key):
+        self.request('AddWorksheet')
+        ws = self.add_worksheet(key, title, [], int(row_count), int(col_count))
+        return self.worksheet_entry(key, ws)
+
+    def UpdateWorksheet(self, worksheet_entry, url=None):
+        self.request('UpdateWorksheet')
+        parts = worksheet_entry.id.text.split('/')
+        ws = self.get_worksheet(parts[-4], parts[-1])
+        ws.resize(int(worksheet_entry.row_count.text),
+                  int(worksheet_entry.col_count.text))
+        return self.worksheet_entry(parts[-4], ws)
+
+    # Cells feed
+    def cell_entry(self, key, ws, row, col, val):
+        numeric_value = None
+        try:
+            numeric_value = str(float(val))
+        except (TypeError, ValueError):
+            pass
+        url = '%s/cells/%s/%s/private/full/R%dC%d' % (
+            feeds_url, key, ws.wksht_id, row, col)
+        return gdata.spreadsheet.SpreadsheetsCell(
+            atom_id=atom.Id(text=url),
+            link=[atom.Link(rel='edit', href=url + '/v')],
+            cell=gdata.spreadsheet.Cell(text=val, row=str(row), col=str(col),
+                                        inputValue=val,
+                                        numericValue=numeric_value))
+
+    def get_cells_feed(self, key, ws, query):
+        """
+        Returns the cells feed for a query with min-row, max-row, 
+        min-col, max-col, max-results and updated-min, for which cells 
+        changed at or after the given version are returned.  With 
+        return-empty, blank cells are returned too, but only those that 
+        were ever set. 
+        """
+        return_empty = (query.get('return-empty') == 'true')
+        min_version = None
+        if (query.get('updated-min')): 
+            min_version = int(query['updated-min'].lstrip('v'))
+        min_row = int(query.get('min-row') or 1)
+        max_row = int(query.get('max-row') or ws.row_count)
+        min_col = int(query.get('min-col') or 1)
+        max_col = int(query.get('max-col') or ws.col_count)
+        if (not return_empty): max_row = min(max_row, len(ws.rows))
+        entries = []
+        for row in xrange(min_row, max_row+1):
+            vals = (ws.rows[row-1] if (row <= len(ws.rows)) else [])
+            if (return_empty): ncols = max_col
+            else: ncols = min(max_col, len(vals))
+            for col in xrange(min_col, ncols+1):
+                val = ws.get(row, col)
+                version = ws.cell_versions.get((row, col))
+                if (val == None and not (return_empty and version)): 
+                    continue
+                if (min_version != None and (version or 0) < min_version):
+                    continue
+                entries.append(self.cell_entry(key, ws, row, col, val))
+        if (query.get('max-results')):
+            del entries[int(query['max-results']):]
+        url = '%s/cells/%s/%s/private/full' % (feeds_url, key, ws.wksht_id)
+        return gdata.spreadsheet.SpreadsheetsCellsFeed(
+            entry=entries,
+            updated=atom.Updated(text='v%d' % ws.version),
+            row_count=gdata.spreadsheet.RowCount(text=str(ws.row_count)),
+            col_count=gdata.spreadsheet.ColCount(text=str(ws.col_count)),
+            link=[atom.Link(rel='http://schemas.google.com/g/2005#batch',
+                            href=url + '/batch')],
+            extension_attributes={etag_attribute: 'W/"v%d"' % ws.version})
+
+    def get_cells_xml(self, key, wksht_id, query=None):
+        ws = self.get_worksheet(key, wksht_id)
+        query = query or {}
+        cache_key = (key, ws.wksht_id, ws.version, tuple(sorted(query.items())))
+        if (cache_key not in self.xml_cache):
+            self.xml_cache[cache_key] = self.get_cells_feed(
+                key, ws, query).ToString()
+        return self.xml_cache[cache_key]
+
+    def GetCellsFeed(self, key, wksht_id='default', cell=None, query=None):
+        self.request('GetCellsFeed')
+        if (self.parse_xml):
+            return gdata.spreadsheet.SpreadsheetsCellsFeedFromString(
+                self.get_cells_xml(key, wksht_id, query))
+        return self.get_cells_feed(key, self.get_worksheet(key, wksht_id),
+                                   query or {})
+
+    def Get(self, uri, extra_headers=None, redirects_remaining=4,
+            encoding='UTF-8', converter=None):
+        """
+        Gets a cells or worksheets feed by URL, as gdata_array does with 
+        fast_cells_feed and for conditional requests, which fail with a 
+        304 error while the feed matches the If-None-Match ETag.  The 
+        XML is always built, since the converter parses it.
+        """
+        self.request('Get')
+        path, query = urllib.splitquery(uri)
+        parts = path.split('/')
+        if (parts[-4] == 'worksheets'):
+            xml = self.get_worksheets_feed(parts[-3]).ToString()
+            from_string = gdata.spreadsheet.SpreadsheetsWorksheetsFeedFromString
+        else:
+            xml = self.get_cells_xml(parts[-4], parts[-3],
+                                     dict(urlparse.parse_qsl(query or '')))
+            from_string = gdata.spreadsheet.SpreadsheetsCellsFeedFromString
+        etag = (extra_headers or {}).get('If-None-Match')
+        if (etag and etag == from_string(xml).extension_attributes.get(
+                etag_attribute)):
+            raise gdata.service.RequestError({
+                    'status': 304, 'reason': 'Not Modified', 'body': ''})
+        if (converter):
+            return converter(xml)
+        return from_string(xml)
+
+    def GetStream(self, uri, extra_headers=None, parser=None):
+        """
+        Gets a feed by URL as Get does, passing it to parser as a file, 
+        as gdata_array does with fast_cells_feed.
+        """
+        return self.Get(uri, extra_headers, 
+                        converter=lambda xml: parser(cStringIO.StringIO(xml)))
+
+    def UpdateCell(self, row, col, inputValue, key, wksht_id='default'):
+        self.request('UpdateCell')
+        ws = self.get_worksheet(key, wksht_id)
+        ws.set(int(row), int(col), inputValue)
+        return self.cell_entry(key, ws, int(row), int(col), inputValue or None)
+
+    def ExecuteBatch(self, batch_feed, url, converter=None):
+        self.request('ExecuteBatch')
+        parts = url.split('/')
+        key = parts[-5]
+        ws = self.get_worksheet(key, parts[-4])
+        res = gdata.spreadsheet.SpreadsheetsCellsFeed()
+        for entry in batch_feed.entry:
+            row, col = int(entry.cell.row), int(entry.cell.col)
+            try:
+                ws.set(row, col, entry.cell.inputValue)
+                status = gdata.BatchStatus(code='200', reason='Success')
+            except gdata.service.RequestError, e:
+                status = gdata.BatchStatus(code='400', reason=e.args[0]['reason'])
+            res_entry = self.cell_entry(key, ws, row, col,
+                                        entry.cell.inputValue or None)
+            res_entry.batch_id = entry.batch_id
+            res_entry.batch_status = status
+            res_entry.batch_operation = entry.batch_operation
+            res.entry.append(res_entry)
+        return self.convert(res, gdata.spreadsheet.SpreadsheetsCellsFeedFromString)
+
+    # List feed, which stops at the first blank row
+    def get_coltags(self, ws):
+        header = ws.rows[0] if ws.rows else []
+        return gdata_array.Schema.make_coltags(header, ws.col_count)
+
+    def list_entries(self, key, ws):
+        coltags = self.get_coltags(ws)
+        entries = []
+        for i in range(1, len(ws.rows)):
+            vals = ws.rows[i]
+            if (not [val for val in vals if val != None]): break
+            custom = {}
+            for icol in range(0, ws.col_count):
+                val = (vals[icol] if icol < len(vals) else None)
+                custom[coltags[icol]] = gdata.spreadsheet.Custom(
+                    column=coltags[icol], text=val)
+            url = '%s/list/%s/%s/private/full/r%d' % (
+                feeds_url, key, ws.wksht_id, ws.row_ids[i])
+            entries.append(gdata.spreadsheet.SpreadsheetsList(
+                    atom_id=atom.Id(text=url), custom=custom,
+                    link=[atom.Link(rel='edit', href=url + '/v')]))
+        return entries
+
+    def GetListFeed(self, key, wksht_id='default', row_id=None, query=None):
+        """
+        Returns the list feed, limited by max-results and by an sq 
+        structured query of 'coltag = "value"' terms joined by 'and', 
+        with total_results giving the number of rows matched. 
+        """
+        self.request('GetListFeed')
+        ws = self.get_worksheet(key, wksht_id)
+        query = query or {}
+        entries = self.list_entries(key, ws)
+        if (query.get('sq')):
+            terms = [re.match(r'\s*([\w-]+)\s*=\s*"([^"]*)"\s*$', term)
+                     for term in query['sq'].split(' and ')]
+            if (None in terms):
+                raise gdata.service.RequestError({
+                        'status': 400, 'reason': 'Bad sq', 'body': ''})
+            entries = [entry for entry in entries
+                       if not [term for term in terms 
+                               if (entry.custom[term.group(1)].text 
+                                   != term.group(2))]]
+        total = len(entries)
+        if (query.get('max-results')):
+            del entries[int(query['max-results']):]
+        feed = gdata.spreadsheet.SpreadsheetsListFeed(
+            entry=entries, total_results=gdata.TotalResults(text=str(total)))
+        return self.convert(feed, gdata.spreadsheet.SpreadsheetsListFeedFromString)
+
+    def InsertRow(self, row_data, key, wksht_id='default'):
+        self.request('InsertRow')
+        ws = self.get_worksheet(key, wksht_id)
+        coltags = self.get_coltags(ws)
+        irow = len(self.list_entries(key, ws)) + 1
+        vals = [None] * ws.col_count
+        custom = {}
+        for tag,val in row_data.items():
+            if (tag in coltags):
+                vals[coltags.index(tag)] = val
+                custom[tag] = gdata.spreadsheet.Custom(column=tag, text=val)
+        ws.rows.insert(irow, vals)
+        ws.row_ids.insert(irow, ws.next_row_id)
+        ws.next_row_id += 1
+        ws.row_count = max(ws.row_count, len(ws.rows))
+        ws.touch_rows(irow+1, len(ws.rows))
+        return gdata.spreadsheet.SpreadsheetsList(custom=custom)
+
+    def DeleteRow(self, entry):
+        self.request('DeleteRow')
+        parts = entry.id.text.split('/')
+        ws = self.get_worksheet(parts[-5], parts[-4])
+        irow = ws.row_ids.index(int(parts[-1][1:]))
+        del ws.rows[irow]
+        del ws.row_ids[irow]
+        ws.touch_rows(irow+1, len(ws.rows)+1)
+        ws.row_count -= 1
+
+######################################################################
+def make_rows(nrows, ncols, sparsity=0.0, blank_rows=0.0, seed=None):
+    """
+    Returns a header row and nrows rows of ncols synthetic values: an
+    ID, an integer, a float and words, with each cell after the ID left
+    blank with probability sparsity, and whole rows left blank with
+    probability blank_rows.
+    """
+    rnd = random.Random(seed)
+    words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta']
+    header = ['id', 'count', 'amount'] + ['Column %d' % i 
+                                         for i in range(4, ncols+1)]
+    rows = [header[:ncols]]
+    for irow in range(0, nrows):
+        if (rnd.random() < blank_rows):
+            rows.append([])
+            continue
+        vals = []
+        for icol in range(0, ncols):
+            if (icol > 0 and rnd.random() < sparsity):
+                vals.append(None)
+            elif (icol == 0):
+                vals.append('row%d' % irow)
+            elif (icol == 1):
+                vals.append(str(rnd.randint(0, 1000)))
+            elif (icol == 2):
+                vals.append('%.2f' % rnd.uniform(0, 1000))
+            else:
+                vals.append('%s %d' % (rnd.choice(words), rnd.randint(0, 99)))
+        while (vals and vals[-1] == None): vals.pop(-1)
+        rows.append(vals)
+    return rows
+
+def setup(options):
+    """
+    Creates a fake service with one synthetic worksheet, installs it as
+    the gdata_array service, and returns it.
+    """
+    svc = FakeSpreadsheetsService(latency=options.latency,
+                                  jitter=options.jitter,
+                                  error_rate=options.error_rate,
+                                  parse_xml=not options.no_parse,
+                                  seed=options.seed)
+    rows = make_rows(options.rows, options.cols, options.sparsity,
+                     options.blank_rows, options.seed)
+    ws = svc.add_worksheet('bench', 'Sheet1', rows,
+                           row_count=len(rows) + options.ops)
+    # Warm the fake's XML cache for the full cells feed
+    svc.get_cells_xml('bench', ws.wksht_id)
+    gdata_array.service_factory = lambda: svc
+    gdata_array.rate_limit_per_second = options.rate_limit
+    gdata_array.retry_wait_time_seconds = options.retry_wait
+    gdata_array.cache_dir = None
+    gdata_array.metadata_cache().invalidate()
+    return svc
+
+def load_worksheet():
+    ws = gdata_array.worksheet('bench', title='Sheet1')
+    ws.load_data()
+    return ws
+
+# Each benchmark takes the options and a loaded worksheet (or None, for
+# those in unloaded_benchmarks), and does the timed work.
+def bench_load(options, ws):
+    load_worksheet()
+
+def bench_load_fast(options, ws):
+    gdata_array.fast_cells_feed = True
+    load_worksheet()
+
+# The parse benchmarks time only the parsing of the full cells feed XML
+# into cell values, through gdata objects and with parse_cells_feed.
+def get_cells_xml():
+    svc = gdata_array.service_factory()
+    return svc.get_cells_xml('bench', svc.spreadsheets['bench'][1][0].wksht_id)
+
+def bench_parse_gdata(options, ws):
+    feed = gdata.spreadsheet.SpreadsheetsCellsFeedFromString(get_cells_xml())
+    list(gdata_array.cell_values(feed.entry))
+
+def bench_parse_fast(options, ws):
+    gdata_array.parse_cells_feed(get_cells_xml())
+
+def bench_iterate(options, ws):
+    key = ws.headers[1]
+    for row in ws:
+        for cell in row: pass
+        row.get(key)
+
+def bench_set_row(options, ws):
+    for i in range(0, min(options.ops, len(ws))):
+        ws.set_row(ws[i].row, ['set%d' % i, str(i)])
+
+def bench_append(options, ws):
+    for i in range(0, options.ops):
+        ws.append(['append%d' % i, str(i)])
+
+def bench_delete(options, ws):
+    for i in range(0, min(options.ops, len(ws))):
+        ws[0].delete()
+
+def bench_delete_rows(options, ws):
+    ws.delete_rows(range(0, min(options.ops, len(ws))))
+
+def bench_coltags(options, ws):
+    for i in range(0, options.ops * 100):
+        ws.coltags
+
+def bench_write_xml(options, ws):
+    ws.write_xml(cStringIO.StringIO())
+
+def run_python(code, count):
+    """
+    Runs the code count times, each in a new Python interpreter that can 
+    import gdata_array. 
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(os.path.abspath(gdata_array.__file__))
+    for i in range(0, count):
+        subprocess.check_call([sys.executable, '-c', code], env=env)
+
+# The import benchmarks time new interpreters, so they include the
+# interpreter's own startup: import is what a script pays before its
+# first API call, and import_gdata adds the gdata modules that the
+# first call loads.
+def bench_import(options, ws):
+    run_python('import gdata_array', options.ops)
+
+def bench_import_gdata(options, ws):
+    run_python('import gdata_array; gdata_array.gdata.spreadsheet.service', 
+               options.ops)
+
+benchmarks = collections.OrderedDict([
+        ('import', bench_import),
+        ('import_gdata', bench_import_gdata),
+        ('load', bench_load),
+        ('load_fast', bench_load_fast),
+        ('parse_gdata', bench_parse_gdata),
+        ('parse_fast', bench_parse_fast),
+        ('iterate', bench_iterate),
+        ('set_row', bench_set_row),
+        ('append', bench_append),
+        ('delete', bench_delete),
+        ('delete_rows', bench_delete_rows),
+        ('coltags', bench_coltags),
+        ('write_xml', bench_write_xml),
+        ])
+
+unloaded_benchmarks = ('import', 'import_gdata', 'load', 'load_fast',
+                       'parse_gdata', 'parse_fast')
+
+def get_peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_benchmark(name, options):
+    """
+    Runs one benchmark and returns its results as a dict.  Only the
+    benchmark itself is timed, not the setup and loading before it.
+    """
+    svc = setup(options)
+    ws = None
+    if (name not in unloaded_benchmarks): ws = load_worksheet()
+    svc.requests.clear()
+    rss_kb = get_peak_rss_kb()
+    start_cpu = time.clock()
+    start = time.time()
+    benchmarks[name](options, ws)
+    wall = time.time() - start
+    cpu = time.clock() - start_cpu
+    return collections.OrderedDict([
+            ('benchmark', name),
+            ('rows', options.rows),
+            ('cols', options.cols),
+            ('sparsity', options.sparsity),
+            ('latency', options.latency),
+            ('error_rate', options.error_rate),
+            ('ops', options.ops),
+            ('wall_seconds', round(wall, 6)),
+            ('cpu_seconds', round(cpu, 6)),
+            ('requests', sum(svc.requests.values())),
+            ('requests_by_method', dict(svc.requests)),
+            ('peak_rss_kb', get_peak_rss_kb()),
+            ('rss_growth_kb', get_peak_rss_kb() - rss_kb),
+            ])
+
+def run_in_process(name, options):
+    """
+    Runs a benchmark in a new process, so its peak memory is its own.
+    """
+    queue = multiprocessing.Queue()
+    def run():
+        try:
+            queue.put(run_benchmark(name, options))
+        except Exception, e:
+            queue.put(collections.OrderedDict([
+                        ('benchmark', name), ('error', repr(e))]))
+    process = multiprocessing.Process(target=run)
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark gdata_array against a fake spreadsheet service.')
+    parser.add_argument('--rows', type=int, default=2000,
+                        help='data rows in the worksheet')
+    parser.add_argument('--cols', type=int, default=10,
+                        help='columns in the worksheet')
+    parser.add_argument('--sparsity', type=float, default=0.1,
+                        help='fraction of blank cells')
+    parser.add_argument('--blank-rows', type=float, default=0.0,
+                        help='fraction of blank rows')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to each request')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='up to this many more seconds per request')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests failing with 503')
+    parser.add_argument('--retry-wait', type=float, default=0.01,
+                        help='retry_wait_time_seconds for the module')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='rate_limit_per_second for the module')
+    parser.add_argument('--ops', type=int, default=20,
+                        help='operations for the write benchmarks')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-parse', action='store_true',
+                        help='return feed objects without parsing XML')
+    parser.add_argument('--no-fork', action='store_true',
+                        help='run all benchmarks in this process')
+    parser.add_argument('--output', default=None,
+                        help='also append the results to this file')
+    parser.add_argument('benchmarks', nargs='*',
+                        help='benchmarks to run: %s (default all)'
+                        % ', '.join(benchmarks))
+    return parser
+
+def main(argv=None):
+    options = get_parser().parse_args(argv)
+    names = options.benchmarks or list(benchmarks)
+    for name in names:
+        if (name not in benchmarks):
+            raise SystemExit('Unknown benchmark "%s"' % name)
+    out = open(options.output, 'a') if options.output else None
+    try:
+        for name in names:
+            if (options.no_fork):
+                result = run_benchmark(name, options)
+            else:
+                result = run_in_process(name, options)
+            line = json.dumps(result)
+            print line
+            if (out):
+                out.write(line + '\n')
+                out.flush()
+    finally:
+        if (out): out.close()
+
+if __name__ == '__main__':
+    main()
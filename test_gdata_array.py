@@ -0,0 +1,958 @@
+#!/usr/bin/env python
+"""
+Behavior tests for gdata_array, run against the fake spreadsheet
+service of gdata_array_bench, so no Google account is needed:
+
+python -m unittest test_gdata_array
+"""
+import cStringIO
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import xml.etree.cElementTree
+
+import gdata.service
+import gdata.spreadsheet.service
+
+import gdata_array
+import gdata_array_bench
+
+# Module settings that the tests change, restored after each test
+settings = ('service_factory', 'rate_limit_per_second',
+            'retry_wait_time_seconds', 'cache_dir', 'batch_size',
+            'fast_cells_feed', 'export_buffer_rows', 'metrics_enabled',
+            'service_max_idle_seconds', 'async_workers', 
+            'metadata_ttl_seconds', 'MetadataCache', 'num_tries', 
+            'token_cache_file', 'token_max_age_seconds', 'email', 
+            'password', 'source')
+
+def request_error(status):
+    return gdata.service.RequestError({
+            'status': status, 'reason': 'Reason %d' % status, 'body': ''})
+
+######################################################################
+class FakeServiceTest(unittest.TestCase):
+    """
+    Sets up a fake service holding the worksheet 'Sheet1' of the
+    spreadsheet 'test' with the given rows, in a sheet of row_count
+    rows and col_count columns.
+    """
+    rows = [['Name', 'Status'], ['a', '1'], ['b', '2'], ['c', '3']]
+    row_count = 10
+    col_count = 4
+
+    def setUp(self):
+        self.saved = dict([(name, getattr(gdata_array, name))
+                           for name in settings])
+        self.svc = gdata_array_bench.FakeSpreadsheetsService()
+        self.sheet = self.svc.add_worksheet(
+            'test', 'Sheet1', [list(vals) for vals in self.rows],
+            self.row_count, self.col_count)
+        gdata_array.service_factory = lambda: self.svc
+        gdata_array.rate_limit_per_second = None
+        gdata_array.retry_wait_time_seconds = 0
+        gdata_array.cache_dir = None
+        gdata_array.metadata_cache().invalidate()
+
+    def tearDown(self):
+        for name, val in self.saved.items():
+            setattr(gdata_array, name, val)
+        gdata_array.metadata_cache().invalidate()
+
+    def worksheet(self, **kwargs):
+        return gdata_array.worksheet('test', title='Sheet1', **kwargs)
+
+    def values(self, rows):
+        return [[(cell or None) for cell in row] for row in rows]
+
+    def fail_cells_feed(self, *statuses):
+        """
+        Makes the next requests for a cells feed fail with the statuses.
+        """
+        statuses = list(statuses)
+        get_cells_feed = self.svc.GetCellsFeed
+        def fail(*args, **kwargs):
+            if (statuses): 
+                self.svc.requests['GetCellsFeed'] += 1
+                raise request_error(statuses.pop(0))
+            return get_cells_feed(*args, **kwargs)
+        self.svc.GetCellsFeed = fail
+
+    def remote_rows(self):
+        rows = [[val for val in vals] for vals in self.sheet.rows]
+        for vals in rows:
+            while (vals and vals[-1] == None): vals.pop(-1)
+        while (rows and not rows[-1]): rows.pop(-1)
+        return rows
+
+######################################################################
+class BatchTest(FakeServiceTest):
+    def test_batch_sends_on_exit(self):
+        ws = self.worksheet()
+        with ws.batch():
+            ws[0]['Status'] = 'x'
+            ws[1]['Status'] = 'y'
+            self.assertEqual(self.sheet.rows[1][1], '1')
+        self.assertEqual(self.svc.requests['ExecuteBatch'], 1)
+        self.assertEqual(self.remote_rows()[1:3], [['a', 'x'], ['b', 'y']])
+
+    def test_batch_discards_on_error(self):
+        ws = self.worksheet()
+        try:
+            with ws.batch():
+                ws[0]['Status'] = 'x'
+                ws[1]['Nope']
+        except KeyError:
+            pass
+        self.assertEqual(self.svc.requests['ExecuteBatch'], 0)
+        self.assertEqual(ws[0]['Status'], '1')
+        self.assertEqual(self.remote_rows(), self.rows)
+
+    def test_flush_in_batches(self):
+        gdata_array.batch_size = 2
+        ws = self.worksheet()
+        with ws.batch():
+            for row, val in zip(ws, 'xyz'): row['Status'] = val
+        self.assertEqual(self.svc.requests['ExecuteBatch'], 2)
+        self.assertEqual([vals[1] for vals in self.remote_rows()[1:]], 
+                         ['x', 'y', 'z'])
+
+    def test_failures_kept_when_a_later_request_fails(self):
+        gdata_array.batch_size = 2
+        ws = self.worksheet()
+        execute_batch = self.svc.ExecuteBatch
+        calls = []
+        def fail_second(batch_feed, url, converter=None):
+            calls.append(url)
+            if (len(calls) == 2):
+                raise gdata.service.RequestError({
+                        'status': 400, 'reason': 'Bad Request', 'body': ''})
+            return execute_batch(batch_feed, url, converter)
+        self.svc.ExecuteBatch = fail_second
+        for row, col, val in ((2, 2, 'x'), (11, 1, 'y'), (3, 2, 'z'),
+                              (4, 2, 'w')):
+            ws.queue_update(row, col, val)
+        try:
+            ws.flush()
+        except gdata_array.BatchError, e:
+            self.assertEqual([failure[:2] for failure in e.failures],
+                             [(11, 1)])
+            self.assertEqual(gdata_array.get_status(e.error), 400)
+        else:
+            self.fail('BatchError not raised')
+        self.assertEqual(self.sheet.rows[1][1], 'x')
+        self.assertEqual(ws._pending.keys(), [(3, 2), (4, 2)])
+
+    def test_write_behind_flush(self):
+        ws = self.worksheet()
+        ws.start_write_behind(delay_seconds=60)
+        try:
+            ws[0]['Status'] = 'x'
+            ws[0]['Status'] = 'y'
+            self.assertEqual(ws[0]['Status'], 'y')
+            self.assertEqual(self.sheet.rows[1][1], '1')
+            self.assertEqual(ws.flush(), 1)
+            self.assertEqual(self.sheet.rows[1][1], 'y')
+        finally:
+            ws.close()
+
+######################################################################
+class PagedTest(FakeServiceTest):
+    def test_row_range_counts_from_last_data_row(self):
+        ws = self.worksheet(rows=slice(-2, None))
+        self.assertEqual(len(ws), 3)
+        self.assertFalse(ws.is_row_loaded(2))
+        self.assertTrue(ws.is_row_loaded(3))
+        self.assertTrue(ws.is_row_loaded(4))
+        self.assertEqual(ws[-1]['Name'], 'c')
+
+    def test_len_matches_unpaged(self):
+        self.assertEqual(len(self.worksheet(page_rows=2)), 
+                         len(self.worksheet()))
+
+    def test_rows_load_on_every_access(self):
+        ws = self.worksheet(page_rows=2)
+        self.assertEqual(list(ws.rows[2]), ['c', '3'])
+        self.assertEqual([list(row) for row in ws.rows], 
+                         [['a', '1'], ['b', '2'], ['c', '3']])
+        self.assertEqual(ws.get_row(2)['Status'], '1')
+
+    def test_pages_read_once(self):
+        ws = self.worksheet(page_rows=2)
+        len(ws)
+        reads = self.svc.requests['GetCellsFeed']
+        list(ws)
+        # The first page was read with the header rows
+        self.assertEqual(self.svc.requests['GetCellsFeed'] - reads, 1)
+        list(ws)
+        self.assertEqual(self.svc.requests['GetCellsFeed'] - reads, 1)
+
+    def test_first_rows_in_one_request(self):
+        for kwargs in ({'page_rows': 2}, {'rows': slice(0, 2)}):
+            self.svc.requests.clear()
+            ws = self.worksheet(**kwargs)
+            self.assertEqual(ws[1]['Name'], 'b')
+            self.assertEqual(self.svc.requests['GetCellsFeed'], 1)
+
+    def test_iterate_past_blank_pages(self):
+        self.sheet.set(9, 1, 'x')
+        ws = self.worksheet(page_rows=2)
+        rows = [list(row) for row in self.worksheet()]
+        self.assertEqual([list(row) for row in ws], rows)
+        reads = self.svc.requests['GetCellsFeed']
+        self.assertEqual(len(ws), len(rows))
+        self.assertEqual(self.svc.requests['GetCellsFeed'], reads)
+
+######################################################################
+class AppendTest(FakeServiceTest):
+    def test_append_row(self):
+        ws = self.worksheet()
+        ws.append({'Name': 'd', 'Status': '4'})
+        self.assertEqual(ws[-1], ['d', '4'])
+        self.assertEqual(self.remote_rows(), self.rows + [['d', '4']])
+
+    def test_append_blank_row(self):
+        ws = self.worksheet()
+        ws.append([])
+        self.assertEqual(len(ws), 4)
+        self.assertEqual(ws[-1], [])
+        self.assertEqual(self.remote_rows(), self.rows)
+
+######################################################################
+class ExtendTest(FakeServiceTest):
+    def test_lists_and_maps(self):
+        ws = self.worksheet()
+        ws.extend([['d', '4'], {'Status': '5', 'Name': 'e'}, {'Name': 'f'}])
+        self.assertEqual(self.svc.requests['ExecuteBatch'], 1)
+        self.assertEqual(self.svc.requests['InsertRow'], 0)
+        self.assertEqual(self.svc.requests['UpdateWorksheet'], 0)
+        rows = self.rows[1:] + [['d', '4'], ['e', '5'], ['f']]
+        self.assertEqual(ws.rows, rows)
+        self.assertEqual(self.remote_rows(), [self.rows[0]] + rows)
+
+    def test_sheet_grows(self):
+        ws = self.worksheet()
+        rows = [['r%d' % i, str(i)] for i in range(7)] + [['x'] * 5]
+        ws.extend(rows)
+        self.assertEqual(self.svc.requests['UpdateWorksheet'], 1)
+        self.assertEqual((self.sheet.row_count, self.sheet.col_count), 
+                         (12, 5))
+        self.assertEqual(ws.rows[3:], rows)
+        self.assertEqual(self.remote_rows()[4:], rows)
+
+    def test_unknown_header(self):
+        ws = self.worksheet()
+        self.assertRaises(ValueError, ws.extend, [{'Nope': 'x'}])
+        self.assertEqual(self.remote_rows(), self.rows)
+
+######################################################################
+class RowListTest(FakeServiceTest):
+    def test_list_operations(self):
+        ws = self.worksheet()
+        rows = [list(row) for row in ws.rows]
+        self.assertEqual(ws.headers + ws.rows, list(ws.headers) + rows)
+        self.assertEqual([ws.headers] + ws.rows, [ws.headers] + rows)
+        self.assertEqual(ws.rows + [['d']], rows + [['d']])
+        self.assertEqual(ws.rows, rows)
+        self.assertEqual(ws.rows[1:], rows[1:])
+        self.assertEqual(ws.rows.index(['b', '2']), 1)
+        self.assertEqual(ws.rows.count(['c', '3']), 1)
+        self.assertEqual(sorted(ws.rows, reverse=True), sorted(rows, reverse=True))
+        self.assertEqual(list(reversed(ws.rows)), rows[::-1])
+        self.assertTrue(['a', '1'] in ws.rows)
+        self.assertRaises(TypeError, ws.rows.sort)
+
+    def test_assign_writes_row(self):
+        ws = self.worksheet()
+        ws.rows[1] = ['x', 'y']
+        self.assertEqual(ws.rows[1], ['x', 'y'])
+        self.assertEqual(self.remote_rows()[2], ['x', 'y'])
+
+    def test_delete_is_local(self):
+        ws = self.worksheet()
+        del ws.rows[0]
+        self.assertEqual(ws.rows, [['b', '2'], ['c', '3']])
+        self.assertEqual(ws.rows[0].row, 2)
+        self.assertEqual(self.remote_rows(), self.rows)
+
+######################################################################
+class FeedCacheTest(FakeServiceTest):
+    def setUp(self):
+        FakeServiceTest.setUp(self)
+        gdata_array.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(gdata_array.cache_dir)
+        FakeServiceTest.tearDown(self)
+
+    def test_cached_cells_revalidated(self):
+        self.assertEqual(self.worksheet()[0]['Status'], '1')
+        # The worksheet entry still comes from the metadata cache
+        self.sheet.set(2, 2, 'x')
+        self.assertEqual(self.worksheet()[0]['Status'], 'x')
+        self.assertEqual(self.worksheet()[0]['Status'], 'x')
+
+    def test_read_evicted_meanwhile(self):
+        self.worksheet().load_data()
+        cache = gdata_array.feed_cache()
+        path = cache.get_path('cells', 'test', self.sheet.wksht_id)
+        utime = os.utime
+        def evict(path, times):
+            os.remove(path)
+            utime(path, times)
+        os.utime = evict
+        try:
+            self.assertNotEqual(
+                cache.read('cells', 'test', self.sheet.wksht_id), None)
+        finally:
+            os.utime = utime
+        self.assertFalse(os.path.exists(path))
+
+    def test_failed_resize_leaves_entry(self):
+        ws = self.worksheet()
+        def fail(*args, **kwargs):
+            raise gdata.service.RequestError({
+                    'status': 400, 'reason': 'Bad Request', 'body': ''})
+        self.svc.UpdateWorksheet = fail
+        self.assertRaises(gdata.service.RequestError, ws.resize, 20)
+        self.assertEqual(ws.data.row_count.text, '10')
+        self.assertEqual(self.worksheet().data.row_count.text, '10')
+
+######################################################################
+class PrefetchTest(FakeServiceTest):
+    def test_errors_attached(self):
+        bad = self.svc.add_worksheet('test', 'Bad', [['x']])
+        get_cells_feed = self.svc.GetCellsFeed
+        def fail_bad(key, wksht_id='default', cell=None, query=None):
+            if (wksht_id == bad.wksht_id):
+                raise gdata.service.RequestError({
+                        'status': 404, 'reason': 'Not Found', 'body': ''})
+            return get_cells_feed(key, wksht_id, cell, query)
+        self.svc.GetCellsFeed = fail_bad
+        wslist = gdata_array.worksheets('test', prefetch=True)
+        self.assertEqual(wslist.errors.keys(), ['Bad'])
+        self.assertTrue(wslist[0].has_data())
+        self.assertFalse(wslist[1].has_data())
+
+######################################################################
+class SpreadsheetTest(FakeServiceTest):
+    def test_one_feed_without_metadata_cache(self):
+        gdata_array.metadata_ttl_seconds = 0
+        ss = gdata_array.spreadsheet('test')
+        self.assertEqual(ss.titles, ['Sheet1'])
+        self.assertEqual(self.svc.requests['GetWorksheetsFeed'], 1)
+
+    def test_metadata_cache_created_once(self):
+        base = gdata_array.MetadataCache
+        class SlowMetadataCache(base):
+            def __init__(self):
+                time.sleep(0.01)
+                base.__init__(self)
+        gdata_array.MetadataCache = SlowMetadataCache
+        gdata_array._metadata_cache = None
+        caches = []
+        threads = [threading.Thread(
+                target=lambda: caches.append(gdata_array.metadata_cache()))
+                   for i in range(4)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(len(set(map(id, caches))), 1)
+
+######################################################################
+class LoginClient(object):
+    """
+    A client that only counts its logins.
+    """
+    password = 'secret'
+
+    def __init__(self):
+        self.logins = 0
+        self.token = None
+
+    def ProgrammaticLogin(self):
+        self.logins += 1
+        self.token = 'token%d' % self.logins
+
+    def GetClientLoginToken(self):
+        return self.token
+
+class ServicePoolTest(FakeServiceTest):
+    def test_idle_client_logs_in_when_token_old(self):
+        def factory():
+            svc = LoginClient()
+            gdata_array.login(svc)
+            return svc
+        pool = gdata_array.ServicePool(1, factory)
+        gdata_array.service_max_idle_seconds = -1
+        with pool.service() as svc: pass
+        with pool.service() as svc: pass
+        self.assertEqual(svc.logins, 1)
+        svc.login_time -= gdata_array.token_max_age_seconds + 1
+        with pool.service() as svc: pass
+        self.assertEqual(svc.logins, 2)
+
+######################################################################
+class RetryTest(FakeServiceTest):
+    def test_retried_with_backoff(self):
+        self.fail_cells_feed(503, 500)
+        calls = []
+        gdata_array.add_metrics_hook(calls.append)
+        try:
+            feed = gdata_array.GetCellsFeed('test', self.sheet.wksht_id)
+        finally:
+            gdata_array.remove_metrics_hook(calls.append)
+        self.assertEqual(len(feed.entry), 8)
+        self.assertEqual(self.svc.requests['GetCellsFeed'], 3)
+        self.assertEqual([call['retries'] for call in calls], [2])
+
+    def test_gives_up(self):
+        gdata_array.num_tries = 3
+        self.fail_cells_feed(503, 503, 503, 503)
+        self.assertRaises(gdata.service.RequestError, 
+                          gdata_array.GetCellsFeed, 'test', 
+                          self.sheet.wksht_id)
+        self.assertEqual(self.svc.requests['GetCellsFeed'], 3)
+        self.fail_cells_feed(400)
+        self.assertRaises(gdata.service.RequestError, 
+                          gdata_array.GetCellsFeed, 'test', 
+                          self.sheet.wksht_id)
+        self.assertEqual(self.svc.requests['GetCellsFeed'], 4)
+
+    def test_retryable(self):
+        self.assertTrue(gdata_array.is_retryable(request_error(500)))
+        self.assertFalse(gdata_array.is_retryable(request_error(404)))
+        self.assertTrue(gdata_array.is_retryable(socket.error()))
+        self.assertFalse(gdata_array.is_retryable(request_error(500), 
+                                                  'InsertRow'))
+        self.assertTrue(gdata_array.is_retryable(request_error(429), 
+                                                 'InsertRow'))
+
+    def test_backoff_delays(self):
+        gdata_array.retry_wait_time_seconds = 2
+        for attempt, low, high in ((1, 1, 2), (3, 4, 8), (10, 30, 60)):
+            delay = gdata_array.get_retry_delay(attempt)
+            self.assertTrue(low <= delay <= high, (attempt, delay))
+
+######################################################################
+class RateLimiterTest(FakeServiceTest):
+    def test_off_by_default(self):
+        self.assertEqual(self.saved['rate_limit_per_second'], None)
+        self.assertEqual(gdata_array.rate_limiter(), None)
+
+    def test_bursts_then_waits(self):
+        limiter = gdata_array.RateLimiter(20.0, 2)
+        start = time.time()
+        limiter.acquire()
+        limiter.acquire()
+        self.assertTrue(time.time() - start < 0.025)
+        limiter.acquire()
+        self.assertTrue(time.time() - start >= 0.025)
+
+    def test_adapts_rate(self):
+        limiter = gdata_array.RateLimiter(10.0, 1)
+        limiter.throttle()
+        self.assertEqual(limiter.rate, 5.0)
+        for i in range(10): limiter.throttle()
+        self.assertEqual(limiter.rate, gdata_array.rate_limit_min)
+        limiter.succeed()
+        self.assertEqual(limiter.rate, 1.0)
+        for i in range(30): limiter.succeed()
+        self.assertEqual(limiter.rate, 10.0)
+
+    def test_throttled_by_server(self):
+        gdata_array.rate_limit_per_second = 1000.0
+        self.fail_cells_feed(429)
+        gdata_array.GetCellsFeed('test', self.sheet.wksht_id)
+        self.assertEqual(gdata_array.rate_limiter().rate, 550.0)
+
+######################################################################
+class IndexTest(FakeServiceTest):
+    rows = [['Name', 'Status'], ['a', '1'], ['b', '2'], ['c', '2']]
+
+    def test_find_and_lookup(self):
+        ws = self.worksheet()
+        self.assertEqual(ws.lookup('Status', 2), self.rows[2:])
+        self.assertTrue(ws.lookup('Status', 2)[0] is ws[1])
+        self.assertEqual(ws.find('Name', 'c'), ['c', '2'])
+        self.assertEqual(ws.find('Name', 'x'), None)
+        self.assertEqual(ws.lookup(1, '1'), [['a', '1']])
+        self.assertRaises(KeyError, ws.lookup, 'Nope', 'x')
+        requests = sum(self.svc.requests.values())
+        ws.lookup('Status', '1')
+        self.assertEqual(sum(self.svc.requests.values()), requests)
+
+    def test_follows_writes(self):
+        ws = self.worksheet()
+        ws.create_index('Status')
+        ws[0]['Status'] = '2'
+        ws.set_row(ws[2].row, ['c', '3'])
+        self.assertEqual(ws.lookup('Status', '2'), [['a', '2'], ['b', '2']])
+        self.assertEqual(ws.lookup('Status', '1'), [])
+        self.assertEqual(ws.find('Status', '3'), ['c', '3'])
+
+    def test_follows_appends(self):
+        ws = self.worksheet()
+        ws.create_index('Name')
+        ws.append(['d', '4'])
+        ws.extend([['e', '5']])
+        self.assertTrue(ws.find('Name', 'd') is ws[3])
+        self.assertTrue(ws.find('Name', 'e') is ws[4])
+
+    def test_follows_deletes(self):
+        ws = self.worksheet()
+        ws.create_index('Name')
+        ws.delete_rows([0])
+        self.assertEqual(ws.find('Name', 'a'), None)
+        self.assertEqual(ws.find('Name', 'c').row, 3)
+        del ws.rows[0]
+        self.assertEqual(ws.find('Name', 'b'), None)
+        self.assertEqual(ws.find('Name', 'c').row, 2)
+
+######################################################################
+class TokenCacheTest(FakeServiceTest):
+    def setUp(self):
+        FakeServiceTest.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tokens')
+        gdata_array.token_cache_file = self.path
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        FakeServiceTest.tearDown(self)
+
+    def test_saved_for_other_processes(self):
+        gdata_array.TokenCache(self.path).put('me', 'src', 'tok')
+        self.assertEqual(os.stat(self.path).st_mode & 0777, 0600)
+        token, saved = gdata_array.TokenCache(self.path).get_entry('me', 
+                                                                   'src')
+        self.assertEqual(token, 'tok')
+        self.assertTrue(time.time() - saved < 5)
+        self.assertEqual(
+            gdata_array.TokenCache(self.path).get_entry('me', 'other'), None)
+
+    def test_expired(self):
+        cache = gdata_array.TokenCache(self.path)
+        cache.put('me', 'src', 'tok')
+        gdata_array.token_max_age_seconds = -1
+        self.assertEqual(cache.get_entry('me', 'src'), None)
+        cache.put('you', 'src', 'tok2')
+        self.assertEqual(cache.read().keys(), ['you|src'])
+
+    def test_ignored_if_others_can_read(self):
+        cache = gdata_array.TokenCache(self.path)
+        cache.put('me', 'src', 'tok')
+        os.chmod(self.path, 0644)
+        self.assertEqual(cache.get_entry('me', 'src'), None)
+
+    def test_login_saved_and_reused(self):
+        svc = LoginClient()
+        svc.email, svc.source = 'me', 'src'
+        gdata_array.login(svc)
+        token, saved = gdata_array.token_cache().get_entry('me', 'src')
+        self.assertEqual(token, 'token1')
+        gdata_array.service_factory = None
+        gdata_array.email, gdata_array.source = 'me', 'src'
+        client = gdata_array.new_spreadsheet_service()
+        self.assertEqual(client.GetClientLoginToken(), 'token1')
+        self.assertEqual(client.login_time, saved)
+
+######################################################################
+class AsyncTest(FakeServiceTest):
+    def setUp(self):
+        FakeServiceTest.setUp(self)
+        self.asyncio = gdata_array.import_module('asyncio', 'trollius')
+        if (self.asyncio == None or 
+            gdata_array.import_module('concurrent.futures') == None):
+            self.skipTest('asyncio and concurrent.futures are not installed')
+        self.loop = self.asyncio.new_event_loop()
+        gdata_array.async_workers = 2
+        gdata_array._async_executor = None
+
+    def tearDown(self):
+        self.loop.close()
+        if (gdata_array._async_executor):
+            gdata_array._async_executor.shutdown()
+            gdata_array._async_executor = None
+        FakeServiceTest.tearDown(self)
+
+    def test_waiting_calls_do_not_hold_threads(self):
+        a = gdata_array.AsyncWorksheet(self.worksheet(), loop=self.loop)
+        b = gdata_array.AsyncWorksheet(self.worksheet(), loop=self.loop)
+        order = []
+        def step(i):
+            time.sleep(0.1)
+            order.append(i)
+        futures = [a.run(step, i) for i in range(4)]
+        start = time.time()
+        self.assertTrue(self.loop.run_until_complete(b.run(time.time)) 
+                        - start < 0.05)
+        self.loop.run_until_complete(
+            self.asyncio.wait(futures, loop=self.loop))
+        self.assertEqual(order, [0, 1, 2, 3])
+
+    def test_errors_reach_the_caller(self):
+        a = gdata_array.AsyncWorksheet(self.worksheet(), loop=self.loop)
+        failed = a.run(int, 'x')
+        after = a.run(int, '2')
+        self.assertRaises(ValueError, self.loop.run_until_complete, failed)
+        self.assertEqual(self.loop.run_until_complete(after), 2)
+
+    def test_rows_need_loading(self):
+        a = gdata_array.AsyncWorksheet(self.worksheet(page_rows=2), 
+                                       loop=self.loop)
+        self.assertRaises(ValueError, len, a)
+        self.loop.run_until_complete(a.load())
+        self.assertRaises(ValueError, a.__getitem__, 0)
+        self.loop.run_until_complete(a.load_all())
+        requests = sum(self.svc.requests.values())
+        self.assertEqual([list(row) for row in a], self.rows[1:])
+        self.assertEqual(sum(self.svc.requests.values()), requests)
+
+######################################################################
+class DeleteRowsTest(FakeServiceTest):
+    def test_cells_moved_up(self):
+        ws = self.worksheet()
+        row = ws[2]
+        self.assertEqual(ws.delete_rows([0]), 1)
+        self.assertEqual(self.svc.requests['DeleteRow'], 0)
+        self.assertEqual(self.remote_rows(), [self.rows[0]] + self.rows[2:])
+        self.assertEqual(self.sheet.row_count, 9)
+        self.assertEqual(ws.rows, self.rows[2:])
+        self.assertEqual((row.row, row['Name']), (3, 'c'))
+
+    def test_formulas_deleted_through_list_feed(self):
+        self.sheet.set(4, 2, '=B3*2')
+        ws = self.worksheet()
+        ws.delete_rows(lambda row: row['Name'] == 'a')
+        self.assertEqual(self.svc.requests['DeleteRow'], 1)
+        self.assertEqual(self.svc.requests['ExecuteBatch'], 0)
+        self.assertEqual(self.remote_rows(), 
+                         [self.rows[0], ['b', '2'], ['c', '=B3*2']])
+        self.assertEqual(ws.rows, [['b', '2'], ['c', '=B3*2']])
+
+    def test_formula_above_deleted_rows(self):
+        self.sheet.set(2, 3, '=B4')
+        ws = self.worksheet()
+        ws.delete_rows([1])
+        self.assertEqual(self.svc.requests['DeleteRow'], 1)
+        self.assertEqual(self.svc.requests['ExecuteBatch'], 0)
+        self.assertEqual(ws.rows, [['a', '1', '=B4'], ['c', '3']])
+
+    def test_formulas_unreachable(self):
+        self.sheet.set(1, 3, '=A1')
+        self.sheet.set(3, 1, None)
+        self.sheet.set(3, 2, None)
+        ws = self.worksheet()
+        self.assertRaises(ValueError, ws.delete_rows, [2])
+        self.assertEqual(sum(self.svc.requests.values()),
+                         self.svc.requests['GetWorksheetsFeed'] +
+                         self.svc.requests['GetCellsFeed'])
+        self.assertEqual(self.remote_rows()[3], ['c', '3'])
+
+    def test_failed_moves_reload(self):
+        ws = self.worksheet()
+        def fail(*args, **kwargs):
+            raise gdata.service.RequestError({
+                    'status': 400, 'reason': 'Bad Request', 'body': ''})
+        self.svc.ExecuteBatch = fail
+        self.assertRaises(gdata.service.RequestError, ws.delete_rows, [0])
+        self.assertEqual(ws.rows, self.rows[1:])
+        self.assertFalse(ws._pending)
+        self.assertEqual(self.sheet.row_count, 10)
+
+######################################################################
+class ToNumpyTest(FakeServiceTest):
+    rows = [['Name', 'Value'], ['alpha', '1.5'], [None, '2'], 
+            ['gamma ray', 'x']]
+
+    def setUp(self):
+        FakeServiceTest.setUp(self)
+        self.numpy = gdata_array.import_module('numpy')
+        if (self.numpy == None): self.skipTest('numpy is not installed')
+
+    def test_numbers(self):
+        array = self.worksheet().to_numpy()
+        self.assertEqual(array[:,1].tolist(), [1.5, 2.0, None])
+        self.assertEqual(array[:,0].mask.tolist(), [True, True, True])
+
+    def test_strings_whole(self):
+        ws = self.worksheet()
+        for dtype in (str, unicode, object):
+            array = ws.to_numpy(dtype=dtype)
+            self.assertEqual(array[:,0].tolist(), ['alpha', None, 'gamma ray'])
+            self.assertEqual(array[:,1].tolist(), ['1.5', '2', 'x'])
+
+######################################################################
+class WriteList(list):
+    """
+    A file that keeps each write as an item.
+    """
+    def write(self, data):
+        self.append(data)
+
+class ExportTest(FakeServiceTest):
+    rows = [['2019', 'Status'], ['a', '1'], ['b', '2'], ['c', '3']]
+
+    def test_csv_buffered_rows(self):
+        gdata_array.export_buffer_rows = 2
+        f = WriteList()
+        self.worksheet().write_csv(f)
+        self.assertEqual(f, ['2019,Status\r\na,1\r\nb,2\r\n', 'c,3\r\n'])
+
+    def test_xml_tags_valid(self):
+        f = WriteList()
+        self.worksheet().write_xml(f)
+        root = xml.etree.cElementTree.fromstring(''.join(f))
+        self.assertEqual([elem.tag for elem in root[0]], ['_2019', 'Status'])
+        self.assertEqual(root[2].findtext('_2019'), 'c')
+
+######################################################################
+class CreateWorksheetTest(FakeServiceTest):
+    def test_default_title_unused(self):
+        self.svc.add_worksheet('test', 'Sheet3', [['x']])
+        ws = gdata_array.create_worksheet('test', [['H'], ['1']])
+        self.assertEqual(ws.title, 'Sheet2')
+        ws = gdata_array.create_worksheet('test', [['H'], ['2']])
+        self.assertEqual(ws.title, 'Sheet4')
+        self.assertEqual(gdata_array.worksheet('test', title='Sheet4')[0], 
+                         ['2'])
+
+######################################################################
+class HTTPClient(gdata.spreadsheet.service.SpreadsheetsService):
+    """
+    A gdata client whose HTTP requests all get the same response body.
+    """
+    def __init__(self, body):
+        gdata.spreadsheet.service.SpreadsheetsService.__init__(self)
+        self.body = body
+
+    def request(self, operation, url, data=None, headers=None, 
+                url_params=None):
+        return Response(200, self.body)
+
+class MetricsTest(FakeServiceTest):
+    def record_calls(self, func, *args):
+        calls = []
+        gdata_array.add_metrics_hook(calls.append)
+        try:
+            func(*args)
+        finally:
+            gdata_array.remove_metrics_hook(calls.append)
+        return calls
+
+    def test_bytes_from_http_responses(self):
+        xml_string = self.svc.get_cells_xml('test', self.sheet.wksht_id)
+        client = HTTPClient(xml_string)
+        gdata_array.service_factory = lambda: client
+        uri = gdata_array.cells_feed_url('test', self.sheet.wksht_id)
+        for func, args in ((gdata_array.GetCellsFeed, ('test', 'od6')), 
+                           (gdata_array.GetCellsValues, (uri,))):
+            calls = self.record_calls(func, *args)
+            self.assertEqual([call['bytes'] for call in calls], 
+                             [len(xml_string)])
+            self.assertTrue(calls[0]['seconds'] >= 0)
+        self.assertFalse('request' in client.__dict__)
+
+    def test_bytes_unmeasured(self):
+        calls = self.record_calls(self.worksheet().load_data)
+        self.assertEqual([(call['operation'], call['bytes']) 
+                          for call in calls], 
+                         [('GetCellsFeed', None)])
+
+######################################################################
+class SyncTest(FakeServiceTest):
+    def test_no_changes(self):
+        ws = self.worksheet()
+        self.assertEqual(ws.sync(self.rows), 0)
+        self.assertEqual(self.svc.requests['ExecuteBatch'], 0)
+
+    def test_changes(self):
+        ws = self.worksheet()
+        rows = [self.rows[0], ['a', '1'], ['b', 'x'], ['c', '3'], ['d']]
+        self.assertEqual(ws.sync(rows), 2)
+        self.assertEqual(self.remote_rows(), rows)
+        self.assertEqual(ws.rows, rows[1:])
+
+    def test_delete_through_list_feed(self):
+        gdata_array.batch_size = 2
+        ws = self.worksheet()
+        ws.sync([self.rows[0]] + self.rows[2:])
+        self.assertEqual(self.svc.requests['DeleteRow'], 1)
+        self.assertEqual(self.svc.requests['ExecuteBatch'], 0)
+        self.assertEqual(self.remote_rows(), [self.rows[0]] + self.rows[2:])
+        self.assertEqual(ws.rows, self.rows[2:])
+
+    def test_blank_rows_make_list_feed_dearer(self):
+        gdata_array.batch_size = 2
+        self.sheet.rows.extend([[], [], [], ['d', '4']])
+        self.sheet.row_ids.extend([11, 12, 13, 14])
+        ws = self.worksheet()
+        rows = [self.rows[0]] + self.rows[2:] + [[], [], [], ['d', '4']]
+        ws.sync(rows)
+        self.assertEqual(self.svc.requests['DeleteRow'], 0)
+        self.assertEqual(self.svc.requests['UpdateCell'], 0)
+        self.assertEqual(self.remote_rows(), rows)
+
+    def test_empty_without_headers(self):
+        ws = self.worksheet(nheaders=0)
+        ws.sync([])
+        self.assertEqual(self.remote_rows(), [])
+        self.assertEqual(len(ws), 0)
+
+######################################################################
+class IterRowsTest(FakeServiceTest):
+    rows = [['Name', 'Status'], ['a', '1'], [], ['b', '2'], ['c', '3']]
+
+    def test_windows(self):
+        ws = self.worksheet()
+        stream = ws.iter_rows(chunk_rows=3)
+        rows = [list(row) for row in stream]
+        self.assertEqual(rows, self.rows[1:])
+        # The header row, then rows 2-4, 5-7 and 8-10
+        self.assertEqual(self.svc.requests['GetCellsFeed'], 4)
+        self.assertFalse(ws.has_data())
+        self.assertEqual(rows, [list(row) for row in self.worksheet()])
+
+    def test_rows_read_only(self):
+        rows = list(self.worksheet().iter_rows(chunk_rows=2))
+        self.assertEqual([row['Status'] for row in rows], 
+                         ['1', None, '2', '3'])
+        self.assertEqual(rows[2].row, 4)
+        self.assertRaises(TypeError, rows[0].__setitem__, 'Status', 'x')
+        self.assertRaises(TypeError, rows[0].delete)
+
+    def test_column_range(self):
+        stream = self.worksheet().iter_rows()
+        stream.cols = slice(1, 2)
+        self.assertEqual([list(row) for row in stream], 
+                         [[None, '1'], [], [None, '2'], [None, '3']])
+        self.assertEqual(stream.headers, ['Name', 'Status'])
+
+    def test_loaded_rows_used(self):
+        ws = self.worksheet()
+        ws.load_data()
+        requests = sum(self.svc.requests.values())
+        rows = list(ws.iter_rows())
+        self.assertTrue(rows[0] is ws[0])
+        self.assertEqual(sum(self.svc.requests.values()), requests)
+
+######################################################################
+class SelectTest(FakeServiceTest):
+    rows = [['Name', 'Status'], ['a', '1'], ['b', '2'], ['c', '2']]
+
+    def test_loaded(self):
+        ws = self.worksheet()
+        ws.load_data()
+        requests = sum(self.svc.requests.values())
+        selection = ws.select({'Status': '2'})
+        self.assertEqual(selection, self.rows[2:])
+        self.assertTrue(selection[0] is ws[1])
+        self.assertEqual(sum(self.svc.requests.values()), requests)
+
+    def test_list_feed_query(self):
+        selection = self.worksheet().select({'Status': 2}, columns=['Name'])
+        self.assertEqual(selection, [['b'], ['c']])
+        self.assertEqual(self.svc.requests['GetListFeed'], 2)
+
+    def test_data_after_blank_row(self):
+        self.sheet.rows.insert(2, [])
+        self.sheet.row_ids.insert(2, 99)
+        selection = self.worksheet().select({'Status': '2'}, 
+                                            columns=['Name'])
+        self.assertEqual(selection, [['b'], ['c']])
+        self.assertEqual(self.svc.requests['GetListFeed'], 1)
+
+    def test_function(self):
+        selection = self.worksheet().select(lambda row: row['Name'] > 'a')
+        self.assertEqual(selection, self.rows[2:])
+
+######################################################################
+class ReloadTest(FakeServiceTest):
+    def test_incremental(self):
+        ws = self.worksheet()
+        row = ws[0]
+        self.sheet.set(2, 2, 'x')
+        self.sheet.set(3, 1, None)
+        self.sheet.set(5, 1, 'd')
+        entries = []
+        get_cells_feed = self.svc.get_cells_feed
+        def record(key, ws, query):
+            feed = get_cells_feed(key, ws, query)
+            entries.append(len(feed.entry))
+            return feed
+        self.svc.get_cells_feed = record
+        changes = ws.reload(incremental=True)
+        self.assertEqual(entries, [3])
+        self.assertEqual(sorted(changes), 
+                         [(2, 2, '1', 'x'), (3, 1, 'b', None), 
+                          (5, 1, None, 'd')])
+        self.assertEqual(ws.rows, [['a', 'x'], [None, '2'], ['c', '3'], ['d']])
+        self.assertEqual(row['Status'], 'x')
+        self.assertEqual(ws.reload(incremental=True), [])
+
+    def test_incremental_drops_cleared_rows(self):
+        ws = self.worksheet()
+        self.sheet.set(4, 1, None)
+        self.sheet.set(4, 2, None)
+        ws.reload(incremental=True)
+        self.assertEqual(ws.rows, self.rows[1:3])
+
+######################################################################
+class Response(object):
+    """
+    An HTTP response of the given status, with a body to read.
+    """
+    def __init__(self, status, body='', location=None):
+        self.status = status
+        self.reason = 'Reason %d' % status
+        self.file = cStringIO.StringIO(body)
+        self.location = location
+
+    def read(self, *args):
+        return self.file.read(*args)
+
+    def getheader(self, name):
+        return (self.location if (name == 'Location') else None)
+
+class ResponseClient(object):
+    """
+    A client answering each request with the next of the responses.
+    """
+    def __init__(self, responses):
+        self.responses = responses
+        self.uris = []
+
+    def request(self, operation, uri, headers=None):
+        self.uris.append(uri)
+        return self.responses.pop(0)
+
+class ParseCellsFeedTest(FakeServiceTest):
+    def test_parse_stream(self):
+        xml_string = self.svc.get_cells_xml('test', self.sheet.wksht_id)
+        feed, values = gdata_array.parse_cells_feed(
+            cStringIO.StringIO(xml_string))
+        self.assertEqual(feed.updated.text, 'v%d' % self.sheet.version)
+        self.assertEqual([(row, col, text) for row,col,text,iv,nv in values],
+                         [(1, 1, 'Name'), (1, 2, 'Status'), (2, 1, 'a'), 
+                          (2, 2, '1'), (3, 1, 'b'), (3, 2, '2'), 
+                          (4, 1, 'c'), (4, 2, '3')])
+        self.assertEqual(gdata_array.parse_cells_feed(xml_string)[1], values)
+
+    def test_stream_get(self):
+        xml_string = self.svc.get_cells_xml('test', self.sheet.wksht_id)
+        client = ResponseClient([Response(302, location='/moved'), 
+                                 Response(200, xml_string)])
+        feed, values = gdata_array.stream_get(
+            client, '/feed', parser=gdata_array.parse_cells_feed)
+        self.assertEqual(client.uris, ['/feed', '/moved'])
+        self.assertEqual(len(values), 8)
+        client = ResponseClient([Response(404, 'missing')])
+        self.assertRaises(gdata.service.RequestError, gdata_array.stream_get,
+                          client, '/feed', parser=gdata_array.parse_cells_feed)
+
+if __name__ == '__main__':
+    unittest.main()